@@ -0,0 +1,165 @@
+"""
+Admission control for agent runs.
+
+At most ADMISSION_MAX_ACTIVE graphs run at once per process. Further runs
+wait in a priority queue (Premium ahead of Free, background work last) for
+at most their tier's queue timeout. When the queue is full or the wait runs
+out, the request is shed straight away with a 503 and a Retry-After, rather
+than piling onto Groq and the upstream APIs and timing out for everyone.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+
+from app.config import settings
+from app.database import SubscriptionTier
+from app.metrics import metrics
+from app.profiling import phase
+
+PRIORITY_PREMIUM = 0
+PRIORITY_FREE = 1
+PRIORITY_BACKGROUND = 2  # Cache warming and other work nobody is waiting on
+
+BUSY_DETAIL = "Cicero is handling a lot of questions right now. Please try again in a few seconds."
+
+
+def priority_for(tier: Optional[SubscriptionTier]) -> int:
+    if tier is None:
+        return PRIORITY_BACKGROUND
+    return PRIORITY_PREMIUM if tier == SubscriptionTier.PREMIUM else PRIORITY_FREE
+
+
+def queue_timeout_for(priority: int) -> float:
+    if priority == PRIORITY_PREMIUM:
+        return settings.ADMISSION_QUEUE_TIMEOUT_PREMIUM
+    if priority == PRIORITY_FREE:
+        return settings.ADMISSION_QUEUE_TIMEOUT_FREE
+    return settings.ADMISSION_QUEUE_TIMEOUT_BACKGROUND
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """Global concurrency limit with a bounded priority queue in front of it"""
+
+    def __init__(self, max_active: int, max_queue: int):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self._active = 0
+        self._queue: List[_Waiter] = []  # Heap; entries whose future is done are stale
+        self._waiting = 0
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, timeout: Optional[float] = None):
+        """Hold one run slot for the duration of the block, or raise a 503 HTTPException"""
+        with phase("admission_wait"):
+            await self._acquire(priority, queue_timeout_for(priority) if timeout is None else timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            metrics.observe("admission.run_seconds", time.monotonic() - start)
+            self._release()
+
+    async def _acquire(self, priority: int, timeout: float):
+        if self._active < self.max_active and self._waiting == 0:
+            self._active += 1
+            self._report(wait=0.0)
+            return
+
+        if self._waiting >= self.max_queue and not self._evict_worse_than(priority):
+            metrics.incr("admission.shed_queue_full")
+            raise self._busy()
+
+        waiter = _Waiter(priority, next(self._seq))
+        heapq.heappush(self._queue, waiter)
+        self._waiting += 1
+        self._report()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            metrics.incr("admission.shed_deadline")
+            raise self._busy()
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        # waiter.future's result is False when a higher-priority arrival took our place
+        if not waiter.future.result():
+            metrics.incr("admission.evicted")
+            raise self._busy()
+        self._report(wait=time.monotonic() - waiter.enqueued_at)
+
+    def _abandon(self, waiter: _Waiter):
+        if waiter.future.done():
+            if waiter.future.result():
+                # Granted a slot just as we gave up: hand it on
+                self._release()
+            return
+        waiter.future.set_result(False)
+        self._waiting -= 1
+        self._report()
+
+    def _evict_worse_than(self, priority: int) -> bool:
+        """Full queue: drop the newest lowest-priority waiter if it ranks below `priority`"""
+        live = [w for w in self._queue if not w.future.done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda w: (w.priority, w.seq))
+        if worst.priority <= priority:
+            return False
+        worst.future.set_result(False)
+        self._waiting -= 1
+        return True
+
+    def _release(self):
+        self._active -= 1
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if waiter.future.done():
+                continue  # Timed out, cancelled or evicted
+            self._active += 1
+            self._waiting -= 1
+            waiter.future.set_result(True)
+            break
+        self._report()
+
+    def _busy(self) -> HTTPException:
+        # Rough time for the queue ahead to drain, from recent run durations
+        typical_run = metrics.percentile("admission.run_seconds", 50) or 5.0
+        retry_after = max(1, round(typical_run * (self._waiting + 1) / self.max_active))
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=BUSY_DETAIL,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def _report(self, wait: Optional[float] = None):
+        metrics.set_gauge("admission.active", self._active)
+        metrics.set_gauge("admission.queue_depth", self._waiting)
+        if wait is not None:
+            metrics.incr("admission.admitted")
+            metrics.observe("admission.wait_seconds", wait)
+
+
+admission = AdmissionController(
+    max_active=settings.ADMISSION_MAX_ACTIVE,
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+)
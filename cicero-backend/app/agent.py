@@ -1,12 +1,21 @@
 from typing import TypedDict, List, Annotated
+import asyncio
+import logging
 import re
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langchain_groq import ChatGroq
 from langchain_core.messages import SystemMessage, BaseMessage, ToolMessage, AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
 from pydantic import SecretStr
 from app.config import settings
+from app.deadline import should_wrap_up, timeout_for, SKIPPED_TOOL_RESULT
+from app.llm_cache import get_llm_cache
+from app.profiling import phase, profiled
 from app.tools.legal_search import search_case_law, search_statutes
+from app.tools.document_search import search_documents
+
+logger = logging.getLogger(__name__)
 
 # 1. Define the State
 class AgentState(TypedDict):
@@ -17,23 +26,57 @@ class AgentState(TypedDict):
 
 # 2. Setup the "Brain" (Groq)
 # We use Llama 3 on Groq because it is excellent at following tool-use instructions.
-llm = ChatGroq(
-    temperature=0, model=settings.GROQ_MODEL, api_key=SecretStr(settings.GROQ_API_KEY)
-)
+# The client is created on first use (or by app.startup during the lifespan) so
+# importing this module stays cheap.
+tools = [search_case_law, search_statutes] + ([search_documents] if settings.USE_RAG else [])
+_llm = None
+_llm_with_tools = None
+
+
+def get_llm() -> ChatGroq:
+    global _llm
+    if _llm is None:
+        # temperature=0 makes identical calls deterministic, so they're answered from
+        # the cache; bind_tools() shares it (bound tools are part of the cache key)
+        _llm = ChatGroq(
+            temperature=0, model=settings.GROQ_MODEL, api_key=SecretStr(settings.GROQ_API_KEY),
+            cache=get_llm_cache() or False,
+        )
+    return _llm
+
+
+def get_llm_with_tools():
+    """The LLM with the legal tools bound, so it knows they exist"""
+    global _llm_with_tools
+    if _llm_with_tools is None:
+        _llm_with_tools = get_llm().bind_tools(tools)
+    return _llm_with_tools
+
 
-# Bind the tools to the LLM so it knows they exist
-tools = [search_case_law, search_statutes]
-llm_with_tools = llm.bind_tools(tools)
+# Appended to the system prompt when the document library is enabled
+DOCUMENT_SEARCH_INSTRUCTIONS = """
+
+- search_documents: Cicero's own library of landmark case summaries (e.g. Miranda v. Arizona). It answers in milliseconds, so try it first for well-known cases and core legal concepts, and cite the case it returns."""
+
+
+# Appended to the system prompt once the request deadline is close
+WRAP_UP_INSTRUCTIONS = """
+
+TIME IS UP: Do not call any tools. Answer the user now using only the search results above and your general legal knowledge."""
 
 
 # 3. Define the Nodes
-async def reasoner(state: AgentState):
+@profiled("node:agent")
+async def reasoner(state: AgentState, config: RunnableConfig = None):
     """
     The reasoning node. This is where Cicero 'thinks'.
     He looks at the conversation and decides if he needs to search the law.
     """
     messages = state["messages"].copy()  # Work with a copy to avoid mutating state
     user_state = state.get("user_state", "US")
+    # Close to the deadline: no more tools, just synthesize from what we have
+    wrap_up = should_wrap_up(config)
+    tool_names = ", ".join(t.name for t in tools)
 
     base_system_content = f"""You are Cicero, a warm and empathetic legal companion who helps people understand the law.
 
@@ -46,7 +89,7 @@ PERSONA:
 - You use helpful analogies and metaphors
 
 TOOL USAGE GUIDELINES:
-- You have tools available: search_case_law, search_statutes.
+- You have tools available: {tool_names}.
 - Use tools when you need specific, current, or state-specific information.
 - For well-established legal concepts (Miranda rights, police stop rights, etc.), you can answer from your knowledge without tools.
 - When searching statutes, ALWAYS use state="{user_state}" for the user's state.
@@ -82,6 +125,10 @@ RESPONSE STYLE:
 - Only mention limitations if the information is truly unavailable or uncertain
 - If something fails, say "I'm having some trouble finding that information" - never show errors"""
 
+    if settings.USE_RAG:
+        base_system_content += DOCUMENT_SEARCH_INSTRUCTIONS
+    if wrap_up:
+        base_system_content += WRAP_UP_INSTRUCTIONS
     system_prompt = SystemMessage(content=base_system_content)
 
     # Ensure system prompt is always the first message
@@ -92,11 +139,15 @@ RESPONSE STYLE:
         messages[0] = system_prompt
 
     try:
-        response = await llm_with_tools.ainvoke(messages)
+        llm = get_llm() if wrap_up else get_llm_with_tools()
+        with phase("llm"):
+            response = await asyncio.wait_for(
+                llm.ainvoke(messages), timeout_for(settings.LLM_TIMEOUT_SECONDS, config)
+            )
         
         # Check if the response contains malformed XML-style function calls
         # and convert to a regular response if so
-        if hasattr(response, 'content') and response.content:
+        if hasattr(response, 'content') and response.content and not wrap_up:
             content = str(response.content)  # Ensure it's a string
             if '<function=' in content or '</function>' in content:
                 # The model tried to use XML-style function syntax
@@ -107,7 +158,7 @@ RESPONSE STYLE:
         return {"messages": [response]}
     except Exception as e:
         error_str = str(e)
-        print(f"Error in reasoner: {e}")
+        logger.warning("Error in reasoner: %r", e)
         
         # Check if this is a failed tool call with XML-style syntax
         if 'failed_generation' in error_str and '<function=' in error_str:
@@ -123,7 +174,7 @@ RESPONSE STYLE:
                     if response:
                         return {"messages": [response]}
             except Exception as parse_err:
-                print(f"Error parsing failed_generation: {parse_err}")
+                logger.warning("Error parsing failed_generation: %s", parse_err)
         
         # Return a helpful error message instead of crashing
         error_msg = AIMessage(
@@ -153,30 +204,32 @@ async def handle_xml_tool_call(content: str, messages: list, user_state: str = "
         # Use user's state as default if not specified in the tool call
         if 'state' not in args and tool_name == 'search_statutes':
             args['state'] = user_state
-            print(f"--- Using user's state setting: {user_state} ---")
+            logger.debug("Using user's state setting: %s", user_state)
         
         # Execute the tool directly using arun
-        print(f"--- Manually executing {tool_name} with args: {args} ---")
+        logger.debug("Manually executing %s with args: %s", tool_name, args)
         if tool_name == 'search_case_law':
             result = await search_case_law.arun(tool_input=args)
         elif tool_name == 'search_statutes':
             result = await search_statutes.arun(tool_input=args)
+        elif tool_name == 'search_documents' and settings.USE_RAG:
+            result = await search_documents.arun(tool_input=args)
         else:
             result = "I couldn't find specific information on that topic."
         
-        print(f"--- Tool result (first 200 chars): {str(result)[:200]} ---")
+        logger.debug("Tool result (first 200 chars): %s", str(result)[:200])
         
         # Now ask the LLM to synthesize the result (without tools to avoid loop)
         synth_messages = messages + [
             AIMessage(content=f"I searched for information about '{query}' in {user_state} and found:\n\n{result}"),
             HumanMessage(content="Please summarize this information in a helpful, friendly way for the user. Do not include any tool call text or instructions—just give the answer plainly.")
         ]
-        synth_response = await llm.ainvoke(synth_messages)
+        synth_response = await asyncio.wait_for(
+            get_llm().ainvoke(synth_messages), timeout_for(settings.LLM_TIMEOUT_SECONDS)
+        )
         return synth_response
     except Exception as parse_error:
-        print(f"Error parsing/executing tool call: {parse_error}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error parsing/executing tool call: %s", parse_error)
         return None
 
 
@@ -201,7 +254,8 @@ def _check_result_relevance(query: str, result: str) -> bool:
     return True  # If no meaningful terms, don't filter
 
 
-async def tool_executor(state: AgentState):
+@profiled("node:tools")
+async def tool_executor(state: AgentState, config: RunnableConfig = None):
     """
     The action node. This executes the tools Cicero asked for.
     """
@@ -209,8 +263,20 @@ async def tool_executor(state: AgentState):
     
     # Check if the message has tool_calls attribute
     if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
-        print("--- Warning: No tool calls found in last message ---")
+        logger.warning("No tool calls found in last message")
         return {"messages": []}
+
+    if should_wrap_up(config):
+        # Every tool call still needs a reply before the model can answer
+        logger.info("Out of time: skipping tool calls")
+        return {"messages": [
+            ToolMessage(
+                tool_call_id=str(call.get("id") or "unknown"),
+                name=str(call.get("name") or "unknown"),
+                content=SKIPPED_TOOL_RESULT,
+            )
+            for call in last_message.tool_calls
+        ]}
     
     # Get the original user query for relevance checking
     user_query = ""
@@ -232,7 +298,7 @@ async def tool_executor(state: AgentState):
     tool_calls = last_message.tool_calls
     results: list[tuple[str, str, str]] = []
 
-    print(f"--- Cicero is using tools: {len(tool_calls)} calls ---")
+    logger.debug("Cicero is using tools: %d calls", len(tool_calls))
 
     for call in tool_calls:
         try:
@@ -259,7 +325,7 @@ async def tool_executor(state: AgentState):
                     "corporate requirements", "business license", "business name"
                 ]
                 if any(concept in query_lower for concept in established_concepts):
-                    print(f"--- ERROR: search_statutes called for established legal concept. Redirecting to search_case_law ---")
+                    logger.info("search_statutes called for established legal concept. Redirecting to search_case_law")
                     # Redirect to search_case_law instead
                     tool_name = "search_case_law"
                     # Update tool_args if needed
@@ -267,25 +333,31 @@ async def tool_executor(state: AgentState):
                         tool_args["jurisdiction"] = tool_args.pop("state")
             
             if tool_name == "search_case_law":
-                res = await search_case_law.ainvoke(tool_args)
+                with phase("tool:search_case_law"):
+                    res = await search_case_law.ainvoke(tool_args)
                 # Check relevance
                 if user_query and not _check_result_relevance(user_query, str(res)):
-                    print(f"--- Warning: search_case_law result may not be relevant to query ---")
+                    logger.debug("search_case_law result may not be relevant to query")
                     res = f"Note: The search results may not be directly relevant to your question. {res}"
                 results.append((tool_id, res, tool_name))
             elif tool_name == "search_statutes":
-                res = await search_statutes.ainvoke(tool_args)
+                with phase("tool:search_statutes"):
+                    res = await search_statutes.ainvoke(tool_args)
                 # Check relevance - statutes tool is more prone to irrelevant results
                 if user_query and not _check_result_relevance(user_query, str(res)):
-                    print(f"--- Warning: search_statutes result may not be relevant to query ---")
+                    logger.debug("search_statutes result may not be relevant to query")
                     res = f"Note: This result may not be directly relevant to your question. The search_statutes tool finds recent bills, not established legal concepts. For questions about established laws like 'statute of limitations', try search_case_law instead. {res}"
                 results.append((tool_id, res, tool_name))
+            elif tool_name == "search_documents" and settings.USE_RAG:
+                with phase("tool:search_documents"):
+                    res = await search_documents.ainvoke(tool_args)
+                results.append((tool_id, res, tool_name))
             else:
-                print(f"Unknown tool called: {tool_name}")
+                logger.warning("Unknown tool called: %s", tool_name)
                 tool_name_str = str(tool_name) if tool_name is not None else "unknown"
                 results.append((tool_id, f"Error: Tool '{tool_name_str}' is not available.", tool_name_str))
         except Exception as e:
-            print(f"Error executing tool call: {e}")
+            logger.exception("Error executing tool call: %s", e)
             tool_id = call.get("id") if isinstance(call, dict) else getattr(call, "id", "unknown")
             tool_id = str(tool_id) if tool_id is not None else "unknown"
             # Get tool_name from the call if available
@@ -302,13 +374,6 @@ async def tool_executor(state: AgentState):
 
 
 # 4. Build the Graph
-workflow = StateGraph(AgentState)
-workflow.add_node("agent", reasoner)
-workflow.add_node("tools", tool_executor)
-
-workflow.set_entry_point("agent")
-
-
 # Conditional Logic: Does Cicero want to use a tool?
 def should_continue(state: AgentState):
     last_message = state["messages"][-1]
@@ -318,7 +383,21 @@ def should_continue(state: AgentState):
     return END
 
 
-workflow.add_conditional_edges("agent", should_continue)
-workflow.add_edge("tools", "agent")  # Loop back to agent to synthesize answer
+_app_graph = None
+
+
+def get_app_graph():
+    """Compile the agent graph on first use"""
+    global _app_graph
+    if _app_graph is None:
+        workflow = StateGraph(AgentState)
+        workflow.add_node("agent", reasoner)
+        workflow.add_node("tools", tool_executor)
+
+        workflow.set_entry_point("agent")
+
+        workflow.add_conditional_edges("agent", should_continue)
+        workflow.add_edge("tools", "agent")  # Loop back to agent to synthesize answer
 
-app_graph = workflow.compile()
+        _app_graph = workflow.compile()
+    return _app_graph
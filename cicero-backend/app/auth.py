@@ -1,12 +1,21 @@
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status, Request, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth, credentials, initialize_app
-from sqlalchemy.orm import Session
+from sqlalchemy import case, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db, User, SubscriptionTier
 from app.config import settings
+from app.cache import TTLCache
+from app.profiling import profiled
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import hmac
 import json
+import logging
 import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 # Initialize Firebase Admin SDK (lazy initialization)
 _firebase_initialized = False
@@ -20,6 +29,9 @@ def _initialize_firebase():
     if not settings.FIREBASE_CREDENTIALS:
         raise ValueError("FIREBASE_CREDENTIALS environment variable is required")
 
+    # firebase_admin is slow to import; only pay for it once it is actually needed
+    from firebase_admin import credentials, initialize_app
+
     try:
         # Try to parse as JSON string first
         firebase_creds = json.loads(settings.FIREBASE_CREDENTIALS)
@@ -40,14 +52,55 @@ def _initialize_firebase():
 
 security = HTTPBearer()
 
+FREE_DAILY_QUERY_LIMIT = 5
+
+# Verified tokens keyed by SHA-256 of the raw token, each kept until its own `exp`
+_token_cache = TTLCache(max_size=settings.FIREBASE_TOKEN_CACHE_SIZE)
+
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _prefetch_public_keys():
+    """Fetch Google's ID-token signing certificates into the SDK's HTTP cache"""
+    _initialize_firebase()
+    from firebase_admin import auth, _token_gen
+
+    # verify_id_token() reads the certificates through this cache-control aware
+    # request object, so warming it keeps key refreshes off the request path.
+    verifier = auth._get_client(None)._token_verifier
+    verifier.request(_token_gen.ID_TOKEN_CERT_URI, method="GET")
+
+
+def _verify_id_token(token: str) -> dict:
+    _initialize_firebase()  # Ensure Firebase is initialized
+    from firebase_admin import auth
+    return auth.verify_id_token(token)
+
+
+async def refresh_public_keys_forever():
+    """Background task: prefetch signing keys now and refresh them periodically"""
+    while True:
+        try:
+            await asyncio.to_thread(_prefetch_public_keys)
+        except Exception as e:
+            logger.warning("Error prefetching Firebase public keys: %s", e)
+        await asyncio.sleep(settings.FIREBASE_KEY_REFRESH_SECONDS)
 
+
+@profiled("auth:firebase")
 async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """Verify Firebase ID token and return decoded token"""
-    _initialize_firebase()  # Ensure Firebase is initialized
-    try:
-        token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+    token = credentials.credentials
+    cache_key = _token_cache_key(token)
+    decoded_token = _token_cache.get(cache_key)
+    if decoded_token is not None:
         return decoded_token
+
+    try:
+        # Signature checks (and any certificate refresh) are blocking; keep them off the loop
+        decoded_token = await asyncio.to_thread(_verify_id_token, token)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,11 +108,37 @@ async def verify_firebase_token(credentials: HTTPAuthorizationCredentials = Depe
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    expires_at = decoded_token.get("exp")
+    if expires_at:
+        _token_cache.set(cache_key, decoded_token, expires_at=float(expires_at))
+    return decoded_token
+
+
+# User rows keyed by firebase_uid. Writers invalidate explicitly; the TTL bounds
+# how stale another worker process's copy can get.
+_user_cache = TTLCache(max_size=settings.USER_CACHE_SIZE, default_ttl=settings.USER_CACHE_TTL_SECONDS)
+_USER_CACHE_FIELDS = (
+    "id", "email", "firebase_uid", "subscription_tier", "queries_today", "queries_reset_date",
+    "stripe_customer_id", "stripe_subscription_id", "created_at", "updated_at",
+)
 
+
+def _cache_user(user: User) -> dict:
+    snapshot = {field: getattr(user, field) for field in _USER_CACHE_FIELDS}
+    _user_cache.set(user.firebase_uid, snapshot)
+    return snapshot
+
+
+def invalidate_user(firebase_uid: str):
+    """Drop a cached user record after its row changed"""
+    _user_cache.pop(firebase_uid)
+
+
+@profiled("auth:user")
 async def get_current_user(
     request: Request,
     decoded_token: dict = Depends(verify_firebase_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     """Get or create user from Firebase token"""
     firebase_uid = decoded_token.get("uid")
@@ -71,8 +150,15 @@ async def get_current_user(
             detail="Invalid token: missing uid or email"
         )
     
+    cached = _user_cache.get(firebase_uid)
+    if cached is not None and cached["email"] == email:
+        user = User(**cached)
+        request.state.user_id = user.id
+        return user
+
     # Get or create user
-    user = db.query(User).filter(User.firebase_uid == firebase_uid).first()
+    result = await db.execute(select(User).where(User.firebase_uid == firebase_uid))
+    user = result.scalars().first()
     
     if not user:
         # Create new user
@@ -84,13 +170,17 @@ async def get_current_user(
             queries_reset_date=datetime.utcnow()
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
     else:
         # Update email if changed
         if user.email != email:
             user.email = email
-            db.commit()
+            await db.commit()
+
+    # Always hand out a detached copy so cached and fresh users behave the same:
+    # callers write through UPDATE statements, never attribute changes + commit.
+    user = User(**_cache_user(user))
     
     # Set user_id in request state for rate limiting
     request.state.user_id = user.id
@@ -98,27 +188,75 @@ async def get_current_user(
     return user
 
 
-def check_usage_limit(user: User, db: Session) -> bool:
-    """Check if user can make a query based on subscription tier and usage"""
+@profiled("usage_gate")
+async def reserve_query(user: User, db: AsyncSession, count: int = 1) -> bool:
+    """Atomically reset-if-new-day, check the tier limit and take `count` queries.
+
+    A single conditional UPDATE does all three, so concurrent requests cannot
+    race past the FREE limit and the gate costs one commit. Returns False when
+    the user is over their limit.
+    """
     now = datetime.utcnow()
-    
-    # Reset daily count if needed
-    if user.queries_reset_date.date() < now.date():
-        user.queries_today = 0
-        user.queries_reset_date = now
-        db.commit()
-    
-    # Check limits based on subscription tier
-    if user.subscription_tier == SubscriptionTier.FREE:
-        if user.queries_today >= 5:
-            return False
-    
-    # Premium tier has no limits
+    today_start = datetime(now.year, now.month, now.day)
+    new_day = User.queries_reset_date < today_start
+
+    allowed = [User.subscription_tier == SubscriptionTier.PREMIUM, User.queries_today + count <= FREE_DAILY_QUERY_LIMIT]
+    if count <= FREE_DAILY_QUERY_LIMIT:
+        allowed.append(new_day)
+
+    # SET expressions see the row as it was before the update, so both CASEs agree
+    stmt = (
+        update(User)
+        .where(User.id == user.id, or_(*allowed))
+        .values(
+            queries_today=case((new_day, count), else_=User.queries_today + count),
+            queries_reset_date=case((new_day, now), else_=User.queries_reset_date),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    if db.bind.dialect.update_returning:
+        result = await db.execute(stmt.returning(User.queries_today))
+        queries_today = result.scalar_one_or_none()
+    else:
+        # Older SQLite builds: no UPDATE ... RETURNING, read the counter back in the same transaction
+        result = await db.execute(stmt)
+        queries_today = None
+        if result.rowcount:
+            queries_today = (await db.execute(select(User.queries_today).where(User.id == user.id))).scalar_one()
+    await db.commit()
+
+    if queries_today is None:
+        return False
+    invalidate_user(user.firebase_uid)
+    user.queries_today = queries_today
     return True
 
 
-def increment_usage(user: User, db: Session):
-    """Increment user's query count"""
-    user.queries_today += 1
-    db.commit()
+async def release_query(user: User, db: AsyncSession, count: int = 1):
+    """Refund queries taken by reserve_query when the request produced no answer"""
+    now = datetime.utcnow()
+    today_start = datetime(now.year, now.month, now.day)
+    await db.execute(
+        update(User)
+        .where(
+            User.id == user.id,
+            User.queries_today >= count,
+            # A reservation made before midnight was already wiped by the daily reset
+            User.queries_reset_date >= today_start,
+        )
+        .values(queries_today=User.queries_today - count)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    invalidate_user(user.firebase_uid)
+    user.queries_today = max(user.queries_today - count, 0)
+
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Gate admin-only endpoints behind the ADMIN_TOKEN shared secret"""
+    if not settings.ADMIN_TOKEN:
+        # Admin surface is disabled entirely unless a token is configured
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
@@ -0,0 +1,273 @@
+"""
+Running chat questions through the agent graph.
+
+Shared by /chat and /chat/batch. Quota, auth and usage logging stay with the
+endpoints; this module only turns ChatRequests into ChatResponses.
+
+Hedging: when the graph has not answered a user's question within the
+CHAT_HEDGE_PERCENTILE of recent graph latencies, a direct case-law search is
+started alongside it. A usable search result that arrives first is the
+answer and the graph is cancelled; otherwise the graph's answer wins and the
+search is dropped (or used as the fallback if the graph's answer is unusable).
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+
+from app import startup
+from app.admission import admission, queue_timeout_for, PRIORITY_BACKGROUND
+from app.citations import cited_sources
+from app.config import settings
+from app.deadline import budget_for, deadline_scope, remaining, SKIPPED_TOOL_RESULT
+from app.metrics import metrics
+from app.models import ChatRequest, ChatResponse
+from app.tools.legal_search import search_case_law, search_scope
+
+logger = logging.getLogger(__name__)
+
+# Extra time past the deadline before a stuck graph is abandoned
+DEADLINE_GRACE_SECONDS = 2.0
+
+FALLBACK_TRIGGERS = [
+    "i'm having trouble",
+    "technical difficulties",
+    "couldn't find",
+    "search_statutes(",
+    "trouble processing",
+]
+
+
+def build_inputs(chat_request: ChatRequest) -> dict:
+    """Convert request history and current message to LangGraph format"""
+    history_messages = []
+    for item in chat_request.history:
+        if isinstance(item, dict) and "role" in item and "content" in item:
+            if item["role"] == "user":
+                history_messages.append(HumanMessage(content=item["content"]))
+            elif item["role"] == "assistant":
+                history_messages.append(AIMessage(content=item["content"]))
+
+    # Include the user's state in the message context
+    user_state = chat_request.state or "US"
+    current_message = HumanMessage(content=f"[User is in {user_state}] {chat_request.message}")
+    return {"messages": history_messages + [current_message], "user_state": user_state}
+
+
+async def answer_chat(
+    chat_request: ChatRequest, priority: int = PRIORITY_BACKGROUND,
+    deadline_seconds: Optional[float] = None, hedge: bool = True,
+) -> Tuple[ChatResponse, bool]:
+    """Run the agent for one question.
+
+    Returns the response and whether it counts as an answer; a False flag
+    (the graph hit its recursion limit) means the caller should refund the
+    query. Other errors propagate, including the 503 HTTPException raised
+    when admission control sheds the run. `deadline_seconds` replaces the
+    priority's budget (background jobs get longer); `hedge=False` never
+    starts a hedged search.
+    """
+    with deadline_scope(deadline_seconds or budget_for(priority)) as deadline:
+        return await _answer_chat(chat_request, priority, deadline, hedge)
+
+
+async def _answer_chat(chat_request: ChatRequest, priority: int, deadline: float, hedge_allowed: bool) -> Tuple[ChatResponse, bool]:
+    inputs = build_inputs(chat_request)
+    user_state = inputs["user_state"]
+    metrics.incr("chat.runs")
+
+    delay = hedge_delay(priority) if hedge_allowed else None
+    started = time.monotonic()
+    # Only runs that could be hedged feed the latency percentile hedging is based on
+    graph = asyncio.create_task(_run_graph(inputs, priority, deadline, record_latency=delay is not None))
+    hedge = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait({graph}, timeout=min(delay, max(remaining(), 0)))
+            if not done and remaining() > 0:
+                metrics.incr("chat.hedge.launched")
+                hedge = asyncio.create_task(_direct_case_search(chat_request.message, user_state))
+            metrics.set_gauge("chat.hedge.rate", metrics.counter("chat.hedge.launched") / metrics.counter("chat.runs"))
+            if hedge is not None:
+                done, _ = await asyncio.wait({graph, hedge}, return_when=asyncio.FIRST_COMPLETED)
+                if graph not in done and _usable_search(hedge.result()):
+                    metrics.incr("chat.hedge.won")
+                    graph.cancel()
+                    # Only a lower bound on the graph's time, but without it the slow runs
+                    # that hedges cut short would vanish from the percentile
+                    metrics.observe("chat.graph_seconds", time.monotonic() - started)
+                    answer = hedge.result()
+                    return ChatResponse(response=answer, citations=await cited_sources(answer), thought_process=[]), True
+        final_state = await graph
+    except BaseException:
+        graph.cancel()
+        if hedge is not None:
+            hedge.cancel()
+        raise
+
+    if final_state is None:
+        # Out of time or recursion limit: a hedged search that found something still answers
+        answer = await _hedge_result(hedge)
+        if _usable_search(answer):
+            metrics.incr("chat.hedge.won")
+            return ChatResponse(response=answer, citations=await cited_sources(answer), thought_process=[]), True
+        return _recursion_limit_response(inputs), False
+
+    # Extract the final response from the AI
+    final_message = final_state["messages"][-1].content
+
+    # Fallback: if the model failed to deliver useful info, run a case-law search directly.
+    msg_lower = str(final_message).lower() if final_message else ""
+    last_tool_content = None
+    for m in reversed(final_state.get("messages", [])):
+        if isinstance(m, ToolMessage) and m.content and m.content != SKIPPED_TOOL_RESULT:
+            last_tool_content = str(m.content)
+            break
+
+    if any(trigger in msg_lower for trigger in FALLBACK_TRIGGERS):
+        if last_tool_content:
+            final_message = last_tool_content
+        elif hedge is not None:
+            # The hedge already started this search
+            final_message = await _hedge_result(hedge) or final_message
+        elif remaining() > 0:
+            final_message = await _direct_case_search(chat_request.message, user_state) or final_message
+    if hedge is not None and not hedge.done():
+        metrics.incr("chat.hedge.cancelled")
+        hedge.cancel()
+
+    # Cases cited in the answer first, then those the searches turned up
+    tool_output = [
+        str(m.content) for m in final_state.get("messages", [])
+        if isinstance(m, ToolMessage) and m.content != SKIPPED_TOOL_RESULT
+    ]
+    citations = await cited_sources(str(final_message), *tool_output)
+
+    return ChatResponse(
+        response=str(final_message),
+        citations=citations,
+        thought_process=[],
+    ), True
+
+
+async def _run_graph(inputs: dict, priority: int, deadline: float, record_latency: bool) -> Optional[dict]:
+    """The graph's final state, or None if it ran out of time or hit its recursion limit"""
+    started = time.monotonic()
+    # Run the agent with recursion limit to prevent infinite loops; the deadline
+    # rides along in the config so every node can size its calls to what is left
+    try:
+        async with admission.slot(priority, timeout=min(queue_timeout_for(priority), remaining())):
+            # Nodes wrap up on their own; this only catches a call that ignored its budget
+            final_state = await asyncio.wait_for(
+                startup.get_app_graph().ainvoke(
+                    inputs,
+                    config={"recursion_limit": 20, "configurable": {"deadline": deadline}}
+                ),
+                max(remaining(), 0) + DEADLINE_GRACE_SECONDS,
+            )
+    except HTTPException:
+        raise
+    except asyncio.TimeoutError:
+        metrics.incr("chat.deadline_exceeded")
+        return None
+    except Exception as graph_error:
+        if "recursion_limit" not in str(graph_error).lower():
+            raise
+        return None
+    if record_latency:
+        metrics.observe("chat.graph_seconds", time.monotonic() - started)
+    return final_state
+
+
+def hedge_delay(priority: int) -> Optional[float]:
+    """Seconds to give the graph before hedging with a direct search, or None for no hedge"""
+    # Background runs (cache warming) exist to run the graph; nobody is waiting on them
+    if not settings.CHAT_HEDGE_ENABLED or priority == PRIORITY_BACKGROUND:
+        return None
+    if metrics.observation_count("chat.graph_seconds") < settings.CHAT_HEDGE_MIN_SAMPLES:
+        return settings.CHAT_HEDGE_DEFAULT_SECONDS
+    observed = metrics.percentile("chat.graph_seconds", settings.CHAT_HEDGE_PERCENTILE)
+    return max(observed, settings.CHAT_HEDGE_MIN_SECONDS)
+
+
+async def _direct_case_search(message: str, user_state: str) -> Optional[str]:
+    """search_case_law on the user's own words; None if the search itself failed"""
+    try:
+        return str(await search_case_law.ainvoke({"query": message, "jurisdiction": user_state}))
+    except Exception:
+        return None
+
+
+async def _hedge_result(hedge: Optional[asyncio.Task]) -> Optional[str]:
+    if hedge is None:
+        return None
+    try:
+        return await asyncio.wait_for(hedge, max(remaining(), 0))
+    except asyncio.TimeoutError:
+        return None
+
+
+def _usable_search(result: Optional[str]) -> bool:
+    """A direct search result good enough to answer with"""
+    return bool(result) and not result.startswith(("Error searching cases", "No relevant case law found"))
+
+
+async def answer_batch(
+    chat_requests: List[ChatRequest], concurrency: int, priority: int = PRIORITY_BACKGROUND
+) -> AsyncIterator[Tuple[int, Union[ChatResponse, str], bool]]:
+    """Answer several questions, yielding (index, response, answered) as each finishes.
+
+    At most `concurrency` graphs run at once and all of them share one
+    search scope. A question that failed yields an error message instead of
+    a ChatResponse.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, chat_request: ChatRequest):
+        async with semaphore:
+            try:
+                response, answered = await answer_chat(chat_request, priority)
+                return index, response, answered
+            except HTTPException as e:
+                return index, e.detail, False
+            except Exception as e:
+                logger.exception("Error answering batch question %d", index)
+                return index, "An error occurred processing this question", False
+
+    # Tasks copy the current context, so they all see the same scope
+    with search_scope():
+        tasks = [asyncio.create_task(run(index, r)) for index, r in enumerate(chat_requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Only matters if the consumer stopped early (e.g. a streaming client disconnected)
+        for task in tasks:
+            task.cancel()
+
+
+def _recursion_limit_response(inputs: dict) -> ChatResponse:
+    try:
+        last_ai_message = None
+        for msg in reversed(inputs["messages"]):
+            if isinstance(msg, AIMessage) and not hasattr(msg, "tool_calls"):
+                last_ai_message = msg.content
+                break
+
+        if last_ai_message:
+            return ChatResponse(
+                response=f"{last_ai_message}\n\n(I'm having some trouble finding complete information right now. Please try rephrasing your question.)",
+                citations=[],
+                thought_process=[],
+            )
+    except Exception:
+        pass
+
+    return ChatResponse(
+        response="I'm having trouble processing that request right now. Could you try rephrasing your question or breaking it into smaller parts?",
+        citations=[],
+        thought_process=[],
+    )
@@ -0,0 +1,244 @@
+"""
+Reporter citations in answers, resolved to the cases they name.
+
+Citations such as "384 U.S. 436" are pulled out of the answer and the tool
+results with one precompiled pattern covering the common reporters. The ones
+not already known are resolved together, in a single POST to CourtListener's
+citation-lookup API per response. Results, including citations CourtListener
+does not know, are kept in the citation_cache table and in process memory,
+keyed by normalized citation, so a repeat costs no upstream call at all.
+"""
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.cache import TTLCache
+from app.config import settings
+from app.database import engine, CitationCache
+from app.deadline import timeout_for
+from app.metrics import metrics
+from app.profiling import phase, profiled
+
+logger = logging.getLogger(__name__)
+
+CITATION_LOOKUP_URL = "https://www.courtlistener.com/api/rest/v4/citation-lookup/"
+COURTLISTENER_BASE_URL = "https://www.courtlistener.com"
+
+# Canonical reporter abbreviations. Matching ignores spacing ("F.3d" = "F. 3d").
+REPORTERS = [
+    # Federal
+    "U.S.", "S. Ct.", "L. Ed.", "L. Ed. 2d",
+    "F.", "F.2d", "F.3d", "F.4th", "F. App'x",
+    "F. Supp.", "F. Supp. 2d", "F. Supp. 3d", "B.R.", "Fed. Cl.",
+    # Regional
+    "A.", "A.2d", "A.3d", "P.", "P.2d", "P.3d",
+    "N.E.", "N.E.2d", "N.E.3d", "N.W.", "N.W.2d",
+    "S.E.", "S.E.2d", "S.W.", "S.W.2d", "S.W.3d",
+    "So.", "So. 2d", "So. 3d",
+    # States Cicero covers (see legal_search.STATE_TO_COURT)
+    "Cal.", "Cal. 2d", "Cal. 3d", "Cal. 4th", "Cal. 5th",
+    "Cal. App.", "Cal. App. 2d", "Cal. App. 3d", "Cal. App. 4th", "Cal. App. 5th",
+    "Cal. Rptr.", "Cal. Rptr. 2d", "Cal. Rptr. 3d",
+    "N.Y.", "N.Y.2d", "N.Y.3d", "N.Y.S.", "N.Y.S.2d", "N.Y.S.3d", "A.D.2d", "A.D.3d",
+    "Colo.", "Colo. App.", "Tex.", "Tex. Crim.", "Fla.",
+]
+
+_SPACING = re.compile(r"\s+")
+
+
+def _reporter_pattern(reporter: str) -> str:
+    # Optional whitespace wherever the canonical form has a space or a period
+    tokens = [t for t in re.split(r"(?<=\.)\s*|\s+", reporter) if t]
+    return r"\s*".join(re.escape(t) for t in tokens)
+
+
+_REPORTER_BY_KEY = {_SPACING.sub("", r): r for r in REPORTERS}
+# Longest first, so "F. Supp. 2d" wins over "F." at the same position
+_CITATION = re.compile(
+    r"\b(\d{1,4})\s+("
+    + "|".join(_reporter_pattern(r) for r in sorted(REPORTERS, key=len, reverse=True))
+    + r")\s+(\d{1,5})\b"
+)
+
+
+@dataclass
+class CaseRef:
+    case_name: str
+    url: Optional[str] = None
+    date_filed: Optional[str] = None  # YYYY-MM-DD
+
+
+def extract_citations(*texts: str) -> List[str]:
+    """Normalized citations in order of first appearance, without duplicates"""
+    found: Dict[str, None] = {}
+    for text in texts:
+        for volume, reporter, page in _CITATION.findall(text or ""):
+            found[f"{volume} {_REPORTER_BY_KEY[_SPACING.sub('', reporter)]} {page}"] = None
+    return list(found)
+
+
+def format_citation(citation: str, ref: Optional[CaseRef]) -> str:
+    """"Miranda v. Arizona, 384 U.S. 436 (1966) https://...", or the bare citation if unresolved"""
+    if ref is None:
+        return citation
+    formatted = f"{ref.case_name}, {citation}"
+    if ref.date_filed:
+        formatted += f" ({ref.date_filed[:4]})"
+    if ref.url:
+        formatted += f" {ref.url}"
+    return formatted
+
+
+# citation -> CaseRef, or None for a citation CourtListener does not know
+_memory = TTLCache(max_size=settings.CITATION_CACHE_SIZE, default_ttl=3600)
+_MISSING = object()
+
+
+async def resolve_citations(citations: List[str]) -> Dict[str, Optional[CaseRef]]:
+    """Look citations up in memory, then the database, then one batched CourtListener call.
+
+    Citations that could not be looked up this time (upstream error, no time
+    left) are absent from the result; known-unknown ones map to None.
+    """
+    resolved: Dict[str, Optional[CaseRef]] = {}
+    pending = []
+    for citation in citations:
+        ref = _memory.get(citation, _MISSING)
+        if ref is _MISSING:
+            pending.append(citation)
+        else:
+            resolved[citation] = ref
+    metrics.incr("citations.memory_hits", len(resolved))
+    if not pending:
+        return resolved
+
+    stored = await _load(pending)
+    for citation, ref in stored.items():
+        _memory.set(citation, ref)
+    resolved.update(stored)
+    metrics.incr("citations.db_hits", len(stored))
+    pending = [c for c in pending if c not in stored]
+    if not pending:
+        return resolved
+
+    looked_up = await _lookup(pending)
+    if looked_up:
+        await _store(looked_up)
+        for citation, ref in looked_up.items():
+            _memory.set(citation, ref)
+        resolved.update(looked_up)
+    return resolved
+
+
+@profiled("citations")
+async def cited_sources(*texts: str) -> List[str]:
+    """Formatted citations for ChatResponse.citations from the answer and tool output"""
+    citations = extract_citations(*texts)[:settings.CITATIONS_MAX_PER_RESPONSE]
+    if not citations:
+        return []
+    try:
+        resolved = await resolve_citations(citations)
+    except Exception as e:
+        logger.warning("Citation resolution failed: %s", e)
+        resolved = {}
+    return [format_citation(c, resolved.get(c)) for c in citations]
+
+
+async def _load(citations: List[str]) -> Dict[str, Optional[CaseRef]]:
+    now = datetime.utcnow()
+    found_cutoff = now - timedelta(days=settings.CITATION_CACHE_TTL_DAYS)
+    missing_cutoff = now - timedelta(days=settings.CITATION_CACHE_MISS_TTL_DAYS)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(CitationCache).where(CitationCache.citation.in_(citations))
+        )).all()
+    stored = {}
+    for row in rows:
+        if row.case_name is None:
+            if row.resolved_at >= missing_cutoff:
+                stored[row.citation] = None
+        elif row.resolved_at >= found_cutoff:
+            stored[row.citation] = CaseRef(row.case_name, row.url, row.date_filed)
+    return stored
+
+
+async def _lookup(citations: List[str]) -> Dict[str, Optional[CaseRef]]:
+    """Resolve all `citations` with one citation-lookup request"""
+    from app.tools.legal_search import get_http_client, record_upstream_request
+
+    timeout = timeout_for(settings.CITATION_LOOKUP_TIMEOUT_SECONDS)
+    if timeout <= 0:
+        return {}
+    # The API parses citations out of free text; remember where each one starts
+    text, starts = "", {}
+    for citation in citations:
+        starts[len(text)] = citation
+        text += citation + "; "
+
+    record_upstream_request()
+    metrics.incr("citations.lookups")
+    try:
+        with phase("upstream:citation-lookup"):
+            response = await get_http_client().post(
+                CITATION_LOOKUP_URL,
+                data={"text": text},
+                headers={"Authorization": f"Token {settings.COURTLISTENER_API_KEY}"},
+                timeout=timeout,
+            )
+        response.raise_for_status()
+        results = response.json()
+    except Exception as e:
+        logger.warning("Citation lookup failed: %s", e)
+        return {}
+
+    looked_up = {}
+    for item in results:
+        citation = starts.get(item.get("start_index"))
+        if citation is None:
+            continue
+        clusters = item.get("clusters") or []
+        if item.get("status") in (200, 300) and clusters:
+            # 300 is an ambiguous citation; the first cluster is the best match
+            cluster = clusters[0]
+            url = cluster.get("absolute_url")
+            looked_up[citation] = CaseRef(
+                case_name=cluster.get("case_name") or cluster.get("case_name_full") or citation,
+                url=COURTLISTENER_BASE_URL + url if url else None,
+                date_filed=cluster.get("date_filed"),
+            )
+        elif item.get("status") == 404:
+            looked_up[citation] = None
+        # Anything else (invalid reporter, throttled) is left unresolved and uncached
+    metrics.incr("citations.resolved", sum(1 for ref in looked_up.values() if ref is not None))
+    return looked_up
+
+
+async def _store(looked_up: Dict[str, Optional[CaseRef]]):
+    now = datetime.utcnow()
+    rows = [
+        {
+            "citation": citation,
+            "case_name": ref.case_name if ref else None,
+            "url": ref.url if ref else None,
+            "date_filed": ref.date_filed if ref else None,
+            "resolved_at": now,
+        }
+        for citation, ref in looked_up.items()
+    ]
+    try:
+        async with engine.begin() as conn:
+            dialect_insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+            stmt = dialect_insert(CitationCache).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["citation"],
+                set_={name: stmt.excluded[name] for name in ("case_name", "url", "date_filed", "resolved_at")},
+            )
+            await conn.execute(stmt)
+    except Exception as e:
+        # The answer doesn't depend on this; the next response just looks them up again
+        logger.warning("Could not store resolved citations: %s", e)
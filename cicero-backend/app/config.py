@@ -7,6 +7,12 @@ class Settings(BaseSettings):
     GROQ_API_KEY: str
     # llama-3.3-70b-versatile is the best available on standard Groq plan
     GROQ_MODEL: str = "llama-3.3-70b-versatile"
+    LLM_TIMEOUT_SECONDS: float = 30.0  # Cap on one LLM call (less when the request deadline is closer)
+    LLM_CACHE_ENABLED: bool = True  # Reuse answers to identical LLM calls (app.llm_cache)
+    LLM_CACHE_SIZE: int = 2000  # Completions kept in memory per process
+    LLM_CACHE_TTL_SECONDS: int = 24 * 3600  # How long a cached completion is reused
+    LLM_CACHE_SQLITE_PATH: Optional[str] = None  # e.g. "llm_cache.sqlite3" to persist and share across workers
+    LLM_CACHE_SQLITE_MAX_ENTRIES: int = 50000  # Least recently used completions beyond this are deleted
 
     # The "Reader" (Large Context & Embeddings)
     GEMINI_API_KEY: str
@@ -16,7 +22,17 @@ class Settings(BaseSettings):
     PINECONE_API_KEY: str
     PINECONE_INDEX_NAME: str = "cicero-knowledge"
     PINECONE_NAMESPACE: str = "case-law"
-    USE_RAG: bool = True
+    USE_RAG: bool = True  # Give the agent the search_documents tool
+
+    # Document retrieval (app.rag)
+    RAG_BACKEND: str = "local"  # "local" (index in RAG_INDEX_DIR) or "pinecone" (PINECONE_INDEX_NAME)
+    RAG_DOCUMENTS_DIR: str = "documents"  # Corpus ingested by `python -m app.rag ingest`
+    RAG_INDEX_DIR: str = "rag_index"  # Where the local index is written and memory-mapped from
+    RAG_EMBEDDING_MODEL: str = "BAAI/bge-small-en-v1.5"  # fastembed model (CPU); hashing embedder without fastembed
+    RAG_CHUNK_CHARS: int = 1200  # Target chunk size
+    RAG_CHUNK_OVERLAP_CHARS: int = 200  # Trailing text repeated at the start of the next chunk
+    RAG_TOP_K: int = 4  # Passages returned to the agent
+    RAG_NPROBE: int = 8  # IVF lists scanned per query (large corpora only)
 
     # Memory
     QDRANT_URL: str = (
@@ -31,14 +47,124 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10  # Persistent connections per worker process
+    DB_MAX_OVERFLOW: int = 10  # Extra burst connections beyond the pool
+    DB_POOL_TIMEOUT: int = 10  # Seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE: int = 1800  # Recycle connections before the server drops them
+    USER_CACHE_SIZE: int = 10000  # Max user records cached per worker process
+    USER_CACHE_TTL_SECONDS: int = 60  # Upper bound on staleness across worker processes
+
+    # Usage log write-behind
+    USAGE_LOG_QUEUE_SIZE: int = 10000  # Records buffered in memory before producers wait
+    USAGE_LOG_BATCH_SIZE: int = 500  # Rows written per flush
+    USAGE_LOG_FLUSH_SECONDS: float = 2.0  # Max time a record waits before being flushed
+    USAGE_LOG_ENQUEUE_TIMEOUT_SECONDS: float = 0.5  # Backpressure wait before a record is dropped
+    USAGE_LOG_PARTITION_MONTHS_AHEAD: int = 3  # Monthly partitions created ahead of time (Postgres)
+    USAGE_LOG_RETENTION_MONTHS: int = 0  # Drop partitions older than this; 0 keeps everything
+
+    # Rate limiting
+    # Unset: per-process memory. "database": the app database. Or any SQLAlchemy
+    # URL / redis:// URL for a dedicated shared store.
+    RATE_LIMIT_STORAGE_URL: Optional[str] = None
+    RATE_LIMIT_SYNC_SECONDS: float = 1.0  # How often local counts are pushed to the shared store
+    RATE_LIMIT_SYNC_BATCH: int = 10  # Sync early once a key has this many unsynced hits
+    RATE_LIMIT_REFRESH_SECONDS: float = 10.0  # How often keys without new local hits re-read the shared count
+
+    # Startup
+    WARMUP_ON_STARTUP: bool = False  # Open DB, upstream and LLM connections before /ready passes
+
+    # Logging
+    LOG_LEVEL: str = "DEBUG"  # Level for the app's own loggers; INFO drops debug events entirely
+    LOG_DEBUG_SAMPLE_RATE: float = 0.05  # Fraction of requests whose DEBUG events are kept
+    LOG_SLOW_REQUEST_SECONDS: float = 10.0  # Requests slower than this are always logged
+    LOG_QUEUE_SIZE: int = 10000  # Records buffered for the log thread before new ones are dropped
+    LOG_ERROR_FILE: Optional[str] = "error.log"  # ERROR records also go here (rotated); empty disables
+
+    # Admin
+    ADMIN_TOKEN: Optional[str] = None  # Enables /metrics and other admin endpoints via X-Admin-Token
+
+    # Profiling (app.profiling); admins can also ask for one with X-Profile: 1
+    PROFILE_SAMPLE_RATE: float = 0.0  # Fraction of requests under PROFILE_PATHS profiled automatically
+    PROFILE_PATHS: str = "/chat"  # Comma-separated path prefixes that can be profiled
+    PROFILE_INTERVAL_SECONDS: float = 0.001  # pyinstrument sampling interval
+    PROFILE_DIR: str = "profiles"  # Where speedscope files are written
+    PROFILE_MAX_FILES: int = 200  # Older profiles are deleted
 
     # Firebase
     FIREBASE_CREDENTIALS: Optional[str] = None  # Path to service account JSON or JSON string
+    FIREBASE_TOKEN_CACHE_SIZE: int = 10000  # Max verified ID tokens kept in memory
+    FIREBASE_KEY_REFRESH_SECONDS: int = 3600  # How often signing certificates are re-fetched
 
     # Stripe
     STRIPE_SECRET_KEY: str
     STRIPE_WEBHOOK_SECRET: str
     STRIPE_PREMIUM_PRICE_ID: str  # Stripe Price ID for Premium subscription
+    STRIPE_INBOX_POLL_SECONDS: float = 5.0  # Webhook inbox poll interval (events from other workers)
+    STRIPE_INBOX_MAX_ATTEMPTS: int = 10  # Give up on an event after this many failures (replayable)
+    STRIPE_API_BASE: Optional[str] = None  # Override the API host, e.g. http://localhost:12111 for stripe-mock
+    STRIPE_MAX_WORKERS: int = 8  # Threads for blocking Stripe SDK calls
+    STRIPE_CHECKOUT_CACHE_SIZE: int = 10000  # Open checkout sessions reused per user until they expire
+
+    # Upstream search cache and warmer
+    SEARCH_CACHE_SIZE: int = 5000  # CourtListener/LegiScan responses kept in memory per process
+    SEARCH_CACHE_TTL_SECONDS: int = 24 * 3600  # How long a cached upstream response is reused
+    WARMER_ENABLED: bool = False  # Pre-run popular questions' searches at startup and off-peak
+    WARMER_WINDOW_DAYS: int = 7  # How far back UsageLog is mined for popular questions
+    WARMER_TOP_PER_STATE: int = 10  # Most frequent questions warmed per state
+    WARMER_MIN_COUNT: int = 2  # Ignore questions asked fewer times than this
+    WARMER_UPSTREAM_BUDGET: int = 200  # Max upstream API calls per warming run
+    WARMER_OFF_PEAK_HOURS: str = "3-6"  # UTC hours (start-end) for the scheduled run
+    WARMER_RUN_AGENT: bool = False  # Also run full agent answers (costs LLM tokens)
+
+    # Admission control (per process)
+    ADMISSION_MAX_ACTIVE: int = 16  # Agent runs allowed at once
+    ADMISSION_MAX_QUEUE: int = 64  # Runs allowed to wait for a slot; beyond this requests get a 503
+    ADMISSION_QUEUE_TIMEOUT_PREMIUM: float = 20.0  # Max seconds a Premium run waits for a slot
+    ADMISSION_QUEUE_TIMEOUT_FREE: float = 8.0  # Max seconds a Free run waits for a slot
+    ADMISSION_QUEUE_TIMEOUT_BACKGROUND: float = 60.0  # Max seconds cache warming waits for a slot
+
+    # Request deadlines
+    CHAT_DEADLINE_SECONDS_PREMIUM: float = 45.0  # Total budget for one Premium question
+    CHAT_DEADLINE_SECONDS_FREE: float = 25.0  # Total budget for one Free question
+    CHAT_DEADLINE_SECONDS_BACKGROUND: float = 90.0  # Budget for cache-warming runs
+    CHAT_SYNTHESIS_RESERVE_SECONDS: float = 6.0  # Below this, stop calling tools and answer with what we have
+
+    # Hedged fallback search (app.chat): slow graph runs get a direct case-law search alongside
+    CHAT_HEDGE_ENABLED: bool = True
+    CHAT_HEDGE_PERCENTILE: float = 95.0  # Hedge once the graph is slower than this percentile of recent runs
+    CHAT_HEDGE_MIN_SECONDS: float = 5.0  # Never hedge sooner than this
+    CHAT_HEDGE_MIN_SAMPLES: int = 50  # Graph runs observed before the percentile is trusted
+    CHAT_HEDGE_DEFAULT_SECONDS: float = 15.0  # Hedge delay until then
+
+    # Citations
+    CITATIONS_MAX_PER_RESPONSE: int = 10  # Citations extracted and resolved per answer
+    CITATION_LOOKUP_TIMEOUT_SECONDS: float = 5.0  # Cap on the batched CourtListener lookup
+    CITATION_CACHE_SIZE: int = 10000  # Resolved citations kept in memory per process
+    CITATION_CACHE_TTL_DAYS: int = 90  # How long a resolved citation is trusted
+    CITATION_CACHE_MISS_TTL_DAYS: int = 7  # How long "no such case" is trusted
+
+    # Duplicate /chat requests (app.idempotency)
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 3600  # Answers to Idempotency-Key requests are replayed this long
+    IDEMPOTENCY_WINDOW_SECONDS: int = 60  # Without a key, the same question again this soon shares the answer
+    IDEMPOTENCY_CACHE_SIZE: int = 5000  # Answers kept for replay per process
+
+    # Background chat jobs (app.jobs)
+    CHAT_JOB_WORKERS: int = 2  # Jobs each API process runs at once; 0 leaves them to `python -m app.jobs worker`
+    CHAT_JOB_DEADLINE_SECONDS: float = 180.0  # Total budget for one job's agent run
+    CHAT_JOB_TTL_SECONDS: int = 24 * 3600  # How long a finished job and its answer are kept
+    CHAT_JOB_LEASE_SECONDS: float = 60.0  # A running job whose worker stops renewing this is run again
+    CHAT_JOB_POLL_SECONDS: float = 2.0  # How often idle workers and waiting clients check the table
+    CHAT_JOB_MAX_ATTEMPTS: int = 3  # Give up on a job after this many runs its worker died during
+    CHAT_JOB_MAX_QUEUE_SECONDS: int = 3600  # Fail (and refund) a job still queued after this long
+    CHAT_JOB_MAX_WAIT_SECONDS: float = 30.0  # Longest ?wait= long poll on GET /chat/jobs/{id}
+
+    # Batch chat
+    CHAT_BATCH_MAX_ITEMS: int = 10  # Questions accepted by one /chat/batch request
+    CHAT_BATCH_CONCURRENCY: int = 4  # Agent graphs run at once per batch
+
+    # Responses
+    GZIP_MINIMUM_SIZE: int = 1024  # Compress responses (e.g. long /chat answers) larger than this
+    LEGAL_CACHE_MAX_AGE_SECONDS: int = 3600  # Cache-Control max-age for /legal documents
 
     # CORS
     ALLOWED_ORIGINS: str = "http://localhost:3000,http://127.0.0.1:3000"  # Comma-separated list
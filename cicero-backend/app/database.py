@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Date, DateTime, Float, ForeignKey, Index, Text, Enum as SQLEnum
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
 from app.config import settings
@@ -22,8 +24,8 @@ class User(Base):
     subscription_tier = Column(SQLEnum(SubscriptionTier), default=SubscriptionTier.FREE, nullable=False)
     queries_today = Column(Integer, default=0, nullable=False)
     queries_reset_date = Column(DateTime, default=datetime.utcnow, nullable=False)
-    stripe_customer_id = Column(String, nullable=True)
-    stripe_subscription_id = Column(String, nullable=True)
+    stripe_customer_id = Column(String, nullable=True, index=True)
+    stripe_subscription_id = Column(String, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -31,33 +33,129 @@ class User(Base):
 
 
 class UsageLog(Base):
+    # Range-partitioned by month on timestamp in Postgres (see migrations and app.retention)
     __tablename__ = "usage_logs"
+    __table_args__ = (Index("ix_usage_logs_user_id_timestamp", "user_id", "timestamp"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     query_text = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
     tokens_used = Column(Integer, nullable=True)
+    state = Column(String(2), nullable=True)  # Jurisdiction the question was asked for
 
     user = relationship("User", back_populates="usage_logs")
 
 
+class UsageDaily(Base):
+    """Per-user daily query counts, rolled up incrementally by the UsageLog writer"""
+    __tablename__ = "usage_daily"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    query_count = Column(Integer, default=0, nullable=False)
+
+
+class StripeWebhookEvent(Base):
+    """Inbox of verified Stripe webhook events, deduplicated by Stripe's event ID"""
+    __tablename__ = "stripe_webhook_events"
+
+    id = Column(String, primary_key=True)  # Stripe event ID (evt_...)
+    type = Column(String, nullable=False)
+    customer_id = Column(String, nullable=True, index=True)
+    created = Column(Integer, nullable=False)  # Stripe's event timestamp (epoch seconds)
+    payload = Column(Text, nullable=False)
+    received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = Column(DateTime, nullable=True, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+
+
+class CitationCache(Base):
+    """Reporter citations resolved through CourtListener (see app.citations)"""
+    __tablename__ = "citation_cache"
+
+    citation = Column(String, primary_key=True)  # Normalized, e.g. "384 U.S. 436"
+    case_name = Column(Text, nullable=True)  # Null: CourtListener has no case for this citation
+    url = Column(String, nullable=True)
+    date_filed = Column(String(10), nullable=True)
+    resolved_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ChatJob(Base):
+    """A /chat/jobs question and, once a worker has run it, its answer (see app.jobs)"""
+    __tablename__ = "chat_jobs"
+    __table_args__ = (Index("ix_chat_jobs_claim", "status", "priority", "created_at"),)
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    status = Column(String(16), nullable=False)  # queued, running, succeeded or failed
+    priority = Column(Integer, nullable=False)  # Admission priority (app.admission)
+    request = Column(Text, nullable=False)  # ChatRequest JSON
+    result = Column(Text, nullable=True)  # ChatResponse JSON
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker_id = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=True)  # Lease of the worker running it; when queued, not claimed before this
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)  # Finished jobs are deleted after this
+
+
+class RateLimitCounter(Base):
+    """Shared rate-limit window counters (see app.rate_limit.SharedWindowStorage)"""
+    __tablename__ = "rate_limit_counters"
+
+    key = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)  # Epoch seconds
+
+
+def async_database_url(url: str) -> str:
+    """Map DATABASE_URL onto its async driver (asyncpg for Postgres, aiosqlite for SQLite)"""
+    # Render hands out postgres:// URLs, which SQLAlchemy no longer accepts
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql":
+        query = dict(parsed.query)
+        # asyncpg takes `ssl` rather than libpq's `sslmode`
+        sslmode = query.pop("sslmode", None)
+        if sslmode and "ssl" not in query:
+            query["ssl"] = sslmode
+        parsed = parsed.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+def _engine_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        # aiosqlite runs each connection on its own thread; pool sizing does not apply
+        return {}
+    return {
+        "pool_pre_ping": True,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+
+
 # Database connection
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20
-)
+DATABASE_URL = async_database_url(settings.DATABASE_URL)
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False keeps loaded attributes readable after commit without
+# an implicit (and, under asyncio, illegal) lazy refresh.
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 
-def get_db():
+async def get_db():
     """Dependency for getting database session"""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
@@ -0,0 +1,69 @@
+"""
+Per-request time budget.
+
+answer_chat opens a deadline scope; the deadline also travels in the graph
+config (`configurable.deadline`) so nodes can read it from there. LLM calls
+and upstream fetches take only what is left, and once less than
+CHAT_SYNTHESIS_RESERVE_SECONDS remains the agent stops calling tools and
+answers from what it already has.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from app.admission import PRIORITY_PREMIUM, PRIORITY_FREE
+from app.config import settings
+
+# Tool reply used when a tool call is skipped for lack of time
+SKIPPED_TOOL_RESULT = "Skipped: there is no time left to search. Answer with what you already have."
+
+# time.monotonic() value the current request must finish by
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def budget_for(priority: int) -> float:
+    """Total seconds allowed for one question at this admission priority"""
+    if priority == PRIORITY_PREMIUM:
+        return settings.CHAT_DEADLINE_SECONDS_PREMIUM
+    if priority == PRIORITY_FREE:
+        return settings.CHAT_DEADLINE_SECONDS_FREE
+    return settings.CHAT_DEADLINE_SECONDS_BACKGROUND
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Run the block with a deadline `seconds` from now (an outer, earlier deadline wins)"""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(config: Optional[dict] = None) -> Optional[float]:
+    """Seconds left before the deadline (from `config` or the current scope), or None if unbounded"""
+    deadline = None
+    if config:
+        deadline = config.get("configurable", {}).get("deadline")
+    if deadline is None:
+        deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_for(default: float, config: Optional[dict] = None) -> float:
+    """`default`, capped at the remaining budget (never negative)"""
+    left = remaining(config)
+    return default if left is None else max(0.0, min(default, left))
+
+
+def should_wrap_up(config: Optional[dict] = None) -> bool:
+    """True once there is only time left to synthesize an answer"""
+    left = remaining(config)
+    return left is not None and left < settings.CHAT_SYNTHESIS_RESERVE_SECONDS
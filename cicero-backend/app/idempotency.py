@@ -0,0 +1,98 @@
+"""
+Idempotent /chat requests.
+
+A retried or double-tapped question should not run the agent (and take a
+quota slot) twice. Each request gets a key:
+- with an `Idempotency-Key` header, the user's ID plus that key. Its answer is
+  replayed for IDEMPOTENCY_KEY_TTL_SECONDS.
+- without one, the user's ID plus a hash of the request body (message, state
+  and history). Identical requests within IDEMPOTENCY_WINDOW_SECONDS are merged.
+
+A request whose key is already running waits for that run instead of starting
+another. A request whose key has a stored answer gets that answer. The run
+itself is a separate task, so it carries on when the client that started it
+disconnects, and the client's retry picks up its result. Runs that failed, or
+produced no answer, are not stored; the next request with that key runs
+again. State is per process.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.cache import TTLCache
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """The Idempotency-Key was already used for a different request"""
+
+
+def request_key(user_id: int, header_key: Optional[str], body: str) -> Tuple[str, str, float]:
+    """(key, body fingerprint, seconds to keep the answer) for one request"""
+    fingerprint = hashlib.sha256(body.encode()).hexdigest()
+    if header_key:
+        return f"{user_id}:key:{header_key}", fingerprint, settings.IDEMPOTENCY_KEY_TTL_SECONDS
+    return f"{user_id}:auto:{fingerprint}", fingerprint, settings.IDEMPOTENCY_WINDOW_SECONDS
+
+
+class IdempotentRuns:
+    """Single-flight runs keyed by idempotency key, with their answers kept for a while"""
+
+    def __init__(self, max_size: int):
+        # key -> (fingerprint, task)
+        self._running: Dict[str, Tuple[str, asyncio.Task]] = {}
+        # key -> (fingerprint, result)
+        self._done = TTLCache(max_size=max_size)
+
+    async def run(self, key: str, fingerprint: str, ttl: float,
+                  factory: Callable[[], Awaitable[Tuple[object, bool]]]) -> Tuple[object, bool]:
+        """The result of `factory()` for `key`, running it only if no run for `key` exists yet.
+
+        `factory` returns (result, keep): keep=False results are not replayed
+        later. Returns (result, replayed), where replayed is True if another
+        request's run produced the result.
+        """
+        stored = self._done.get(key)
+        if stored is not None:
+            self._check(stored[0], fingerprint)
+            metrics.incr("idempotency.replayed")
+            return stored[1], True
+
+        running = self._running.get(key)
+        if running is not None:
+            self._check(running[0], fingerprint)
+            metrics.incr("idempotency.attached")
+            task = running[1]
+            replayed = True
+        else:
+            task = asyncio.create_task(factory())
+            self._running[key] = (fingerprint, task)
+            task.add_done_callback(lambda done: self._settle(key, fingerprint, ttl, done))
+            replayed = False
+        # Shielded: a client going away must not cancel a run others (or its retry) are waiting for
+        result, _ = await asyncio.shield(task)
+        return result, replayed
+
+    def _settle(self, key: str, fingerprint: str, ttl: float, task: asyncio.Task):
+        self._running.pop(key, None)
+        # Also marks the exception retrieved when every waiter has gone
+        if task.cancelled() or task.exception() is not None:
+            return
+        result, keep = task.result()
+        if keep:
+            self._done.set(key, (fingerprint, result), ttl=ttl)
+
+    @staticmethod
+    def _check(stored_fingerprint: str, fingerprint: str):
+        if stored_fingerprint != fingerprint:
+            metrics.incr("idempotency.key_reused")
+            raise IdempotencyKeyReused()
+
+
+chat_runs = IdempotentRuns(max_size=settings.IDEMPOTENCY_CACHE_SIZE)
@@ -0,0 +1,406 @@
+"""
+Background chat jobs.
+
+POST /chat/jobs stores the question in the chat_jobs table and returns a job
+ID right away, so slow agent runs don't hold an HTTP connection (or a mobile
+client on a flaky network) for their whole length. Workers claim queued jobs,
+Premium first and then oldest first, and run them through answer_chat with
+the longer CHAT_JOB_DEADLINE_SECONDS budget. The answer is stored on the job
+for CHAT_JOB_TTL_SECONDS. Clients poll GET /chat/jobs/{id}, optionally
+long-polling with ?wait=, or subscribe to GET /chat/jobs/{id}/events
+(Server-Sent Events).
+
+Workers run inside each API process (CHAT_JOB_WORKERS at a time), or in
+separate processes that share the database queue:
+
+    python -m app.jobs worker [concurrency]   # run jobs until stopped
+    python -m app.jobs purge                  # delete expired jobs now
+
+A worker holds a lease on the job it runs and renews it while the agent works.
+If the worker dies, another one runs the job again once the lease has run out,
+up to CHAT_JOB_MAX_ATTEMPTS runs in total. A job shed by admission control, or
+handed back by a worker shutting down, does not use up an attempt; a shed job
+waits for the Retry-After admission control gave before it is claimed again.
+Jobs still queued after CHAT_JOB_MAX_QUEUE_SECONDS fail.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sys
+import uuid
+import weakref
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, or_, select, update
+
+from app import startup
+from app.auth import release_query
+from app.chat import answer_chat
+from app.config import settings
+from app.database import engine, SessionLocal, ChatJob, User
+from app.logging_config import request_id_var
+from app.metrics import metrics
+from app.models import ChatJobResponse, ChatRequest, ChatResponse
+from app.usage_log import usage_log_writer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# Shown to the client; the cause is in the logs under the job's ID
+FAILED_MESSAGE = "An error occurred processing your request"
+# How often workers delete expired jobs and give up on abandoned ones
+_MAINTENANCE_SECONDS = 300
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_wakeup: Optional[asyncio.Event] = None
+# job ID -> event set when that job changes in this process; held by whoever is waiting
+_watchers: "weakref.WeakValueDictionary[str, asyncio.Event]" = weakref.WeakValueDictionary()
+
+
+def _wakeup_event() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def _notify(job_id: str):
+    event = _watchers.get(job_id)
+    if event is not None:
+        event.set()
+
+
+def to_response(job: ChatJob) -> ChatJobResponse:
+    return ChatJobResponse(
+        id=job.id,
+        status=job.status,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        result=ChatResponse.model_validate_json(job.result) if job.result else None,
+        error=job.error,
+    )
+
+
+async def enqueue(user: User, chat_request: ChatRequest, priority: int) -> ChatJob:
+    """Store a new queued job (the caller has already reserved the user's quota)"""
+    job = ChatJob(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        status=QUEUED,
+        priority=priority,
+        request=chat_request.model_dump_json(),
+        attempts=0,
+        created_at=datetime.utcnow(),
+    )
+    async with SessionLocal() as db:
+        db.add(job)
+        await db.commit()
+    metrics.incr("chat_jobs.enqueued")
+    _wakeup_event().set()
+    return job
+
+
+async def get_job(job_id: str, user_id: int) -> Optional[ChatJob]:
+    """The user's job, or None if there is no such job, it belongs to someone else or it has expired"""
+    async with SessionLocal() as db:
+        job = await db.get(ChatJob, job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    if job.expires_at is not None and job.expires_at <= datetime.utcnow():
+        return None
+    return job
+
+
+async def wait_for_job(job_id: str, user_id: int, timeout: float, seen_status: Optional[str] = None) -> Optional[ChatJob]:
+    """The job once its status is no longer `seen_status` (or once it has finished,
+    if None), or as it is when `timeout` runs out.
+
+    Changes made in this process wake the waiter at once. Changes made by
+    worker processes are picked up every CHAT_JOB_POLL_SECONDS.
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + timeout
+    # Look the event up before reading the row, so a change in between still wakes us
+    event = _watchers.get(job_id)
+    if event is None:
+        event = _watchers[job_id] = asyncio.Event()
+    while True:
+        event.clear()
+        job = await get_job(job_id, user_id)
+        if job is None or job.status in FINISHED:
+            return job
+        if seen_status is not None and job.status != seen_status:
+            return job
+        left = give_up_at - loop.time()
+        if left <= 0:
+            return job
+        try:
+            await asyncio.wait_for(event.wait(), min(left, settings.CHAT_JOB_POLL_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def watch_job(job_id: str, user_id: int, keepalive: float = 15.0) -> AsyncIterator[Optional[ChatJob]]:
+    """Yield the job now and at every status change until it finishes (None: no change, time for a keep-alive)"""
+    job = await get_job(job_id, user_id)
+    seen_status = None
+    while job is not None:
+        if job.status != seen_status:
+            seen_status = job.status
+            yield job
+            if job.status in FINISHED:
+                return
+        else:
+            yield None
+        job = await wait_for_job(job_id, user_id, keepalive, seen_status=seen_status)
+
+
+def _claimable(now: datetime):
+    # Queued (and not held back after being shed), or running under a lease its worker stopped renewing
+    return and_(
+        or_(
+            and_(ChatJob.status == QUEUED, or_(ChatJob.locked_until.is_(None), ChatJob.locked_until <= now)),
+            and_(ChatJob.status == RUNNING, ChatJob.locked_until < now),
+        ),
+        ChatJob.attempts < settings.CHAT_JOB_MAX_ATTEMPTS,
+    )
+
+
+async def _claim() -> Optional[ChatJob]:
+    """Take the next job off the queue and lease it to this worker"""
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        # SKIP LOCKED lets Postgres workers claim different jobs concurrently
+        job = (await db.execute(
+            select(ChatJob).where(_claimable(now))
+            .order_by(ChatJob.priority, ChatJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )).scalars().first()
+        if job is None:
+            return None
+        # Conditional, so a worker that read the same row (SQLite has no row locks) loses
+        result = await db.execute(
+            update(ChatJob)
+            .where(ChatJob.id == job.id, _claimable(now))
+            .values(
+                status=RUNNING,
+                worker_id=WORKER_ID,
+                attempts=ChatJob.attempts + 1,
+                locked_until=now + timedelta(seconds=settings.CHAT_JOB_LEASE_SECONDS),
+                started_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    if result.rowcount != 1:
+        return None
+    if job.status == RUNNING:
+        metrics.incr("chat_jobs.reclaimed")
+    job.status, job.attempts = RUNNING, job.attempts + 1
+    _notify(job.id)
+    return job
+
+
+async def _renew_lease(job_id: str):
+    while True:
+        await asyncio.sleep(settings.CHAT_JOB_LEASE_SECONDS / 3)
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(ChatJob)
+                .where(ChatJob.id == job_id, ChatJob.worker_id == WORKER_ID, ChatJob.status == RUNNING)
+                .values(locked_until=datetime.utcnow() + timedelta(seconds=settings.CHAT_JOB_LEASE_SECONDS))
+            )
+
+
+async def _finish(job: ChatJob, result: Optional[ChatResponse] = None, error: Optional[str] = None,
+                  requeue: bool = False, retry_after: float = 0) -> bool:
+    """Record the outcome of this worker's run; False if the job was taken over meanwhile.
+
+    requeue=True puts the job back without counting this run as an attempt,
+    claimable again after `retry_after` seconds.
+    """
+    now = datetime.utcnow()
+    if requeue:
+        values = {
+            "status": QUEUED,
+            "worker_id": None,
+            "attempts": ChatJob.attempts - 1,
+            # For a queued job, the time before which it is not claimed
+            "locked_until": now + timedelta(seconds=retry_after) if retry_after > 0 else None,
+        }
+    else:
+        values = {
+            "status": SUCCEEDED if error is None else FAILED,
+            "result": result.model_dump_json() if result is not None else None,
+            "error": error,
+            "finished_at": now,
+            "locked_until": None,
+            "expires_at": now + timedelta(seconds=settings.CHAT_JOB_TTL_SECONDS),
+        }
+    async with engine.begin() as conn:
+        updated = await conn.execute(
+            update(ChatJob)
+            .where(ChatJob.id == job.id, ChatJob.worker_id == WORKER_ID, ChatJob.status == RUNNING)
+            .values(**values)
+        )
+    _notify(job.id)
+    if requeue and retry_after <= 0:
+        _wakeup_event().set()
+    return updated.rowcount == 1
+
+
+async def _refund(user_id: int):
+    async with SessionLocal() as db:
+        user = await db.get(User, user_id)
+        if user is not None:
+            await release_query(user, db)
+
+
+def _retry_after(e: HTTPException) -> float:
+    try:
+        return float((e.headers or {}).get("Retry-After", ""))
+    except ValueError:
+        return settings.CHAT_JOB_POLL_SECONDS
+
+
+async def _run_job(job: ChatJob):
+    chat_request = ChatRequest.model_validate_json(job.request)
+    lease = asyncio.create_task(_renew_lease(job.id))
+    token = request_id_var.set(f"job-{job.id}")
+    try:
+        response, answered = await answer_chat(
+            chat_request, job.priority, deadline_seconds=settings.CHAT_JOB_DEADLINE_SECONDS, hedge=False
+        )
+    except HTTPException as e:
+        # Shed by admission control: this process is overloaded, so retry once it has had time to drain
+        metrics.incr("chat_jobs.shed")
+        await _finish(job, requeue=True, retry_after=_retry_after(e))
+    except asyncio.CancelledError:
+        # Worker shutting down: hand the job back rather than wait for its lease to run out
+        metrics.incr("chat_jobs.requeued")
+        await asyncio.shield(_finish(job, requeue=True))
+        raise
+    except Exception:
+        logger.exception("Error running chat job %s", job.id)
+        if await _finish(job, error=FAILED_MESSAGE):
+            metrics.incr("chat_jobs.failed")
+            await _refund(job.user_id)
+    else:
+        if await _finish(job, result=response):
+            metrics.incr("chat_jobs.succeeded")
+            if answered:
+                await usage_log_writer.log(job.user_id, chat_request.message, state=chat_request.state)
+            else:
+                await _refund(job.user_id)
+    finally:
+        lease.cancel()
+        request_id_var.reset(token)
+
+
+def _abandoned(now: datetime):
+    # Out of attempts after its workers died, so no worker will claim it again,
+    # or queued (e.g. shed again and again) for longer than anyone will wait
+    out_of_attempts = and_(
+        or_(ChatJob.status == QUEUED, and_(ChatJob.status == RUNNING, ChatJob.locked_until < now)),
+        ChatJob.attempts >= settings.CHAT_JOB_MAX_ATTEMPTS,
+    )
+    stuck = and_(
+        ChatJob.status == QUEUED,
+        ChatJob.created_at < now - timedelta(seconds=settings.CHAT_JOB_MAX_QUEUE_SECONDS),
+    )
+    return or_(out_of_attempts, stuck)
+
+
+async def purge_expired() -> int:
+    """Delete expired jobs and fail those abandoned after their last attempt; returns rows deleted"""
+    now = datetime.utcnow()
+    async with engine.begin() as conn:
+        abandoned = (await conn.execute(select(ChatJob.id, ChatJob.user_id).where(_abandoned(now)))).all()
+        for job_id, _ in abandoned:
+            await conn.execute(
+                update(ChatJob).where(ChatJob.id == job_id, _abandoned(now)).values(
+                    status=FAILED, error=FAILED_MESSAGE, finished_at=now, locked_until=None,
+                    expires_at=now + timedelta(seconds=settings.CHAT_JOB_TTL_SECONDS),
+                )
+            )
+        deleted = await conn.execute(delete(ChatJob).where(ChatJob.expires_at <= now))
+    for job_id, user_id in abandoned:
+        metrics.incr("chat_jobs.failed")
+        await _refund(user_id)
+        _notify(job_id)
+    return deleted.rowcount
+
+
+async def run_workers(concurrency: int):
+    """Run up to `concurrency` jobs at a time, forever"""
+    wakeup = _wakeup_event()
+
+    async def work():
+        while True:
+            try:
+                job = await _claim()
+            except Exception:
+                logger.exception("Error claiming a chat job")
+                job = None
+            if job is not None:
+                await _run_job(job)
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), settings.CHAT_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+    async def maintain():
+        while True:
+            try:
+                await purge_expired()
+            except Exception:
+                logger.exception("Error purging chat jobs")
+            await asyncio.sleep(_MAINTENANCE_SECONDS)
+
+    tasks = [asyncio.create_task(maintain())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        # gather() has cancelled them all; wait while running jobs go back on the queue
+        await asyncio.wait(tasks)
+        raise
+
+
+if __name__ == "__main__":
+    async def _main(args):
+        from app.logging_config import setup_logging, shutdown_logging
+
+        if args[:1] == ["purge"]:
+            print(f"Deleted {await purge_expired()} expired jobs")
+        elif args[:1] == ["worker"]:
+            setup_logging()
+            usage_log_writer.start()
+            concurrency = int(args[1]) if len(args) > 1 else max(settings.CHAT_JOB_WORKERS, 1)
+            logger.info("Chat job worker %s running %d jobs at a time", WORKER_ID, concurrency)
+            try:
+                await run_workers(concurrency)
+            finally:
+                await usage_log_writer.stop()
+                await startup.shutdown()
+                shutdown_logging()
+        else:
+            print(__doc__)
+            return
+        await engine.dispose()
+
+    try:
+        asyncio.run(_main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
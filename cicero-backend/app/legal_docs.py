@@ -0,0 +1,116 @@
+"""
+Legal documents served from memory.
+
+The markdown files are read once, serialized to the JSON body the app
+expects and compressed ahead of time (gzip, plus brotli when the `brotli`
+package is installed). Each encoding has its own strong ETag so clients and
+proxies can revalidate with If-None-Match and get a bodyless 304.
+"""
+import gzip
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+from app.config import settings
+
+try:
+    import brotli
+except ImportError:  # Listed in requirements.txt; without it only gzip variants are built
+    brotli = None
+
+LEGAL_DIR = Path(__file__).resolve().parent.parent / "legal"
+DOCUMENTS = {
+    "privacy": ("privacy_policy.md", "Privacy policy not yet available"),
+    "terms": ("terms_of_service.md", "Terms of service not yet available"),
+}
+
+
+class LegalDocument:
+    """One document's JSON body in every encoding we serve, with per-encoding ETags"""
+
+    def __init__(self, content: str):
+        body = json.dumps({"content": content}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+
+_documents: Dict[str, LegalDocument] = {}
+
+
+def load_legal_documents():
+    """Read and precompress every legal document (called once at startup)"""
+    for name, (filename, fallback) in DOCUMENTS.items():
+        try:
+            content = (LEGAL_DIR / filename).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            content = fallback
+        _documents[name] = LegalDocument(content)
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def _choose_encoding(document: LegalDocument, accept_encoding: Optional[str]) -> str:
+    if not accept_encoding:
+        return "identity"
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding in ("br", "gzip"):
+        if encoding in document.bodies and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: str, document: LegalDocument) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in document.etags.values())
+
+
+def legal_document_response(request: Request, name: str) -> Response:
+    """Serve a preloaded document, answering 304 when the client's copy is current"""
+    if not _documents:
+        load_legal_documents()
+    document = _documents[name]
+    encoding = _choose_encoding(document, request.headers.get("accept-encoding"))
+    body = document.bodies[encoding]
+    headers = {
+        "ETag": document.etags[encoding],
+        "Cache-Control": f"public, max-age={settings.LEGAL_CACHE_MAX_AGE_SECONDS}",
+    }
+    # GZipMiddleware adds Vary: Accept-Encoding to the unencoded bodies large enough
+    # for it to consider; the responses it passes through untouched need it from here
+    vary = {"Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, document):
+        return Response(status_code=304, headers={**headers, **vary})
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    if encoding != "identity" or len(body) < settings.GZIP_MINIMUM_SIZE:
+        headers.update(vary)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,228 @@
+"""
+Exact-match cache for Groq chat completions.
+
+The LLM runs at temperature 0, so the same model, bound tools and messages
+give the same answer. LLMCache plugs into LangChain's chat-model cache hook
+(`ChatGroq(cache=...)`). The hook hands it the serialized messages and a
+string describing the model and call parameters, including any bound tools,
+so `get_llm()` and `get_llm_with_tools()` share one cache without colliding.
+Entries are keyed by a SHA-256 of both strings.
+
+Two tiers:
+- an in-process LRU (LLM_CACHE_SIZE entries), always on;
+- an optional SQLite file (LLM_CACHE_SQLITE_PATH), shared by the workers on
+  one machine and surviving restarts, trimmed to LLM_CACHE_SQLITE_MAX_ENTRIES.
+
+Both tiers expire entries after LLM_CACHE_TTL_SECONDS. Inside `bypass()` (used
+for requests sent with `Cache-Control: no-cache`) lookups miss but fresh
+answers are still stored.
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from app.cache import TTLCache
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# Delete expired rows and trim the SQLite tier after this many writes
+_PRUNE_EVERY = 100
+
+# load.loads is marked beta; it has been stable for what we store (messages and generations)
+warnings.filterwarnings("ignore", message=r"The function `loads` is in beta", category=LangChainBetaWarning)
+
+_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass(enabled: bool = True):
+    """Skip cache lookups for LLM calls made inside the block (results are still stored)"""
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode()).hexdigest()
+
+
+class SQLiteTier:
+    """Persistent key -> serialized generations store (blocking; call from a thread)"""
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        # WAL lets the other workers read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=2000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_used_at ON llm_cache (used_at)")
+
+    def get(self, key: str) -> Optional[tuple]:
+        """(value, expires_at) for a live entry, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+        return row
+
+    def set(self, key: str, value: str, expires_at: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._writes += 1
+            if self._writes % _PRUNE_EVERY == 1:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        # Least recently used beyond the size limit
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMCache(BaseCache):
+    """LangChain cache: in-memory LRU in front of an optional SQLite file"""
+
+    def __init__(self, max_entries: int, ttl: float, sqlite_path: Optional[Path] = None,
+                 sqlite_max_entries: int = 0):
+        self.ttl = ttl
+        # Values are kept serialized: every hit gets fresh message objects, so
+        # nothing downstream (add_messages assigns IDs) can alter the cached copy
+        self._memory = TTLCache(max_size=max_entries, default_ttl=ttl)
+        self._sqlite = SQLiteTier(sqlite_path, sqlite_max_entries) if sqlite_path else None
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if _bypass.get():
+            metrics.incr("llm_cache.bypassed")
+            return None
+        key = cache_key(prompt, llm_string)
+        value = self._memory.get(key)
+        if value is not None:
+            metrics.incr("llm_cache.hits")
+            return self._load(value)
+        if self._sqlite is not None:
+            row = self._sqlite_call(self._sqlite.get, key)
+            if row is not None:
+                value, expires_at = row
+                self._memory.set(key, value, expires_at=expires_at)
+                metrics.incr("llm_cache.hits")
+                metrics.incr("llm_cache.disk_hits")
+                return self._load(value)
+        metrics.incr("llm_cache.misses")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = cache_key(prompt, llm_string)
+        value = dumps([_without_id(generation) for generation in return_val])
+        expires_at = time.time() + self.ttl
+        self._memory.set(key, value, expires_at=expires_at)
+        if self._sqlite is not None:
+            self._sqlite_call(self._sqlite.set, key, value, expires_at)
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self._sqlite is None:
+            return self.lookup(prompt, llm_string)
+        # Memory hits and bypassed calls never touch the disk; skip the thread hop for them
+        if _bypass.get() or self._memory.get(cache_key(prompt, llm_string)) is not None:
+            return self.lookup(prompt, llm_string)
+        return await asyncio.to_thread(self.lookup, prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self._sqlite is None:
+            self.update(prompt, llm_string, return_val)
+        else:
+            await asyncio.to_thread(self.update, prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self._memory.clear()
+        if self._sqlite is not None:
+            self._sqlite.clear()
+
+    def _sqlite_call(self, fn, *args):
+        # A locked or broken cache file costs a cache miss, never the answer
+        try:
+            return fn(*args)
+        except sqlite3.Error as e:
+            metrics.incr("llm_cache.errors")
+            logger.warning("LLM cache file error: %s", e)
+            return None
+
+    @staticmethod
+    def _load(value: str) -> RETURN_VAL_TYPE:
+        return loads(value, allowed_objects="core")
+
+
+def _without_id(generation):
+    # A replayed message must not reuse the original's ID: LangGraph's add_messages
+    # would treat it as the same message and replace it
+    message = getattr(generation, "message", None)
+    if message is None or message.id is None:
+        return generation
+    return generation.model_copy(update={"message": message.model_copy(update={"id": None})})
+
+
+_llm_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """The process-wide cache, or None when LLM_CACHE_ENABLED is off"""
+    global _llm_cache
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        sqlite_path = None
+        if settings.LLM_CACHE_SQLITE_PATH:
+            sqlite_path = Path(settings.LLM_CACHE_SQLITE_PATH)
+            if not sqlite_path.is_absolute():
+                sqlite_path = BACKEND_DIR / sqlite_path
+        _llm_cache = LLMCache(
+            max_entries=settings.LLM_CACHE_SIZE,
+            ttl=settings.LLM_CACHE_TTL_SECONDS,
+            sqlite_path=sqlite_path,
+            sqlite_max_entries=settings.LLM_CACHE_SQLITE_MAX_ENTRIES,
+        )
+    return _llm_cache
@@ -0,0 +1,132 @@
+"""
+Structured, non-blocking logging.
+
+Request coroutines only put records on an in-memory queue (QueueHandler);
+a QueueListener thread formats them as JSON lines and does the console and
+error-file I/O. If the queue is ever full, records are dropped and counted
+rather than blocking the event loop. Every record carries the request ID set
+by RequestIdMiddleware. DEBUG records are sampled per request (so a sampled
+request keeps its whole trace), while INFO and above, including slow-request
+and error events, are always kept.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import settings
+from app.metrics import metrics
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request ID and sample DEBUG records per request"""
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.request_id = request_id
+        if record.levelno > logging.DEBUG or self.debug_sample_rate >= 1:
+            return True
+        if request_id is None:
+            return random.random() < self.debug_sample_rate
+        # Same answer for every record of a request, so sampled traces are complete
+        return zlib.crc32(request_id.encode()) % 10000 < self.debug_sample_rate * 10000
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("logging.dropped")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback now (the listener thread can't see our
+        # frames), but leave JSON formatting and all I/O to the listener
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, msg, extra fields, exc"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """Route the app's logging through a queue to a background listener thread (idempotent)"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter()
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(formatter)
+    handlers = [console]
+    if settings.LOG_ERROR_FILE:
+        error_file = logging.handlers.RotatingFileHandler(
+            settings.LOG_ERROR_FILE, maxBytes=10 * 1024 * 1024, backupCount=3
+        )
+        error_file.setLevel(logging.ERROR)
+        error_file.setFormatter(formatter)
+        handlers.append(error_file)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestContextFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(logging.WARNING)  # Third-party libraries: warnings and up
+    for name in ("app", "main"):
+        logging.getLogger(name).setLevel(settings.LOG_LEVEL.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        _listener = _queue_handler = None
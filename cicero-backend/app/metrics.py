@@ -0,0 +1,48 @@
+from collections import defaultdict, deque
+
+
+class Metrics:
+    """In-process counters, gauges and latency observations for the /metrics endpoint"""
+
+    def __init__(self, window: int = 1024):
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._observations = defaultdict(lambda: deque(maxlen=window))
+
+    def incr(self, name: str, value: float = 1):
+        self._counters[name] += value
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def set_gauge(self, name: str, value: float):
+        self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        self._observations[name].append(value)
+
+    def observation_count(self, name: str) -> int:
+        return len(self._observations.get(name, ()))
+
+    def percentile(self, name: str, q: float):
+        """q-th percentile (0-100) of the recent observations, or None if there are none"""
+        values = sorted(self._observations.get(name, ()))
+        if not values:
+            return None
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def snapshot(self) -> dict:
+        summaries = {}
+        for name, values in self._observations.items():
+            if values:
+                summaries[name] = {
+                    "count": len(values),
+                    "p50": self.percentile(name, 50),
+                    "p95": self.percentile(name, 95),
+                    "max": max(values),
+                }
+        return {"counters": dict(self._counters), "gauges": dict(self._gauges), "summaries": summaries}
+
+
+metrics = Metrics()
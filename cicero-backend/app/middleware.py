@@ -1,20 +1,194 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response as StarletteResponse
-
-
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    """Add security headers to all responses"""
-
-    async def dispatch(self, request: Request, call_next):
-        response: Response = await call_next(request)
-        
-        # Security headers
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        
-        return response
+import asyncio
+import logging
+import re
+import time
+import uuid
 
+from slowapi.middleware import SlowAPIASGIMiddleware, _ASGIMiddlewareResponder
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.logging_config import request_id_var
+from app.profiling import profile_mode, start_profile, finish_profile, save_profile
+
+logger = logging.getLogger(__name__)
+
+# Accept a caller's request ID (e.g. from the load balancer) only if it looks sane
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+SECURITY_HEADERS = {
+    "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+}
+
+
+class SecurityHeadersMiddleware:
+    """Add security headers to all responses (pure ASGI: bodies stream through untouched)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in SECURITY_HEADERS.items():
+                    headers[name] = value
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class RequestIdMiddleware:
+    """Give every request a correlation ID (X-Request-ID) for its logs, and log slow requests"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = Headers(scope=scope).get("x-request-id", "")
+        request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            duration = time.perf_counter() - start
+            fields = {"method": scope["method"], "path": scope["path"], "status": status_code,
+                      "duration_ms": round(duration * 1000, 1)}
+            if duration >= settings.LOG_SLOW_REQUEST_SECONDS:
+                logger.warning("slow request", extra=fields)
+            else:
+                logger.debug("request", extra=fields)
+            request_id_var.reset(token)
+
+
+class ProfilingMiddleware:
+    """Profile requested or sampled requests under PROFILE_PATHS (see app.profiling)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.prefixes = tuple(p.strip() for p in settings.PROFILE_PATHS.split(",") if p.strip())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        mode = profile_mode(Headers(scope=scope))
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Inside RequestIdMiddleware, so the profile is named after the request
+        profile_id = request_id_var.get() or uuid.uuid4().hex
+
+        async def send_with_profile_id(message: Message):
+            # Only an admin who asked for the profile is told where to find it
+            if message["type"] == "http.response.start" and mode == "requested":
+                MutableHeaders(scope=message)["X-Profile-ID"] = profile_id
+            await send(message)
+
+        token = start_profile(profile_id, scope["method"], scope["path"])
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile = finish_profile(token)
+            try:
+                await asyncio.to_thread(save_profile, profile)
+            except Exception:
+                logger.exception("Error saving profile %s", profile_id)
+
+
+class _RateLimitResponder(_ASGIMiddlewareResponder):
+    """slowapi's responder, forwarding http.response.start once instead of before every body chunk"""
+
+    _start_sent = False
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Held back so slowapi can still turn it into a 429 or add headers
+            await super().send_wrapper(message)
+        elif self._start_sent:
+            await self.send(message)
+        else:
+            self._start_sent = True
+            if message["type"] == "http.response.body":
+                await super().send_wrapper(message)
+            else:
+                await self.send(self.initial_message)
+                await self.send(message)
+
+
+class RateLimitMiddleware(SlowAPIASGIMiddleware):
+    """SlowAPIASGIMiddleware that leaves streamed (multi-chunk) responses intact"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await _RateLimitResponder(self.app)(scope, receive, send)
+
+
+class RateLimitHeadersMiddleware:
+    """Add X-RateLimit-* headers (and Retry-After on 429) for routes with a slowapi limit.
+
+    Like slowapi's own header injection, only when the limiter was built with
+    headers_enabled=True; ours is not, so responses carry no such headers.
+    """
+
+    def __init__(self, app: ASGIApp, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not (self.limiter.enabled and self.limiter._headers_enabled):
+            await self.app(scope, receive, send)
+            return
+        # request.state lives in this dict; slowapi leaves the limit it checked there
+        state = scope.setdefault("state", {})
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                current_limit = state.get("view_rate_limit")
+                if current_limit is not None:
+                    self._add_headers(message, current_limit)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    def _add_headers(self, message: Message, current_limit):
+        item, args = current_limit
+        try:
+            reset_at, remaining = self.limiter.limiter.get_window_stats(item, *args)
+        except Exception:
+            logger.exception("Error reading rate limit window")
+            return
+        reset_at = int(reset_at) + 1
+        headers = MutableHeaders(scope=message)
+        headers["X-RateLimit-Limit"] = str(item.amount)
+        headers["X-RateLimit-Remaining"] = str(remaining)
+        headers["X-RateLimit-Reset"] = str(reset_at)
+        # Other 429s (e.g. the daily query quota) are not about this window
+        if message["status"] == 429 and remaining == 0:
+            headers["Retry-After"] = str(max(int(reset_at - time.time()), 0))
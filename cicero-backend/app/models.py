@@ -1,5 +1,7 @@
 from pydantic import BaseModel, Field, validator
+from datetime import datetime
 from typing import List, Optional
+from app.config import settings
 
 # Valid US state codes
 VALID_STATE_CODES = {
@@ -12,6 +14,12 @@ VALID_STATE_CODES = {
 }
 
 
+def _validate_state_code(v: Optional[str]) -> str:
+    if v and v.upper() not in VALID_STATE_CODES:
+        raise ValueError(f"Invalid state code. Must be one of: {', '.join(sorted(VALID_STATE_CODES))}")
+    return v.upper() if v else "US"
+
+
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=2000)
     history: List[dict] = []  # e.g. [{"role": "user", "content": "..."}]
@@ -25,9 +33,7 @@ class ChatRequest(BaseModel):
 
     @validator("state")
     def validate_state(cls, v):
-        if v and v.upper() not in VALID_STATE_CODES:
-            raise ValueError(f"Invalid state code. Must be one of: {', '.join(sorted(VALID_STATE_CODES))}")
-        return v.upper() if v else "US"
+        return _validate_state_code(v)
 
 
 class ChatResponse(BaseModel):
@@ -36,6 +42,47 @@ class ChatResponse(BaseModel):
     thought_process: List[str] = []  # Optional: show the user what Cicero "thought"
 
 
+class ChatBatchRequest(BaseModel):
+    messages: List[str] = Field(..., min_length=1)  # Independent questions, answered concurrently
+    history: List[dict] = []  # Shared conversation context for every question
+    state: Optional[str] = "CA"
+    stream: bool = False  # Stream NDJSON lines as answers finish instead of one JSON body
+
+    @validator("messages")
+    def validate_messages(cls, v):
+        if len(v) > settings.CHAT_BATCH_MAX_ITEMS:
+            raise ValueError(f"At most {settings.CHAT_BATCH_MAX_ITEMS} messages per batch")
+        messages = [m.strip() for m in v]
+        if any(not m or len(m) > 2000 for m in messages):
+            raise ValueError("Each message must be 1-2000 characters")
+        return messages
+
+    @validator("state")
+    def validate_state(cls, v):
+        return _validate_state_code(v)
+
+
+class ChatBatchItem(BaseModel):
+    index: int  # Position in the request's messages
+    response: Optional[str] = None
+    citations: List[str] = []
+    thought_process: List[str] = []
+    error: Optional[str] = None  # Set instead of response when this question failed
+
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItem]  # In request order
+
+
+class ChatJobResponse(BaseModel):
+    id: str
+    status: str  # queued, running, succeeded or failed
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    result: Optional[ChatResponse] = None  # Set once the job has succeeded
+    error: Optional[str] = None  # Set if it failed
+
+
 class SubscriptionStatusResponse(BaseModel):
     tier: str
     queries_today: int
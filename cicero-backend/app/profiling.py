@@ -0,0 +1,261 @@
+"""
+On-demand request profiling.
+
+A request is profiled when an admin asks for it (`X-Profile: 1` together with
+a valid X-Admin-Token) or when it falls in the PROFILE_SAMPLE_RATE sample.
+A profiled request records a timeline of phases (auth, usage gate, each graph
+node, LLM call, tool, upstream fetch and DB statement). When pyinstrument is
+installed, the request also runs under its sampling profiler. Both are saved
+as one speedscope file (https://www.speedscope.app) in PROFILE_DIR and can be
+downloaded from /admin/profiles.
+
+When a request is not profiled, each `phase()` costs one contextvar lookup.
+"""
+import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# Only one sampling profiler runs per process at a time; overlapping profiled
+# requests get the phase timeline alone
+_sampler_busy = False
+
+
+@dataclass
+class Span:
+    name: str
+    lane: str  # asyncio task the phase ran in; phases within one task nest
+    start: float
+    end: float
+
+
+@dataclass
+class Profile:
+    id: str
+    method: str
+    path: str
+    start: float = field(default_factory=time.perf_counter)
+    end: Optional[float] = None
+    spans: List[Span] = field(default_factory=list)
+    sampler: object = None  # pyinstrument.Profiler, when one could be started
+
+    def add(self, name: str, start: float, end: float):
+        self.spans.append(Span(name, _lane(), start, end))
+
+    def summary(self) -> dict:
+        """Total time and count per phase (ms), slowest first"""
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, [0.0, 0])
+            total[0] += span.end - span.start
+            total[1] += 1
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 1),
+            "cpu_sampled": self.sampler is not None,
+            "phases": {
+                name: {"ms": round(seconds * 1000, 1), "count": count}
+                for name, (seconds, count) in sorted(totals.items(), key=lambda item: -item[1][0])
+            },
+        }
+
+
+_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("profile", default=None)
+
+
+def _lane() -> str:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task.get_name() if task is not None else "main"
+
+
+@contextmanager
+def phase(name: str):
+    """Record the block as a phase of the current profile (no-op when not profiling)"""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, start, time.perf_counter())
+
+
+def profiled(name: str):
+    """Decorator: record each call of an async function as a phase"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with phase(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_mode(headers) -> Optional[str]:
+    """"requested" for an admin's X-Profile: 1 request, "sampled" for a sampled one, else None"""
+    if settings.ADMIN_TOKEN and headers.get("x-profile") == "1":
+        token = headers.get("x-admin-token", "")
+        if hmac.compare_digest(token, settings.ADMIN_TOKEN):
+            return "requested"
+    if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+def start_profile(profile_id: str, method: str, path: str) -> contextvars.Token:
+    global _sampler_busy
+    profile = Profile(profile_id, method, path)
+    if not _sampler_busy:
+        try:
+            from pyinstrument import Profiler
+
+            profile.sampler = Profiler(interval=settings.PROFILE_INTERVAL_SECONDS, async_mode="enabled")
+            profile.sampler.start()
+            _sampler_busy = True
+        except ImportError:
+            profile.sampler = None
+        except Exception as e:
+            logger.warning("Could not start the sampling profiler: %s", e)
+            profile.sampler = None
+    return _profile.set(profile)
+
+
+def finish_profile(token: contextvars.Token) -> Profile:
+    """Stop profiling the current request; write the result with save_profile()"""
+    global _sampler_busy
+    profile = _profile.get()
+    _profile.reset(token)
+    profile.end = time.perf_counter()
+    if profile.sampler is not None:
+        profile.sampler.stop()
+        _sampler_busy = False
+    metrics.incr("profiling.requests")
+    return profile
+
+
+def _speedscope(profile: Profile) -> dict:
+    """The CPU samples (if any) and one evented timeline per task, in one speedscope file"""
+    if profile.sampler is not None:
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        document = json.loads(profile.sampler.output(SpeedscopeRenderer()))
+        for sampled in document["profiles"]:
+            sampled["name"] = f"CPU samples: {profile.method} {profile.path}"
+    else:
+        document = {"$schema": SPEEDSCOPE_SCHEMA, "shared": {"frames": []}, "profiles": []}
+    document["name"] = f"{profile.method} {profile.path} ({profile.id})"
+    document["exporter"] = "cicero"
+
+    frames = document["shared"]["frames"]
+    frame_index: Dict[str, int] = {}
+    lanes: Dict[str, List[Span]] = {}
+    for span in profile.spans:
+        lanes.setdefault(span.lane, []).append(span)
+    end = profile.end - profile.start
+
+    for lane, spans in lanes.items():
+        events, stack = [], []  # stack of (frame, clamped end)
+        for span in sorted(spans, key=lambda s: (s.start, -s.end)):
+            start = span.start - profile.start
+            while stack and stack[-1][1] <= start:
+                frame, closed_at = stack.pop()
+                events.append({"type": "C", "frame": frame, "at": closed_at})
+            if span.name not in frame_index:
+                frame_index[span.name] = len(frames)
+                frames.append({"name": span.name})
+            # speedscope needs strict nesting; clamp a phase that outlived its parent
+            span_end = span.end - profile.start
+            if stack:
+                span_end = min(span_end, stack[-1][1])
+            events.append({"type": "O", "frame": frame_index[span.name], "at": start})
+            stack.append((frame_index[span.name], span_end))
+        while stack:
+            frame, closed_at = stack.pop()
+            events.append({"type": "C", "frame": frame, "at": closed_at})
+        document["profiles"].append({
+            "type": "evented",
+            "name": f"Phases: {lane}",
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": end,
+            "events": events,
+        })
+    return document
+
+
+def _profile_dir() -> Path:
+    path = Path(settings.PROFILE_DIR)
+    return path if path.is_absolute() else BACKEND_DIR / path
+
+
+def save_profile(profile: Profile):
+    """Write the speedscope file and summary, keeping only the newest PROFILE_MAX_FILES (blocking)"""
+    directory = _profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{profile.id}.speedscope.json").write_text(json.dumps(_speedscope(profile)))
+    (directory / f"{profile.id}.summary.json").write_text(json.dumps(profile.summary()))
+
+    summaries = sorted(directory.glob("*.summary.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale in summaries[settings.PROFILE_MAX_FILES:]:
+        profile_id = stale.name[:-len(".summary.json")]
+        stale.unlink(missing_ok=True)
+        (directory / f"{profile_id}.speedscope.json").unlink(missing_ok=True)
+
+
+def list_profiles() -> List[dict]:
+    """Summaries of the stored profiles, newest first"""
+    directory = _profile_dir()
+    if not directory.exists():
+        return []
+    summaries = sorted(directory.glob("*.summary.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [json.loads(path.read_text()) for path in summaries]
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    """The stored speedscope file for `profile_id`, if there is one"""
+    path = _profile_dir() / f"{profile_id}.speedscope.json"
+    # IDs are request IDs ([A-Za-z0-9._-]); refuse anything that could leave the directory
+    if "/" in profile_id or profile_id.startswith(".") or not path.is_file():
+        return None
+    return path
+
+
+def install_db_hooks(engine):
+    """Record every DB statement as a phase ("db:SELECT", ...) of profiled requests"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _profile.get() is not None:
+            conn.info.setdefault("profile_starts", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        profile = _profile.get()
+        starts = conn.info.get("profile_starts")
+        if profile is not None and starts:
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+            profile.add(f"db:{verb}", starts.pop(), time.perf_counter())
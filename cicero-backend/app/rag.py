@@ -0,0 +1,418 @@
+"""
+Retrieval over the documents/ corpus.
+
+`python -m app.rag ingest` splits every .txt/.md file in RAG_DOCUMENTS_DIR
+into overlapping chunks, embeds them on the CPU and writes an index to
+RAG_INDEX_DIR:
+
+    vectors.f16     float16 rows (unit length), memory-mapped at query time
+    centroids.npy   IVF coarse centroids; rows are stored grouped by list
+    offsets.npy     start row of each IVF list (plus the total at the end)
+    chunks.json     chunk text and source, plus the embedder the index was built with
+
+A query scores the centroids, then only the RAG_NPROBE closest lists (small
+corpora use a single list, i.e. exact search). Embeddings come from fastembed
+(RAG_EMBEDDING_MODEL, ONNX on the CPU) when it is installed, otherwise from a
+dependency-free hashing embedder, which is what offline and test runs use.
+
+With RAG_BACKEND="pinecone", the same ingest upserts into PINECONE_INDEX_NAME
+instead, and search_documents queries it through the same VectorStore API.
+
+    python -m app.rag ingest          # build the index
+    python -m app.rag search "..."    # query it
+"""
+import hashlib
+import json
+import logging
+import math
+import re
+import sys
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+HASHING_EMBEDDER = "hashing-512"
+# Corpora smaller than this are searched exhaustively (one IVF list)
+IVF_MIN_CHUNKS = 2048
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_HEADING = re.compile(r"^\s*#{1,6}\s+")
+_RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")  # Markdown horizontal rule
+
+
+@dataclass
+class Chunk:
+    source: str  # Path relative to the documents directory
+    heading: str  # Nearest heading above the chunk, for context
+    text: str
+
+
+@dataclass
+class Passage:
+    source: str
+    heading: str
+    text: str
+    score: float
+
+
+def _resolve(path: str) -> Path:
+    resolved = Path(path)
+    return resolved if resolved.is_absolute() else BACKEND_DIR / resolved
+
+
+# --- Chunking ---
+
+def _clean_heading(line: str) -> str:
+    return _HEADING.sub("", line).replace("*", "").strip()
+
+
+def chunk_text(
+    text: str,
+    source: str,
+    max_chars: int = settings.RAG_CHUNK_CHARS,
+    overlap_chars: int = settings.RAG_CHUNK_OVERLAP_CHARS,
+) -> List[Chunk]:
+    """Split on headings and blank lines, then pack paragraphs into chunks of about `max_chars`.
+
+    Consecutive chunks within a section share up to `overlap_chars` of
+    trailing paragraphs, so a passage cut at a boundary is still found whole.
+    """
+    sections: List[tuple] = []  # (heading, [paragraphs])
+    heading, paragraphs, current = "", [], []
+    for line in text.splitlines() + [""]:
+        if _HEADING.match(line):
+            if current:
+                paragraphs.append(" ".join(current))
+                current = []
+            if paragraphs:
+                sections.append((heading, paragraphs))
+            heading, paragraphs = _clean_heading(line), []
+        elif line.strip() and not _RULE.match(line):
+            current.append(line.strip())
+        elif current:
+            paragraphs.append(" ".join(current))
+            current = []
+    if paragraphs:
+        sections.append((heading, paragraphs))
+
+    chunks = []
+    for heading, paragraphs in sections:
+        window: List[str] = []
+        for paragraph in _split_long(paragraphs, max_chars):
+            if window and sum(len(p) + 1 for p in window) + len(paragraph) > max_chars:
+                chunks.append(Chunk(source, heading, "\n".join(window)))
+                # Carry the tail of the window into the next chunk
+                carried: List[str] = []
+                for previous in reversed(window):
+                    if sum(len(p) + 1 for p in carried) + len(previous) > overlap_chars:
+                        break
+                    carried.insert(0, previous)
+                window = carried
+            window.append(paragraph)
+        if window:
+            chunks.append(Chunk(source, heading, "\n".join(window)))
+    return chunks
+
+
+def _split_long(paragraphs: List[str], max_chars: int) -> Iterable[str]:
+    """Break paragraphs longer than `max_chars` at sentence (or, failing that, word) boundaries"""
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(". ", 0, max_chars)
+            if cut < max_chars // 2:
+                cut = paragraph.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars - 1
+            yield paragraph[:cut + 1].strip()
+            paragraph = paragraph[cut + 1:].strip()
+        if paragraph:
+            yield paragraph
+
+
+def load_corpus(documents_dir: Optional[Path] = None) -> List[Chunk]:
+    documents_dir = documents_dir or _resolve(settings.RAG_DOCUMENTS_DIR)
+    chunks = []
+    for path in sorted(documents_dir.rglob("*")):
+        if path.suffix.lower() in (".txt", ".md") and path.is_file():
+            source = str(path.relative_to(documents_dir))
+            chunks.extend(chunk_text(path.read_text(encoding="utf-8"), source))
+    return chunks
+
+
+# --- Embedding ---
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word bigrams, log-scaled and L2-normalized.
+
+    Lexical rather than semantic, but needs no model download, so the index
+    can always be built and queried offline.
+    """
+
+    name = HASHING_EMBEDDER
+    dim = 512
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = _TOKEN.findall(text.lower())
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        np.copysign(np.log1p(np.abs(vector)), vector, out=vector)
+        return vector
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return _normalize(np.stack([self._embed_one(text) for text in texts]))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+class FastEmbedEmbedder:
+    """A fastembed (ONNX Runtime, CPU) sentence-embedding model"""
+
+    def __init__(self, model_name: str):
+        from fastembed import TextEmbedding
+
+        self.name = model_name
+        self._model = TextEmbedding(model_name)
+        self.dim = len(self.embed_query("dimension probe"))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return _normalize(np.stack(list(self._model.embed(texts))).astype(np.float32))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return _normalize(np.stack(list(self._model.query_embed(text))).astype(np.float32))[0]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def get_embedder(name: Optional[str] = None):
+    """The embedder called `name` (default: RAG_EMBEDDING_MODEL, or hashing without fastembed)"""
+    name = name or settings.RAG_EMBEDDING_MODEL
+    if name == HASHING_EMBEDDER:
+        return HashingEmbedder()
+    try:
+        return FastEmbedEmbedder(name)
+    except ImportError:
+        logger.warning("fastembed is not installed; using the %s embedder", HASHING_EMBEDDER)
+    except Exception as e:
+        logger.warning("Could not load embedding model %s (%s); using the %s embedder", name, e, HASHING_EMBEDDER)
+    return HashingEmbedder()
+
+
+# --- Vector stores ---
+
+class VectorStore:
+    """Top-k passage search; implementations are synchronous (call them from a thread)"""
+
+    def search(self, query: str, k: int) -> List[Passage]:
+        raise NotImplementedError
+
+    def ingest(self, chunks: List[Chunk]) -> dict:
+        raise NotImplementedError
+
+
+def _kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 20) -> np.ndarray:
+    """Spherical k-means (unit centroids, cosine assignment), seeded for reproducible builds"""
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), n_clusters * 256), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = sample[assignment == cluster]
+            # An empty cluster keeps its old centroid
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class LocalVectorStore(VectorStore):
+    """IVF index over a memory-mapped float16 matrix in `index_dir`"""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        self._vectors: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._chunks: List[dict] = []
+        self._embedder = None
+
+    def exists(self) -> bool:
+        return (self.index_dir / "chunks.json").exists()
+
+    def load(self):
+        meta = json.loads((self.index_dir / "chunks.json").read_text(encoding="utf-8"))
+        self._chunks = meta["chunks"]
+        self._embedder = get_embedder(meta["embedder"])
+        if self._embedder.name != meta["embedder"]:
+            raise RuntimeError(
+                f"Index was built with {meta['embedder']}, which is not available; re-run `python -m app.rag ingest`"
+            )
+        shape = (len(self._chunks), meta["dim"])
+        if self._chunks:
+            self._vectors = np.memmap(self.index_dir / "vectors.f16", dtype=np.float16, mode="r", shape=shape)
+        else:
+            self._vectors = np.zeros(shape, dtype=np.float16)  # mmap can't map an empty file
+        self._centroids = np.load(self.index_dir / "centroids.npy")
+        self._offsets = np.load(self.index_dir / "offsets.npy")
+        logger.info("Loaded RAG index: %d chunks, %d lists, %s", len(self._chunks), len(self._centroids), meta["embedder"])
+
+    def search(self, query: str, k: int) -> List[Passage]:
+        if self._vectors is None:
+            self.load()
+        if not self._chunks:
+            return []
+        q = self._embedder.embed_query(query)
+
+        # Probe the closest IVF lists; with one list this is an exact scan
+        n_probe = min(settings.RAG_NPROBE, len(self._centroids))
+        lists = np.argsort(self._centroids @ q)[::-1][:n_probe]
+        rows = np.concatenate([np.arange(self._offsets[i], self._offsets[i + 1]) for i in lists])
+        if not len(rows):
+            return []
+        scores = self._vectors[rows].astype(np.float32) @ q
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            Passage(score=float(scores[i]), **self._chunks[rows[i]])
+            for i in top
+        ]
+
+    def ingest(self, chunks: List[Chunk]) -> dict:
+        embedder = get_embedder()
+        vectors = embedder.embed([f"{c.heading}\n{c.text}" for c in chunks]) if chunks else np.zeros((0, embedder.dim), np.float32)
+
+        n_lists = 1 if len(chunks) < IVF_MIN_CHUNKS else int(math.sqrt(len(chunks)))
+        if n_lists == 1:
+            centroids = _normalize(vectors.sum(axis=0, keepdims=True)) if len(vectors) else np.zeros((1, embedder.dim), np.float32)
+            assignment = np.zeros(len(vectors), dtype=np.int64)
+        else:
+            centroids = _kmeans(vectors, n_lists)
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+        # Store rows grouped by list, so probing a list reads one contiguous slice
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+
+        # Write next to the live index, then swap files in, so a running worker never sees a half-built one
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        staged = {}
+        for name, write in (
+            ("vectors.f16", lambda f: vectors[order].astype(np.float16).tofile(f)),
+            ("centroids.npy", lambda f: np.save(f, centroids.astype(np.float32))),
+            ("offsets.npy", lambda f: np.save(f, offsets.astype(np.int64))),
+            ("chunks.json", lambda f: f.write(json.dumps({
+                "embedder": embedder.name,
+                "dim": embedder.dim,
+                "chunks": [asdict(chunks[i]) for i in order],
+            }).encode())),
+        ):
+            staged[name] = self.index_dir / f"{name}.tmp"
+            with open(staged[name], "wb") as f:
+                write(f)
+        for name, path in staged.items():
+            path.replace(self.index_dir / name)
+        self._vectors = None  # Reload on next search
+        return {"chunks": len(chunks), "lists": n_lists, "dim": embedder.dim, "embedder": embedder.name}
+
+
+class PineconeVectorStore(VectorStore):
+    """Chunks stored in a Pinecone index, with their text in the vector metadata"""
+
+    def __init__(self):
+        from pinecone import Pinecone
+
+        self._index = Pinecone(api_key=settings.PINECONE_API_KEY).Index(settings.PINECONE_INDEX_NAME)
+        self._embedder = get_embedder()
+
+    def search(self, query: str, k: int) -> List[Passage]:
+        result = self._index.query(
+            vector=self._embedder.embed_query(query).tolist(),
+            top_k=k,
+            namespace=settings.PINECONE_NAMESPACE,
+            include_metadata=True,
+        )
+        return [
+            Passage(
+                source=match.metadata.get("source", ""),
+                heading=match.metadata.get("heading", ""),
+                text=match.metadata.get("text", ""),
+                score=float(match.score),
+            )
+            for match in result.matches
+        ]
+
+    def ingest(self, chunks: List[Chunk]) -> dict:
+        vectors = self._embedder.embed([f"{c.heading}\n{c.text}" for c in chunks])
+        records = [
+            {
+                # Stable IDs, so re-ingesting overwrites instead of duplicating
+                "id": hashlib.sha1(f"{c.source}\n{c.text}".encode()).hexdigest(),
+                "values": vector.tolist(),
+                "metadata": asdict(c),
+            }
+            for c, vector in zip(chunks, vectors)
+        ]
+        for start in range(0, len(records), 100):
+            self._index.upsert(vectors=records[start:start + 100], namespace=settings.PINECONE_NAMESPACE)
+        return {"chunks": len(chunks), "dim": self._embedder.dim, "embedder": self._embedder.name}
+
+
+_store: Optional[VectorStore] = None
+
+
+def get_vector_store() -> VectorStore:
+    """The configured store (RAG_BACKEND), created on first use"""
+    global _store
+    if _store is None:
+        if settings.RAG_BACKEND == "pinecone":
+            _store = PineconeVectorStore()
+        else:
+            _store = LocalVectorStore(_resolve(settings.RAG_INDEX_DIR))
+    return _store
+
+
+def search(query: str, k: int = settings.RAG_TOP_K) -> List[Passage]:
+    """Top-k passages for `query` from the configured store"""
+    start = time.perf_counter()
+    passages = get_vector_store().search(query, k)
+    metrics.observe("rag.search_seconds", time.perf_counter() - start)
+    return passages
+
+
+def ingest() -> dict:
+    """Chunk and embed RAG_DOCUMENTS_DIR into the configured store"""
+    start = time.perf_counter()
+    report = get_vector_store().ingest(load_corpus())
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    return report
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "ingest":
+        print(ingest())
+    elif command == "search" and len(sys.argv) > 2:
+        start = time.perf_counter()
+        results = search(" ".join(sys.argv[2:]))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for passage in results:
+            print(f"{passage.score:.3f}  {passage.source} > {passage.heading}\n    {passage.text[:200]}")
+        print(f"({elapsed_ms:.1f} ms)")
+    else:
+        print(__doc__.rsplit("\n\n", 1)[-1])
+        sys.exit(2)
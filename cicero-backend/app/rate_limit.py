@@ -1,9 +1,290 @@
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request
+from limits.storage import Storage
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from fastapi import Request
+from sqlalchemy import case, create_engine, delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+from app.database import RateLimitCounter
+
+logger = logging.getLogger(__name__)
+
+
+class SQLCounterBackend:
+    """Shared window counters in the rate_limit_counters table (Postgres or SQLite)"""
+
+    def __init__(self, url: str):
+        if url.startswith("postgres://"):
+            url = "postgresql://" + url[len("postgres://"):]
+        parsed = make_url(url)
+        if parsed.get_backend_name() == "postgresql":
+            parsed = parsed.set(drivername="postgresql+psycopg2")
+            # Only the sync thread uses this engine, so one connection is plenty
+            self.engine = create_engine(parsed, pool_size=1, max_overflow=0, pool_pre_ping=True)
+            self._insert = postgresql.insert
+        else:
+            self.engine = create_engine(parsed)
+            self._insert = sqlite.insert
+        self._syncs = 0
+
+    def sync(self, deltas: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[int, float]]:
+        """Add `amount` to each key (creating it with `expiry` seconds to live) and return the totals"""
+        now = time.time()
+        table = RateLimitCounter.__table__
+        totals = {}
+        with self.engine.begin() as conn:
+            for key, (amount, expiry) in deltas.items():
+                stmt = self._insert(table).values(key=key, count=amount, expires_at=now + expiry)
+                expired = table.c.expires_at <= now
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["key"],
+                    set_={
+                        "count": case((expired, stmt.excluded.count), else_=table.c.count + stmt.excluded.count),
+                        "expires_at": case((expired, stmt.excluded.expires_at), else_=table.c.expires_at),
+                    },
+                ).returning(table.c.count, table.c.expires_at)
+                count, expires_at = conn.execute(stmt).one()
+                totals[key] = (count, expires_at)
+
+            self._syncs += 1
+            if self._syncs % 100 == 0:
+                conn.execute(delete(table).where(table.c.expires_at <= now))
+        return totals
+
+    def read(self, keys: List[str]) -> Dict[str, Tuple[int, float]]:
+        """Current totals for the keys that exist and haven't expired"""
+        table = RateLimitCounter.__table__
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.key, table.c.count, table.c.expires_at)
+                .where(table.c.key.in_(keys), table.c.expires_at > time.time())
+            )
+            return {key: (count, expires_at) for key, count, expires_at in rows}
+
+    def clear(self, prefix: str):
+        table = RateLimitCounter.__table__
+        with self.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.key.startswith(prefix)))
+
+
+class RedisCounterBackend:
+    """Shared window counters in any Redis-protocol server (Redis, Valkey, a local stand-in)"""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("RATE_LIMIT_STORAGE_URL is a redis:// URL but the `redis` package is not installed")
+        self.client = redis.Redis.from_url(url)
+
+    def sync(self, deltas: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[int, float]]:
+        pipe = self.client.pipeline(transaction=False)
+        for key, (amount, expiry) in deltas.items():
+            pipe.set(key, 0, ex=expiry, nx=True)
+            pipe.incrby(key, amount)
+            pipe.pttl(key)
+        replies = pipe.execute()
+        now = time.time()
+        totals = {}
+        for index, key in enumerate(deltas):
+            count, ttl_ms = replies[index * 3 + 1], replies[index * 3 + 2]
+            totals[key] = (int(count), now + max(ttl_ms, 0) / 1000)
+        return totals
+
+    def read(self, keys: List[str]) -> Dict[str, Tuple[int, float]]:
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+            pipe.pttl(key)
+        replies = pipe.execute()
+        now = time.time()
+        totals = {}
+        for index, key in enumerate(keys):
+            count, ttl_ms = replies[index * 2], replies[index * 2 + 1]
+            if count is not None:
+                totals[key] = (int(count), now + max(ttl_ms, 0) / 1000)
+        return totals
+
+    def clear(self, prefix: str):
+        for key in self.client.scan_iter(match=f"{prefix}*"):
+            self.client.delete(key)
+
+
+def _backend_from_url(url: str):
+    if url == "database":
+        url = settings.DATABASE_URL
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCounterBackend(url)
+    return SQLCounterBackend(url)
+
 
-limiter = Limiter(key_func=get_remote_address)
+class SharedWindowStorage(Storage):
+    """
+    `limits` storage whose counters are shared across worker processes.
+
+    Each process answers from an in-process sliding-window estimate built
+    from aligned fixed windows (previous window weighted by how much of it
+    still overlaps, plus the current one). A background thread pushes local
+    increments to the shared backend in batches and pulls back the global
+    totals, so the shared store is touched once per sync, not per request.
+    Only keys with new local hits are written. Keys that are idle here but
+    still inside their window are re-read every `refresh_interval` seconds.
+    Between syncs a key can overshoot by at most what other workers added
+    since this process last synced or refreshed it.
+    """
+
+    STORAGE_SCHEME = ["cicero"]
+
+    def __init__(self, uri: Optional[str] = None, backend_url: str = "database", sync_interval: float = 1.0,
+                 sync_batch: int = 10, refresh_interval: float = 10.0, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.backend = _backend_from_url(backend_url)
+        self.sync_interval = float(sync_interval)
+        self.sync_batch = int(sync_batch)
+        self.refresh_interval = float(refresh_interval)
+        self._lock = threading.Lock()
+        self._shared: Dict[str, int] = {}  # window key -> last known global count
+        self._pending: Dict[str, int] = {}  # window key -> local hits not yet synced
+        self._expiry: Dict[str, int] = {}  # limit key -> window length
+        self._touched: Dict[str, float] = {}  # window key -> when it stops mattering
+        self._synced: Dict[str, float] = {}  # window key -> when the global count was last fetched
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._sync_loop, name="rate-limit-sync", daemon=True).start()
+
+    @property
+    def base_exceptions(self):
+        return Exception
+
+    def _window_keys(self, key: str, expiry: int, now: float):
+        index = int(now // expiry)
+        return f"{key}:{index}", f"{key}:{index - 1}", (now % expiry) / expiry
+
+    def _estimate(self, key: str, expiry: int, now: float) -> int:
+        current, previous, elapsed = self._window_keys(key, expiry, now)
+        current_total = self._shared.get(current, 0) + self._pending.get(current, 0)
+        previous_total = self._shared.get(previous, 0) + self._pending.get(previous, 0)
+        return math.ceil(previous_total * (1 - elapsed) + current_total)
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        with self._lock:
+            self._expiry[key] = expiry
+            current, _, _ = self._window_keys(key, expiry, now)
+            self._pending[current] = self._pending.get(current, 0) + amount
+            # Keep syncing the key while it can still weigh in as the previous window
+            self._touched[current] = (int(now // expiry) + 2) * expiry
+            if self._pending[current] >= self.sync_batch:
+                self._wakeup.set()
+            return self._estimate(key, expiry, now)
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            expiry = self._expiry.get(key)
+            return self._estimate(key, expiry, time.time()) if expiry else 0
+
+    def get_expiry(self, key: str) -> float:
+        expiry = self._expiry.get(key)
+        if not expiry:
+            return time.time()
+        return (int(time.time() // expiry) + 1) * expiry
+
+    def check(self) -> bool:
+        try:
+            self.backend.sync({})
+            return True
+        except Exception:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self._lock:
+            count = len(self._touched)
+            self._shared.clear()
+            self._pending.clear()
+            self._touched.clear()
+            self._synced.clear()
+        return count
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            for window_key in [k for k in self._touched if k.startswith(f"{key}:")]:
+                self._shared.pop(window_key, None)
+                self._pending.pop(window_key, None)
+                self._touched.pop(window_key, None)
+                self._synced.pop(window_key, None)
+        self.backend.clear(f"{key}:")
+
+    def _sync_loop(self):
+        while True:
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
+            try:
+                self._sync_once()
+            except Exception as e:
+                logger.warning("Error syncing rate limit counters: %s", e)
+
+    def _sync_once(self):
+        now = time.time()
+        with self._lock:
+            for window_key in [k for k, until in self._touched.items() if until <= now]:
+                self._shared.pop(window_key, None)
+                self._pending.pop(window_key, None)
+                self._synced.pop(window_key, None)
+                del self._touched[window_key]
+            deltas = {
+                window_key: (amount, max(int(self._touched[window_key] - now), 1))
+                for window_key, amount in self._pending.items()
+            }
+            # No new hits here: only catch up on what the other workers added, and less often
+            stale = [
+                window_key for window_key in self._touched
+                if window_key not in deltas and self._synced.get(window_key, 0) + self.refresh_interval <= now
+            ]
+        if not deltas and not stale:
+            return
+
+        totals = self.backend.sync(deltas) if deltas else {}
+        if stale:
+            totals.update(self.backend.read(stale))
+        with self._lock:
+            for window_key, (amount, _) in deltas.items():
+                pending = self._pending.get(window_key, 0) - amount
+                if pending > 0:
+                    self._pending[window_key] = pending
+                else:
+                    self._pending.pop(window_key, None)
+            for window_key in list(deltas) + stale:
+                if window_key in self._touched:
+                    # Missing from the store: expired there, so nothing counts against it
+                    self._shared[window_key] = totals.get(window_key, (0, 0))[0]
+                    self._synced[window_key] = now
+
+
+def _build_limiter() -> Limiter:
+    if not settings.RATE_LIMIT_STORAGE_URL:
+        # Per-process memory storage: fine for a single worker
+        return Limiter(key_func=get_remote_address)
+    return Limiter(
+        key_func=get_remote_address,
+        storage_uri="cicero://",
+        storage_options={
+            "backend_url": settings.RATE_LIMIT_STORAGE_URL,
+            "sync_interval": settings.RATE_LIMIT_SYNC_SECONDS,
+            "sync_batch": settings.RATE_LIMIT_SYNC_BATCH,
+            "refresh_interval": settings.RATE_LIMIT_REFRESH_SECONDS,
+        },
+    )
+
+
+limiter = _build_limiter()
 
 
 def get_user_id_for_rate_limit(request: Request) -> str:
@@ -13,4 +294,3 @@ def get_user_id_for_rate_limit(request: Request) -> str:
         return str(request.state.user_id)
     # Fall back to IP address
     return get_remote_address(request)
-
@@ -0,0 +1,137 @@
+"""
+UsageLog partition maintenance and retention.
+
+On Postgres `usage_logs` is range-partitioned by month. This module creates
+partitions ahead of time and drops whole partitions once they fall outside
+the retention window, which is a cheap catalog operation instead of a large
+DELETE. Run it once with `python -m app.retention`; the API also runs it daily.
+
+Rows outside every monthly partition (e.g. from a skewed clock) land in the
+DEFAULT partition, and Postgres refuses to create a partition for a month
+the DEFAULT partition holds rows for. Such rows are moved into their own
+month's partition as it is created, so the DEFAULT partition stays empty.
+"""
+import asyncio
+import logging
+import re
+from datetime import date, datetime
+
+from sqlalchemy import delete, text
+
+from app.config import settings
+from app.database import engine, UsageLog
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_NAME = re.compile(r"^usage_logs_y(\d{4})m(\d{2})$")
+_DEFAULT_PARTITION = "usage_logs_default"
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+async def _partition_months(conn) -> dict:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'usage_logs'"
+    ))
+    months = {}
+    for (name,) in result:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            months[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+async def _default_partition_months(conn) -> set:
+    """Months that rows in the DEFAULT partition belong to"""
+    if (await conn.execute(text(f"SELECT to_regclass('{_DEFAULT_PARTITION}')"))).scalar() is None:
+        return set()
+    result = await conn.execute(text(f"SELECT DISTINCT date_trunc('month', timestamp) FROM {_DEFAULT_PARTITION}"))
+    return {month.date() for (month,) in result}
+
+
+async def _create_partition(conn, month: date, move_default_rows: bool) -> str:
+    name = f"usage_logs_y{month:%Y}m{month:%m}"
+    bounds = f"FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    if not move_default_rows:
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF usage_logs FOR VALUES {bounds}"))
+        return name
+    # Build the partition standalone, move the month's rows out of DEFAULT into it, then attach it
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE usage_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {_DEFAULT_PARTITION} "
+        f"WHERE timestamp >= '{month.isoformat()}' AND timestamp < '{_add_months(month, 1).isoformat()}' RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    await conn.execute(text(f"ALTER TABLE usage_logs ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    logger.warning("Moved %d UsageLog rows from %s into %s", moved.rowcount, _DEFAULT_PARTITION, name)
+    return name
+
+
+async def maintain_usage_log_partitions(
+    months_ahead: int = settings.USAGE_LOG_PARTITION_MONTHS_AHEAD,
+    retention_months: int = settings.USAGE_LOG_RETENTION_MONTHS,
+) -> dict:
+    """Create upcoming monthly partitions and drop expired ones.
+
+    `retention_months` of 0 keeps everything. Returns the partitions created
+    and dropped (or rows deleted on databases without partitioning).
+    """
+    this_month = datetime.utcnow().date().replace(day=1)
+    cutoff = _add_months(this_month, -retention_months) if retention_months > 0 else None
+    report = {"created": [], "dropped": [], "rows_deleted": 0}
+
+    async with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            # Dev/test databases are not partitioned; a plain DELETE is fine at their size
+            if cutoff:
+                result = await conn.execute(delete(UsageLog).where(UsageLog.timestamp < datetime.combine(cutoff, datetime.min.time())))
+                report["rows_deleted"] = result.rowcount
+            return report
+
+        existing = await _partition_months(conn)
+        stray = await _default_partition_months(conn)
+        if cutoff and any(month < cutoff for month in stray):
+            expired = await conn.execute(text(
+                f"DELETE FROM {_DEFAULT_PARTITION} WHERE timestamp < '{cutoff.isoformat()}'"
+            ))
+            report["rows_deleted"] = expired.rowcount
+            stray = {month for month in stray if month >= cutoff}
+
+        upcoming = {_add_months(this_month, offset) for offset in range(months_ahead + 1)}
+        for month in sorted(upcoming | stray):
+            if month in existing:
+                continue
+            report["created"].append(await _create_partition(conn, month, move_default_rows=month in stray))
+
+        if cutoff:
+            for month, name in sorted(existing.items()):
+                if month < cutoff:
+                    await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                    report["dropped"].append(name)
+    return report
+
+
+async def run_retention_forever():
+    """Background task: maintain partitions at startup and then once a day"""
+    while True:
+        try:
+            report = await maintain_usage_log_partitions()
+            if report["created"] or report["dropped"] or report["rows_deleted"]:
+                logger.info("UsageLog retention: %s", report)
+        except Exception as e:
+            logger.exception("Error maintaining UsageLog partitions")
+        await asyncio.sleep(24 * 60 * 60)
+
+
+if __name__ == "__main__":
+    async def _main():
+        print(await maintain_usage_log_partitions())
+        await engine.dispose()
+
+    asyncio.run(_main())
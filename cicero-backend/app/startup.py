@@ -0,0 +1,169 @@
+"""
+Startup subsystem: lazily built heavy clients, optional warm-up and readiness.
+
+Importing `main` only defines routes. The LangGraph agent, the Groq client
+and the Firebase/Stripe SDKs are imported and constructed on first use, or
+up front by `initialize()` from the FastAPI lifespan. `/ready` reports 503
+until that (and the optional warm-up) has finished.
+
+`python -m app.startup` prints a per-module import-time report for `main`.
+"""
+import asyncio
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+_ready = False
+
+
+def is_ready() -> bool:
+    return _ready
+
+
+def get_app_graph():
+    """The compiled agent graph; importing app.agent pulls in LangGraph and langchain_groq"""
+    from app.agent import get_app_graph as _get_app_graph
+    return _get_app_graph()
+
+
+def _build_clients():
+    from app.agent import get_llm_with_tools
+    from app.subscription import _stripe
+
+    get_app_graph()
+    get_llm_with_tools()
+    _stripe()
+    if settings.USE_RAG:
+        _load_document_index()
+
+
+def _load_document_index():
+    """Map the local document index (and load its embedding model) before the first question"""
+    from app.rag import get_vector_store, LocalVectorStore
+
+    store = get_vector_store()
+    if isinstance(store, LocalVectorStore):
+        if store.exists():
+            try:
+                store.load()
+            except Exception:
+                # search_documents answers "not available" until the index is fixed; everything else works
+                logger.exception("Could not load the document index; starting without document search")
+        else:
+            logger.warning("USE_RAG is set but there is no document index; run `python -m app.rag ingest`")
+
+
+async def _warm_database():
+    if engine.dialect.name == "sqlite":
+        return
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # Check out a full pool's worth of connections at once so all of them get opened
+    await asyncio.gather(*(ping() for _ in range(settings.DB_POOL_SIZE)))
+
+
+async def _warm_upstreams():
+    from app.tools.legal_search import get_http_client
+
+    client = get_http_client()
+    # Any response is fine: the point is an open, pooled TLS connection
+    for url in ("https://www.courtlistener.com/api/rest/v4/", "https://api.legiscan.com/"):
+        await client.head(url)
+
+
+async def _warm_llm():
+    from app.agent import get_llm
+
+    # Listing models is free and opens the Groq SDK's pooled connection
+    await get_llm().async_client._client.models.list()
+
+
+async def warm_up():
+    """Pre-establish DB, upstream API and LLM connections"""
+    for name, step in (("database", _warm_database), ("upstreams", _warm_upstreams), ("llm", _warm_llm)):
+        start = time.perf_counter()
+        try:
+            await step()
+            logger.info("Warm-up %s: %.0f ms", name, (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.warning("Warm-up %s failed: %s", name, e)
+
+
+def _stop_process():
+    # Same as the platform stopping us: uvicorn shuts down gracefully and the process exits
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def initialize():
+    """Build heavy clients (in a thread, since it is mostly imports) and optionally warm up.
+
+    If that fails the process stops rather than staying up with /ready at 503
+    for good, so the failure shows up as a failed deploy or a restart.
+    """
+    global _ready
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(_build_clients)
+        logger.info("Clients initialized in %.0f ms", (time.perf_counter() - start) * 1000)
+        if settings.WARMUP_ON_STARTUP:
+            await warm_up()
+    except Exception:
+        logger.exception("Startup failed; stopping the process")
+        _stop_process()
+        return
+    _ready = True
+
+
+async def shutdown():
+    global _ready
+    from app.subscription import shutdown_stripe_executor
+    from app.tools.legal_search import close_http_client
+
+    _ready = False
+    await close_http_client()
+    shutdown_stripe_executor()
+
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_time_report(module: str = "main") -> list:
+    """Import `module` in a fresh interpreter and return (module, self_ms, cumulative_ms) rows, slowest first"""
+    backend_dir = Path(__file__).resolve().parent.parent
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=backend_dir, env=os.environ.copy(), capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            rows.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "main"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rows = import_time_report(target)
+    print(f"{'module':<60} {'self ms':>9} {'cumul ms':>9}")
+    for name, self_ms, cumulative_ms in rows[:limit]:
+        print(f"{name:<60} {self_ms:9.1f} {cumulative_ms:9.1f}")
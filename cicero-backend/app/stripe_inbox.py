@@ -0,0 +1,193 @@
+"""
+Durable inbox for Stripe webhook events.
+
+The webhook endpoint only verifies the signature and inserts the event here
+(duplicates from Stripe retries are ignored by event ID). A background worker
+applies pending events oldest-first, each in the same transaction that marks
+it processed, so every event takes effect exactly once. Only one process
+drains the inbox at a time (a Postgres advisory lock), which keeps events for
+the same customer in order.
+
+    python -m app.stripe_inbox process            # drain pending events now
+    python -m app.stripe_inbox replay [evt_...]   # re-apply specific events
+    python -m app.stripe_inbox replay --since 2026-10-01T00:00:00
+"""
+import asyncio
+import json
+import logging
+import sys
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.auth import invalidate_user
+from app.config import settings
+from app.database import engine, SessionLocal, StripeWebhookEvent
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant identifying the inbox worker's advisory lock
+_ADVISORY_LOCK_KEY = 0x53545250  # "STRP"
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _wakeup_event() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+async def record_event(payload: bytes):
+    """Insert a verified event into the inbox (no-op if Stripe already delivered it)"""
+    # Work from the raw JSON: newer SDKs return StripeObjects that are not dicts
+    event = json.loads(payload)
+    data = event["data"]["object"]
+    values = {
+        "id": event["id"],
+        "type": event["type"],
+        "customer_id": data.get("customer"),
+        "created": int(event.get("created") or 0),
+        "payload": payload.decode("utf-8"),
+        "received_at": datetime.utcnow(),
+        "attempts": 0,
+    }
+    async with engine.begin() as conn:
+        dialect_insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+        stmt = dialect_insert(StripeWebhookEvent).values(**values).on_conflict_do_nothing(index_elements=["id"])
+        result = await conn.execute(stmt)
+    metrics.incr("stripe_inbox.received" if result.rowcount else "stripe_inbox.duplicates")
+    _wakeup_event().set()
+
+
+async def _apply_one(event_id: str) -> bool:
+    """Apply one pending event; returns False if it failed and was left pending"""
+    from app.subscription import apply_stripe_event
+
+    async with SessionLocal() as db:
+        row = (await db.execute(
+            select(StripeWebhookEvent).where(
+                StripeWebhookEvent.id == event_id, StripeWebhookEvent.processed_at.is_(None)
+            )
+        )).scalars().first()
+        if row is None:
+            return True
+        try:
+            event = json.loads(row.payload)
+            firebase_uids = await apply_stripe_event(db, event["type"], event["data"]["object"])
+            row.processed_at = datetime.utcnow()
+            row.attempts += 1
+            row.last_error = None
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            await db.execute(
+                update(StripeWebhookEvent)
+                .where(StripeWebhookEvent.id == event_id)
+                .values(attempts=StripeWebhookEvent.attempts + 1, last_error=str(e)[:2000])
+            )
+            await db.commit()
+            metrics.incr("stripe_inbox.failures")
+            logger.warning("Error applying Stripe event %s: %s", event_id, e)
+            return False
+
+    for firebase_uid in firebase_uids:
+        invalidate_user(firebase_uid)
+    metrics.incr("stripe_inbox.applied")
+    return True
+
+
+async def _drain(limit: int) -> int:
+    async with SessionLocal() as db:
+        pending = (await db.execute(
+            select(StripeWebhookEvent.id, StripeWebhookEvent.customer_id)
+            .where(
+                StripeWebhookEvent.processed_at.is_(None),
+                StripeWebhookEvent.attempts < settings.STRIPE_INBOX_MAX_ATTEMPTS,
+            )
+            .order_by(StripeWebhookEvent.created, StripeWebhookEvent.received_at)
+            .limit(limit)
+        )).all()
+
+    applied = 0
+    blocked_customers = set()
+    for event_id, customer_id in pending:
+        # After a failure, hold back that customer's later events so they stay in order
+        if customer_id and customer_id in blocked_customers:
+            continue
+        if await _apply_one(event_id):
+            applied += 1
+        elif customer_id:
+            blocked_customers.add(customer_id)
+    return applied
+
+
+async def process_pending(limit: int = 100) -> int:
+    """Apply pending events oldest-first; returns how many were applied"""
+    async with engine.connect() as lock_conn:
+        if lock_conn.dialect.name != "postgresql":
+            return await _drain(limit)
+        # A session-level lock outlives the statement that took it, so in autocommit
+        # mode this connection holds it without sitting idle in a transaction
+        await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        got_lock = await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+        if not got_lock:
+            return 0  # Another process is draining the inbox
+        try:
+            return await _drain(limit)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY})
+
+
+async def run_inbox_worker_forever():
+    """Background task: drain the inbox whenever an event arrives (and poll for other processes' events)"""
+    wakeup = _wakeup_event()
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), settings.STRIPE_INBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        try:
+            while await process_pending() > 0:
+                pass
+        except Exception as e:
+            logger.exception("Error processing Stripe inbox")
+
+
+async def replay_events(event_ids: Iterable[str] = (), since: Optional[datetime] = None) -> int:
+    """Mark events as pending again so the worker re-applies them"""
+    event_ids = list(event_ids)
+    stmt = update(StripeWebhookEvent).values(processed_at=None, attempts=0, last_error=None)
+    if event_ids:
+        stmt = stmt.where(StripeWebhookEvent.id.in_(event_ids))
+    elif since is not None:
+        stmt = stmt.where(StripeWebhookEvent.received_at >= since)
+    else:
+        raise ValueError("Pass event IDs or a `since` timestamp to replay")
+    async with engine.begin() as conn:
+        result = await conn.execute(stmt)
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    async def _main(args):
+        if args[:1] == ["replay"]:
+            if args[1:2] == ["--since"]:
+                count = await replay_events(since=datetime.fromisoformat(args[2]))
+            else:
+                count = await replay_events(args[1:])
+            print(f"Marked {count} events for replay")
+        elif args[:1] != ["process"]:
+            print(__doc__)
+            return
+        total = 0
+        while (applied := await process_pending()) > 0:
+            total += applied
+        print(f"Applied {total} events")
+        await engine.dispose()
+
+    asyncio.run(_main(sys.argv[1:]))
@@ -1,31 +1,94 @@
-import stripe
+import asyncio
+import functools
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 from fastapi import HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.cache import TTLCache
 from app.database import get_db, User, SubscriptionTier
-from app.auth import get_current_user
+from app.auth import get_current_user, invalidate_user, FREE_DAILY_QUERY_LIMIT
 from app.config import settings
 from datetime import datetime
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+# Reused sessions must stay open long enough for the user to finish paying
+CHECKOUT_REUSE_MARGIN_SECONDS = 15 * 60
+
+_stripe_module = None
+_executor: Optional[ThreadPoolExecutor] = None
+_checkout_sessions = TTLCache(max_size=settings.STRIPE_CHECKOUT_CACHE_SIZE)
+_checkout_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _stripe():
+    """Import and configure the Stripe SDK on first use (it is slow to import)"""
+    global _stripe_module
+    if _stripe_module is None:
+        import stripe
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        if settings.STRIPE_API_BASE:
+            stripe.api_base = settings.STRIPE_API_BASE
+        _stripe_module = stripe
+    return _stripe_module
+
 
+async def _stripe_call(fn, *args, **kwargs):
+    """Run a blocking Stripe SDK call on the bounded Stripe thread pool"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.STRIPE_MAX_WORKERS, thread_name_prefix="stripe")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
 
-def create_checkout_session(user: User, db: Session) -> dict:
+
+def shutdown_stripe_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+async def create_checkout_session(user: User, db: AsyncSession) -> dict:
     """Create Stripe Checkout session for Premium subscription"""
+    # Serialize taps from the same user so they share one customer and one session
+    lock = _checkout_locks.get(user.firebase_uid)
+    if lock is None:
+        lock = _checkout_locks[user.firebase_uid] = asyncio.Lock()
+    async with lock:
+        cached = _checkout_sessions.get(user.firebase_uid)
+        if cached and cached["price_id"] == settings.STRIPE_PREMIUM_PRICE_ID:
+            return {"checkout_url": cached["checkout_url"], "session_id": cached["session_id"]}
+        return await _create_checkout_session(user, db)
+
+
+async def _create_checkout_session(user: User, db: AsyncSession) -> dict:
+    stripe = _stripe()
     try:
-        # Create or get Stripe customer
-        if not user.stripe_customer_id:
-            customer = stripe.Customer.create(
+        # Create a Stripe customer once; afterwards the stored ID is all we need
+        customer_id = user.stripe_customer_id
+        if not customer_id:
+            customer = await _stripe_call(
+                stripe.Customer.create,
                 email=user.email,
-                metadata={"firebase_uid": user.firebase_uid}
+                metadata={"firebase_uid": user.firebase_uid},
+                # Concurrent requests from other workers get the same customer back
+                idempotency_key=f"customer-{user.firebase_uid}",
+            )
+            customer_id = customer.id
+            await db.execute(
+                update(User).where(User.id == user.id).values(stripe_customer_id=customer_id)
             )
-            user.stripe_customer_id = customer.id
-            db.commit()
-        else:
-            customer = stripe.Customer.retrieve(user.stripe_customer_id)
+            await db.commit()
+            invalidate_user(user.firebase_uid)
+            user.stripe_customer_id = customer_id
 
         # Create checkout session
-        checkout_session = stripe.checkout.Session.create(
-            customer=customer.id,
+        checkout_session = await _stripe_call(
+            stripe.checkout.Session.create,
+            customer=customer_id,
             payment_method_types=["card"],
             line_items=[{
                 "price": settings.STRIPE_PREMIUM_PRICE_ID,
@@ -40,15 +103,25 @@ def create_checkout_session(user: User, db: Session) -> dict:
             }
         )
 
+        _checkout_sessions.set(
+            user.firebase_uid,
+            {
+                "checkout_url": checkout_session.url,
+                "session_id": checkout_session.id,
+                "price_id": settings.STRIPE_PREMIUM_PRICE_ID,
+            },
+            expires_at=(checkout_session.expires_at or time.time()) - CHECKOUT_REUSE_MARGIN_SECONDS,
+        )
         return {"checkout_url": checkout_session.url, "session_id": checkout_session.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating checkout session: {str(e)}")
 
 
-def handle_stripe_webhook(payload: bytes, sig_header: str) -> dict:
-    """Handle Stripe webhook events"""
+async def handle_stripe_webhook(payload: bytes, sig_header: str) -> dict:
+    """Verify a Stripe webhook and record it in the inbox; the inbox worker applies it"""
+    stripe = _stripe()
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
@@ -56,67 +129,77 @@ def handle_stripe_webhook(payload: bytes, sig_header: str) -> dict:
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    # Handle the event
-    event_type = event["type"]
-    event_data = event["data"]["object"]
-
-    from app.database import SessionLocal
-    db = SessionLocal()
+    from app.stripe_inbox import record_event
+
+    # Acknowledge as soon as the event is durable; retries of the same event are deduplicated
+    await record_event(payload)
+    return {"status": "success"}
+
+
+async def apply_stripe_event(db: AsyncSession, event_type: str, event_data: dict) -> list:
+    """Apply one Stripe event to the users table without committing.
+
+    Returns the firebase_uids whose cached records must be invalidated once
+    the caller commits.
+    """
+    if event_type == "checkout.session.completed":
+        # Subscription created
+        session = event_data
+        user_id = int(session["metadata"]["user_id"])
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+
+        if user:
+            _checkout_sessions.pop(user.firebase_uid)
+            subscription_id = session.get("subscription")
+            user.stripe_subscription_id = subscription_id
+            user.subscription_tier = SubscriptionTier.PREMIUM
+            return [user.firebase_uid]
+
+    elif event_type == "customer.subscription.updated":
+        # Subscription updated (e.g., renewed, changed)
+        subscription = event_data
+        result = await db.execute(
+            select(User).where(User.stripe_subscription_id == subscription["id"])
+        )
+        user = result.scalars().first()
 
-    try:
-        if event_type == "checkout.session.completed":
-            # Subscription created
-            session = event_data
-            user_id = int(session["metadata"]["user_id"])
-            user = db.query(User).filter(User.id == user_id).first()
-            
-            if user:
-                subscription_id = session.get("subscription")
-                user.stripe_subscription_id = subscription_id
+        if user:
+            if subscription["status"] in ["active", "trialing"]:
                 user.subscription_tier = SubscriptionTier.PREMIUM
-                db.commit()
-
-        elif event_type == "customer.subscription.updated":
-            # Subscription updated (e.g., renewed, changed)
-            subscription = event_data
-            user = db.query(User).filter(
-                User.stripe_subscription_id == subscription["id"]
-            ).first()
-            
-            if user:
-                if subscription["status"] in ["active", "trialing"]:
-                    user.subscription_tier = SubscriptionTier.PREMIUM
-                elif subscription["status"] in ["canceled", "unpaid", "past_due"]:
-                    user.subscription_tier = SubscriptionTier.FREE
-                    user.stripe_subscription_id = None
-                db.commit()
-
-        elif event_type == "customer.subscription.deleted":
-            # Subscription canceled
-            subscription = event_data
-            user = db.query(User).filter(
-                User.stripe_subscription_id == subscription["id"]
-            ).first()
-            
-            if user:
+            elif subscription["status"] in ["canceled", "unpaid", "past_due"]:
                 user.subscription_tier = SubscriptionTier.FREE
                 user.stripe_subscription_id = None
-                db.commit()
+            return [user.firebase_uid]
 
-        return {"status": "success"}
-    finally:
-        db.close()
+    elif event_type == "customer.subscription.deleted":
+        # Subscription canceled
+        subscription = event_data
+        result = await db.execute(
+            select(User).where(User.stripe_subscription_id == subscription["id"])
+        )
+        user = result.scalars().first()
+
+        if user:
+            user.subscription_tier = SubscriptionTier.FREE
+            user.stripe_subscription_id = None
+            return [user.firebase_uid]
 
+    return []
 
-def cancel_subscription(user: User, db: Session) -> dict:
+
+async def cancel_subscription(user: User, db: AsyncSession) -> dict:
     """Cancel user's subscription"""
+    stripe = _stripe()
     if not user.stripe_subscription_id:
         raise HTTPException(status_code=400, detail="No active subscription to cancel")
 
     try:
-        subscription = stripe.Subscription.retrieve(user.stripe_subscription_id)
-        subscription.cancel_at_period_end = True
-        subscription.save()
+        # One modify call instead of retrieve + save
+        await _stripe_call(
+            stripe.Subscription.modify, user.stripe_subscription_id, cancel_at_period_end=True
+        )
+        invalidate_user(user.firebase_uid)
 
         return {"message": "Subscription will be canceled at the end of the billing period"}
     except Exception as e:
@@ -125,7 +208,7 @@ def cancel_subscription(user: User, db: Session) -> dict:
 
 def get_subscription_status(user: User) -> dict:
     """Get user's subscription status"""
-    queries_limit = 5 if user.subscription_tier == SubscriptionTier.FREE else None
+    queries_limit = FREE_DAILY_QUERY_LIMIT if user.subscription_tier == SubscriptionTier.FREE else None
     
     return {
         "tier": user.subscription_tier.value,
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+from langchain_core.tools import tool
+
+from app import rag
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# --- TOOL 3: Cicero's own document library (app.rag) ---
+@tool
+async def search_documents(query: str) -> str:
+    """
+    Search Cicero's curated library of landmark case summaries and legal explainers.
+    Fast and offline - try this first for well-known cases and core legal concepts
+    (e.g. "Miranda warning custodial interrogation", "right to remain silent").
+
+    Arguments:
+      query: What to look for, in plain words or legal terms.
+    """
+    try:
+        # Embedding and the index scan are CPU work; keep them off the event loop
+        passages = await asyncio.to_thread(rag.search, query, settings.RAG_TOP_K)
+    except FileNotFoundError:
+        logger.warning("No document index found; run `python -m app.rag ingest`")
+        return "The document library is not available right now."
+    except Exception as e:
+        logger.warning("Document search failed: %s", e)
+        return "The document library is not available right now."
+
+    if not passages:
+        return "No relevant documents found."
+    return "\n".join(
+        f"SOURCE: {p.source} - {p.heading}\nPASSAGE: {p.text}\n---"
+        for p in passages
+    )
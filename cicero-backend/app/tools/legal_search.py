@@ -1,8 +1,18 @@
+import asyncio
+import contextvars
+import logging
+from contextlib import contextmanager
 import httpx
 from langchain_core.tools import tool
+from app.cache import TTLCache
 from app.config import settings
+from app.deadline import timeout_for
+from app.metrics import metrics
+from app.profiling import phase
 from typing import Optional, List, Dict
 
+logger = logging.getLogger(__name__)
+
 
 # State abbreviation to CourtListener court ID mapping
 # Focus on main appellate/supreme courts + federal courts for each state
@@ -102,16 +112,153 @@ STATE_TO_COURT = {
 
 
 # --- Helper for HTTP Requests ---
+# One pooled client for all upstream calls so TLS connections are reused
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Process-wide cache of successful upstream results (filled by requests and app.warmer)
+_search_cache = TTLCache(max_size=settings.SEARCH_CACHE_SIZE, default_ttl=settings.SEARCH_CACHE_TTL_SECONDS)
+
+# Per-request-group cache of upstream calls: key -> Future of the JSON result.
+# Set by search_scope(); tasks created inside the scope inherit it.
+_search_scope: contextvars.ContextVar[Optional[Dict[tuple, asyncio.Future]]] = contextvars.ContextVar(
+    "search_scope", default=None
+)
+
+
+@contextmanager
+def search_scope():
+    """Share upstream results between everything run inside (e.g. one /chat/batch).
+
+    Identical concurrent calls are made once (single-flight) and later ones
+    reuse the result; failed calls are not kept.
+    """
+    token = _search_scope.set({})
+    try:
+        yield
+    finally:
+        _search_scope.reset(token)
+
+
+class UpstreamCalls:
+    """Upstream requests made inside one count_upstream_calls() block"""
+
+    def __init__(self):
+        self.count = 0
+
+
+# Set by count_upstream_calls(); tasks created inside the block add to the same counter
+_upstream_calls: contextvars.ContextVar[Optional[UpstreamCalls]] = contextvars.ContextVar(
+    "upstream_calls", default=None
+)
+
+
+@contextmanager
+def count_upstream_calls():
+    """Count the upstream requests made by this task (and tasks it starts) inside the block.
+
+    Unlike the process-wide `upstream.requests` counter, other requests'
+    traffic does not show up here.
+    """
+    calls = UpstreamCalls()
+    token = _upstream_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _upstream_calls.reset(token)
+
+
+def record_upstream_request():
+    """Call before every request to an external API"""
+    metrics.incr("upstream.requests")
+    calls = _upstream_calls.get()
+    if calls is not None:
+        calls.count += 1
+
+
+def _request_key(url: str, params: Optional[dict]) -> tuple:
+    items = []
+    for name, value in sorted((params or {}).items()):
+        items.append((name, tuple(value) if isinstance(value, list) else value))
+    return url, tuple(items)
+
+
 async def fetch_json(url: str, params: dict = None, headers: dict = None) -> Dict:
-    async with httpx.AsyncClient() as client:
+    key = _request_key(url, params)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        metrics.incr("search_cache.hits")
+        return cached
+    metrics.incr("search_cache.misses")
+
+    scope = _search_scope.get()
+    if scope is None:
+        return _cache_result(key, await _fetch_json(url, params, headers))
+
+    shared = scope.get(key)
+    if shared is not None:
+        metrics.incr("search_scope.shared")
         try:
-            response = await client.get(
-                url, params=params, headers=headers, timeout=10.0
+            return await asyncio.shield(shared)
+        except asyncio.CancelledError:
+            # The caller that owned the fetch was cancelled, not us: fetch it ourselves
+            if not shared.cancelled() or asyncio.current_task().cancelling():
+                raise
+            return await fetch_json(url, params, headers)
+
+    future = asyncio.get_running_loop().create_future()
+    scope[key] = future
+    try:
+        # _fetch_json turns errors into {"error": ...}; only cancellation gets here
+        data = await _fetch_json(url, params, headers)
+    except BaseException:
+        scope.pop(key, None)
+        future.cancel()
+        raise
+    if "error" in data:
+        scope.pop(key, None)
+    future.set_result(data)
+    return _cache_result(key, data)
+
+
+def _cache_result(key: tuple, data: Dict) -> Dict:
+    if "error" not in data:
+        _search_cache.set(key, data)
+    return data
+
+
+async def _fetch_json(url: str, params: dict = None, headers: dict = None) -> Dict:
+    # Never wait longer than the request's remaining time budget
+    timeout = timeout_for(10.0)
+    if timeout <= 0:
+        return {"error": "Out of time for this request"}
+    record_upstream_request()
+    try:
+        with phase(f"upstream:{httpx.URL(url).host}"):
+            response = await get_http_client().get(
+                url, params=params, headers=headers, timeout=timeout
             )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return {"error": str(e)}
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        return {"error": str(e)}
 
 
 # --- TOOL 1: Case Law (CourtListener) ---
@@ -138,21 +285,21 @@ async def search_case_law(query: str, jurisdiction: str = None) -> str:
         "type": "o",  # Opinion search type
     }
     
-    print(f"--- Case law query: '{query}' ---")
+    logger.debug("Case law query: '%s'", query)
     
     # Convert state abbreviation to CourtListener court IDs
     if jurisdiction and jurisdiction.upper() in STATE_TO_COURT:
         courts = STATE_TO_COURT[jurisdiction.upper()]
         params["court"] = courts  # httpx encodes lists as repeated params (court=a&court=b)
-        print(f"--- Searching courts: {','.join(courts)} ---")
+        logger.debug("Searching courts: %s", ",".join(courts))
     elif jurisdiction:
         # Accept a comma-separated list or a single direct CourtListener ID
         courts = [c.strip() for c in jurisdiction.split(",") if c.strip()]
         params["court"] = courts if len(courts) > 1 else courts[0]
-        print(f"--- Searching courts: {jurisdiction} ---")
+        logger.debug("Searching courts: %s", jurisdiction)
 
     data = await fetch_json(url, params, headers)
-    print(f"--- CourtListener response count: {data.get('count', 'N/A')} ---")
+    logger.debug("CourtListener response count: %s", data.get("count", "N/A"))
 
     if "error" in data:
         return f"Error searching cases: {data['error']}"
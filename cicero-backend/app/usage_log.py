@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.config import settings
+from app.database import engine, UsageLog, UsageDaily
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ("user_id", "query_text", "timestamp", "tokens_used", "state")
+_MAX_FLUSH_ATTEMPTS = 3
+_STOP = object()
+
+
+class UsageLogWriter:
+    """Write-behind logger for UsageLog rows.
+
+    Requests enqueue records; a background task writes them in multi-row
+    batches (COPY on Postgres) once `batch_size` records are waiting or the
+    oldest has waited `flush_interval` seconds.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, enqueue_timeout: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+
+    async def log(self, user_id: int, query_text: str, timestamp: Optional[datetime] = None,
+                  tokens_used: Optional[int] = None, state: Optional[str] = None):
+        """Queue one usage record, waiting briefly for room when the queue is full"""
+        record = (user_id, query_text[:500], timestamp or datetime.utcnow(), tokens_used, state)
+        item = (time.monotonic(), record)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Backpressure: slow the producer down rather than grow without bound
+            metrics.incr("usage_log.backpressure_waits")
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                metrics.incr("usage_log.dropped")
+                logger.warning("UsageLog queue full, dropped record for user %s", user_id)
+                return
+        metrics.set_gauge("usage_log.queue_depth", self._queue.qsize())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush everything still queued"""
+        if self._task is not None:
+            # A sentinel rather than cancel(), so a batch being written is never cut off
+            await self._queue.put(_STOP)
+            await self._task
+            self._task = None
+        while not self._queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    def _drain(self, limit: int) -> list:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = item[0] + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list):
+        if not batch:
+            return
+        records = [record for _, record in batch]
+        for attempt in range(1, _MAX_FLUSH_ATTEMPTS + 1):
+            try:
+                await _write_records(records)
+                break
+            except Exception as e:
+                metrics.incr("usage_log.flush_errors")
+                logger.warning("Error flushing %d UsageLog rows (attempt %d): %s", len(records), attempt, e)
+                if attempt == _MAX_FLUSH_ATTEMPTS:
+                    metrics.incr("usage_log.dropped", len(records))
+                    return
+                await asyncio.sleep(0.5 * attempt)
+
+        metrics.incr("usage_log.flushed", len(records))
+        metrics.incr("usage_log.batches")
+        metrics.observe("usage_log.batch_size", len(records))
+        metrics.observe("usage_log.flush_lag_seconds", time.monotonic() - batch[0][0])
+        metrics.set_gauge("usage_log.queue_depth", self._queue.qsize())
+
+
+async def _write_records(records: list):
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                UsageLog.__tablename__, records=records, columns=list(_COLUMNS)
+            )
+        else:
+            await conn.execute(insert(UsageLog), [dict(zip(_COLUMNS, record)) for record in records])
+        await _roll_up_daily(conn, records)
+
+
+async def _roll_up_daily(conn, records: list):
+    """Add this batch's per-user daily counts to usage_daily in the same transaction"""
+    counts = Counter((record[2].date(), record[0]) for record in records)
+    dialect_insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(UsageDaily).values(
+        [{"day": day, "user_id": user_id, "query_count": count} for (day, user_id), count in counts.items()]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "user_id"],
+        set_={"query_count": UsageDaily.query_count + stmt.excluded.query_count},
+    )
+    await conn.execute(stmt)
+
+
+usage_log_writer = UsageLogWriter(
+    max_queue=settings.USAGE_LOG_QUEUE_SIZE,
+    batch_size=settings.USAGE_LOG_BATCH_SIZE,
+    flush_interval=settings.USAGE_LOG_FLUSH_SECONDS,
+    enqueue_timeout=settings.USAGE_LOG_ENQUEUE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,163 @@
+"""
+Cache warmer for popular questions.
+
+Mines UsageLog for the most frequent questions per state over the last
+WARMER_WINDOW_DAYS and pre-runs their CourtListener/LegiScan searches (and,
+with WARMER_RUN_AGENT, whole agent answers) so the process-wide search cache
+is hot. Runs once at startup and then daily in the WARMER_OFF_PEAK_HOURS
+window, stopping once a run has made WARMER_UPSTREAM_BUDGET upstream calls.
+The cache is per process, so every worker warms its own.
+
+    python -m app.warmer          # show what would be warmed
+    python -m app.warmer --run    # warm this process (useful to check budgets)
+"""
+import asyncio
+import logging
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from app import startup
+from app.config import settings
+from app.database import engine, SessionLocal, UsageLog
+from app.metrics import metrics
+from app.tools.legal_search import count_upstream_calls
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w\s'-]+")
+
+
+def normalize_query(text: str) -> str:
+    """Case, punctuation and whitespace-insensitive form used to group repeats"""
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+async def popular_queries(
+    window_days: int = settings.WARMER_WINDOW_DAYS,
+    top_per_state: int = settings.WARMER_TOP_PER_STATE,
+    min_count: int = settings.WARMER_MIN_COUNT,
+) -> Dict[str, List[Tuple[str, int]]]:
+    """Most frequent questions per state as (representative text, count), most popular first"""
+    since = datetime.utcnow() - timedelta(days=window_days)
+    count = func.count().label("count")
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(UsageLog.state, UsageLog.query_text, count)
+            .where(UsageLog.timestamp >= since, UsageLog.state.is_not(None))
+            .group_by(UsageLog.state, UsageLog.query_text)
+            .order_by(count.desc())
+            .limit(20000)
+        )).all()
+
+    # Merge variants that normalize alike; keep the most-asked raw text, since that is
+    # what the chat fallback search sends upstream (and so what the cache is keyed on)
+    totals: Dict[str, Counter] = defaultdict(Counter)
+    representative: Dict[Tuple[str, str], str] = {}
+    for state, text, n in rows:
+        key = normalize_query(text)
+        if not key:
+            continue
+        totals[state][key] += n
+        representative.setdefault((state, key), text)  # Rows arrive most frequent first
+
+    popular = {}
+    for state, counter in totals.items():
+        top = [(representative[(state, key)], n) for key, n in counter.most_common(top_per_state) if n >= min_count]
+        if top:
+            popular[state] = top
+    return popular
+
+
+def _interleave(popular: Dict[str, List[Tuple[str, int]]]) -> List[Tuple[str, str]]:
+    """Round-robin across states so a small budget still covers every state's head"""
+    ordered = []
+    for rank in range(max((len(top) for top in popular.values()), default=0)):
+        for state, top in popular.items():
+            if rank < len(top):
+                ordered.append((state, top[rank][0]))
+    return ordered
+
+
+async def _warm_one(state: str, text: str):
+    from app.tools.legal_search import search_case_law, search_statutes
+
+    await search_case_law.ainvoke({"query": text, "jurisdiction": state})
+    await search_statutes.ainvoke({"query": text, "state": state})
+    if settings.WARMER_RUN_AGENT:
+        from app.chat import answer_chat
+        from app.models import ChatRequest
+
+        await answer_chat(ChatRequest(message=text, state=state))
+
+
+async def warm_cache(budget: int = settings.WARMER_UPSTREAM_BUDGET, until: Optional[datetime] = None) -> dict:
+    """Warm the search cache for popular questions until `budget` upstream calls are used (or `until`)"""
+    start = time.perf_counter()
+    popular = await popular_queries()
+    warmed = 0
+    # Only this run's own calls count against the budget, not concurrent user traffic
+    with count_upstream_calls() as upstream:
+        for state, text in _interleave(popular):
+            if upstream.count >= budget:
+                break
+            if until is not None and datetime.utcnow() >= until:
+                break
+            try:
+                await _warm_one(state, text)
+                warmed += 1
+            except Exception as e:
+                logger.warning("Error warming '%s' (%s): %s", text[:60], state, e)
+
+    report = {
+        "questions": warmed,
+        "candidates": sum(len(top) for top in popular.values()),
+        "upstream_calls": upstream.count,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+    metrics.incr("warmer.questions", warmed)
+    metrics.incr("warmer.upstream_calls", report["upstream_calls"])
+    return report
+
+
+def _next_off_peak_window(now: datetime) -> Tuple[datetime, datetime]:
+    start_hour, end_hour = (int(hour) for hour in settings.WARMER_OFF_PEAK_HOURS.split("-"))
+    start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+    if start <= now:
+        start += timedelta(days=1)
+    end = start.replace(hour=end_hour)
+    if end <= start:
+        end += timedelta(days=1)  # Window wraps past midnight, e.g. "23-4"
+    return start, end
+
+
+async def run_warmer_forever():
+    """Background task: warm once the app is ready, then daily inside the off-peak window"""
+    while not startup.is_ready():
+        await asyncio.sleep(1)
+    until = None  # The post-deploy run is not limited to off-peak hours, only by the budget
+    while True:
+        try:
+            logger.info("Cache warm-up: %s", await warm_cache(until=until))
+        except Exception:
+            logger.exception("Error warming caches")
+        start, until = _next_off_peak_window(datetime.utcnow())
+        await asyncio.sleep((start - datetime.utcnow()).total_seconds())
+
+
+if __name__ == "__main__":
+    async def _main(args):
+        if "--run" in args:
+            print(await warm_cache())
+        else:
+            for state, top in sorted((await popular_queries()).items()):
+                for text, n in top:
+                    print(f"{state}  {n:6d}  {text[:100]}")
+        await engine.dispose()
+
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,90 @@
+"""
+Event-loop concurrency benchmark: blocking Session vs AsyncSession.
+
+Runs N concurrent "request" coroutines, each doing the user lookup + usage
+commit that /chat does, while a ticker coroutine measures how late the event
+loop wakes it up. Usage:
+
+    DATABASE_URL=sqlite:///bench.db python bench_db.py [requests] [concurrency]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.database import Base, SessionLocal, User, SubscriptionTier, engine as async_engine
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+UID = "bench-user"
+
+sync_engine = create_engine(settings.DATABASE_URL.replace("postgres://", "postgresql://", 1))
+SyncSession = sessionmaker(bind=sync_engine)
+
+
+def setup():
+    Base.metadata.create_all(sync_engine)
+    with SyncSession() as db:
+        if not db.query(User).filter(User.firebase_uid == UID).first():
+            db.add(User(email="bench@example.com", firebase_uid=UID, subscription_tier=SubscriptionTier.PREMIUM,
+                        queries_today=0, queries_reset_date=datetime.utcnow()))
+            db.commit()
+
+
+async def sync_request():
+    with SyncSession() as db:
+        user = db.query(User).filter(User.firebase_uid == UID).first()
+        user.queries_today += 1
+        db.commit()
+
+
+async def async_request():
+    async with SessionLocal() as db:
+        user = (await db.execute(select(User).where(User.firebase_uid == UID))).scalars().first()
+        user.queries_today += 1
+        await db.commit()
+
+
+async def run(label, request):
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            await request()
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(f"{label:>6}: {REQUESTS / elapsed:8.1f} req/s  "
+          f"loop lag max {max(lags or [0]) * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms")
+
+
+async def main():
+    setup()
+    print(f"{REQUESTS} requests, concurrency {CONCURRENCY}, {async_engine.url.drivername}")
+    await run("sync", sync_request)
+    await run("async", async_request)
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""
+Per-request middleware overhead: BaseHTTPMiddleware stack vs pure ASGI.
+
+Builds the same small app twice, once with the old BaseHTTPMiddleware
+security headers + SlowAPIMiddleware and once with the pure ASGI
+replacements, and drives both directly over ASGI (no sockets) so the
+numbers are dominated by middleware cost. Usage:
+
+    python bench_middleware.py [requests]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from slowapi import Limiter
+from slowapi.middleware import SlowAPIMiddleware
+from slowapi.util import get_remote_address
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware import SecurityHeadersMiddleware, RateLimitHeadersMiddleware, RateLimitMiddleware, SECURITY_HEADERS
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+class BaseHTTPSecurityHeadersMiddleware(BaseHTTPMiddleware):
+    """The previous implementation, kept here for comparison"""
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        for name, value in SECURITY_HEADERS.items():
+            response.headers[name] = value
+        return response
+
+
+def build_app(pure_asgi: bool) -> FastAPI:
+    limiter = Limiter(key_func=get_remote_address)
+    app = FastAPI()
+    app.state.limiter = limiter
+
+    @app.get("/ping")
+    @limiter.limit("1000000/hour")
+    async def ping(request: Request):
+        return {"status": "ok"}
+
+    if pure_asgi:
+        app.add_middleware(RateLimitMiddleware)
+        app.add_middleware(RateLimitHeadersMiddleware, limiter=limiter)
+        app.add_middleware(SecurityHeadersMiddleware)
+    else:
+        app.add_middleware(SlowAPIMiddleware)
+        app.add_middleware(BaseHTTPSecurityHeadersMiddleware)
+    return app
+
+
+async def call(app, path="/ping"):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1234),
+        "server": ("bench", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+async def bench(label: str, app):
+    # Warm up, and make sure the headers really are added
+    messages = await call(app)
+    headers = dict(messages[0]["headers"])
+    assert b"x-frame-options" in headers, headers
+    for _ in range(200):
+        await call(app)
+
+    timings = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await call(app)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    print(
+        f"{label:<18} mean {statistics.fmean(timings):7.1f} us   "
+        f"p50 {timings[len(timings) // 2]:7.1f} us   p99 {timings[int(len(timings) * 0.99)]:7.1f} us   "
+        f"body messages {len(messages) - 1}"
+    )
+
+
+async def main():
+    print(f"{REQUESTS} sequential GET /ping per stack")
+    await bench("BaseHTTPMiddleware", build_app(pure_asgi=False))
+    await bench("pure ASGI", build_app(pure_asgi=True))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
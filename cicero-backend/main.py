@@ -1,32 +1,93 @@
 from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from app.models import ChatRequest, ChatResponse, SubscriptionStatusResponse
-from app.agent import app_graph
-from app.auth import get_current_user, check_usage_limit, increment_usage
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from app.models import (
+    ChatRequest,
+    ChatResponse,
+    ChatBatchRequest,
+    ChatBatchItem,
+    ChatBatchResponse,
+    ChatJobResponse,
+    SubscriptionStatusResponse,
+)
+from app.chat import answer_chat, answer_batch
+from app import jobs
+from app.admission import priority_for
+from app import startup
+from app.auth import get_current_user, reserve_query, release_query, refresh_public_keys_forever, require_admin
 from app.subscription import (
     create_checkout_session,
     handle_stripe_webhook,
     cancel_subscription,
     get_subscription_status
 )
-from app.database import get_db, User, UsageLog
-from app.middleware import SecurityHeadersMiddleware
+from app.database import engine, get_db, SessionLocal, User
+from app.metrics import metrics
+from app.usage_log import usage_log_writer
+from app.retention import run_retention_forever
+from app.stripe_inbox import run_inbox_worker_forever
+from app.warmer import run_warmer_forever
+from app.legal_docs import load_legal_documents, legal_document_response
+from app.middleware import SecurityHeadersMiddleware, RateLimitHeadersMiddleware, RateLimitMiddleware, RequestIdMiddleware, ProfilingMiddleware
+from app.logging_config import setup_logging, shutdown_logging
+from app.profiling import install_db_hooks, list_profiles, profile_path
 from app.rate_limit import limiter, get_user_id_for_rate_limit
 from app.config import settings
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from app.tools.legal_search import search_case_law
+from app import idempotency, llm_cache
 from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
-from datetime import datetime
-
-app = FastAPI(title="Cicero API", version="2.0")
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    load_legal_documents()
+    # Keep Firebase signing keys warm so token verification never fetches them inline
+    # Heavy clients build in the background; /ready flips once they (and warm-up) are done
+    initializer = asyncio.create_task(startup.initialize())
+    key_refresher = asyncio.create_task(refresh_public_keys_forever())
+    usage_log_writer.start()
+    retention = asyncio.create_task(run_retention_forever())
+    stripe_inbox = asyncio.create_task(run_inbox_worker_forever())
+    warmer = asyncio.create_task(run_warmer_forever()) if settings.WARMER_ENABLED else None
+    job_workers = asyncio.create_task(jobs.run_workers(settings.CHAT_JOB_WORKERS)) if settings.CHAT_JOB_WORKERS > 0 else None
+    try:
+        yield
+    finally:
+        initializer.cancel()
+        key_refresher.cancel()
+        retention.cancel()
+        stripe_inbox.cancel()
+        if warmer:
+            warmer.cancel()
+        if job_workers:
+            # Running jobs go back on the queue for the next worker
+            job_workers.cancel()
+            await asyncio.gather(job_workers, return_exceptions=True)
+        await usage_log_writer.stop()
+        await startup.shutdown()
+        await engine.dispose()
+        shutdown_logging()
+
+
+app = FastAPI(title="Cicero API", version="2.0", lifespan=lifespan)
+
+# Compress large bodies (long /chat answers); already-encoded responses pass through untouched
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE, compresslevel=6)
 
 # Add rate limit exception handler
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(RateLimitHeadersMiddleware, limiter=limiter)
+# One budget for a user's questions, whether asked directly (/chat) or queued (/chat/jobs)
+chat_rate_limit = limiter.shared_limit("100/hour", scope="chat", key_func=get_user_id_for_rate_limit)
 
 # Add security headers middleware
 app.add_middleware(SecurityHeadersMiddleware)
@@ -41,17 +102,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Admin-requested or sampled profiles of /chat requests; a no-op pass-through otherwise
+app.add_middleware(ProfilingMiddleware)
+install_db_hooks(engine)
+
+# Outermost, so every log line for a request (including CORS preflights) carries its ID
+app.add_middleware(RequestIdMiddleware)
 
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
-    response = JSONResponse(
+    # RateLimitHeadersMiddleware adds the X-RateLimit-* and Retry-After headers when the limiter enables them
+    return JSONResponse(
         status_code=status.HTTP_429_TOO_MANY_REQUESTS,
         content={"detail": "Rate limit exceeded. Please try again later."}
     )
-    response = request.app.state.limiter._inject_headers(
-        response, request.state.view_rate_limit
-    )
-    return response
 
 
 @app.get("/")
@@ -59,6 +123,35 @@ def health_check():
     return {"status": "online", "system": "Cicero 2.0 Agentic Brain"}
 
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 503 until heavy clients are built and warm-up has finished"""
+    if not startup.is_ready():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "starting"})
+    return {"status": "ready"}
+
+
+@app.get("/metrics", dependencies=[Depends(require_admin)])
+async def metrics_snapshot():
+    """In-process metrics for this worker (admin only)"""
+    return metrics.snapshot()
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def profiles_index():
+    """Stored request profiles on this worker, newest first, with per-phase totals (admin only)"""
+    return await asyncio.to_thread(list_profiles)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def profile_download(profile_id: str):
+    """Download one profile as a speedscope file (open it at https://www.speedscope.app)"""
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+
 @app.get("/auth/verify")
 async def verify_auth(current_user: User = Depends(get_current_user)):
     """Verify authentication token"""
@@ -71,125 +164,183 @@ async def verify_auth(current_user: User = Depends(get_current_user)):
 
 
 @app.post("/chat", response_model=ChatResponse)
-@limiter.limit("100/hour", key_func=get_user_id_for_rate_limit)
+@chat_rate_limit
 async def chat_endpoint(
     request: Request,
+    response: Response,
     chat_request: ChatRequest,
     current_user: User = Depends(get_current_user),
-    db = Depends(get_db)
 ):
-    """Chat endpoint with authentication and usage limits"""
-    try:
-        # Check usage limits
-        if not check_usage_limit(current_user, db):
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Daily query limit reached. Upgrade to Premium for unlimited queries."
-            )
+    """Chat endpoint with authentication and usage limits.
+
+    Duplicates (same Idempotency-Key, or the same question again within
+    IDEMPOTENCY_WINDOW_SECONDS) share one run and one quota slot.
+    """
+    header_key = request.headers.get("idempotency-key")
+    if header_key is not None and not 0 < len(header_key) <= idempotency.MAX_KEY_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Idempotency-Key")
+    key, fingerprint, ttl = idempotency.request_key(current_user.id, header_key, chat_request.model_dump_json())
+    # Cache-Control: no-cache asks for fresh LLM answers (they still refresh the cache)
+    no_cache = "no-cache" in request.headers.get("cache-control", "").lower()
+
+    async def run():
+        # Own session: the run outlives this request if its client goes away
+        async with SessionLocal() as db:
+            # Reserve the quota slot up front; it is refunded if no answer is produced
+            if not await reserve_query(current_user, db):
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Daily query limit reached. Upgrade to Premium for unlimited queries."
+                )
+
+            try:
+                with llm_cache.bypass(no_cache):
+                    chat_response, answered = await answer_chat(chat_request, priority_for(current_user.subscription_tier))
+            except HTTPException:
+                await release_query(current_user, db)
+                raise
+            except Exception:
+                await release_query(current_user, db)
+                # Queued for the log thread (console + error.log); no file I/O on the request path
+                logger.exception("Error answering chat request")
+                raise HTTPException(status_code=500, detail="An error occurred processing your request")
+
+            if not answered:
+                await release_query(current_user, db)
+                return chat_response, False
+
+        # Log query off the request path (usage was already counted by reserve_query)
+        await usage_log_writer.log(current_user.id, chat_request.message, state=chat_request.state)
+        return chat_response, True
 
-        # Convert request history and current message to LangGraph format
-        history_messages = []
-        for item in chat_request.history:
-            if isinstance(item, dict) and "role" in item and "content" in item:
-                if item["role"] == "user":
-                    history_messages.append(HumanMessage(content=item["content"]))
-                elif item["role"] == "assistant":
-                    history_messages.append(AIMessage(content=item["content"]))
-        
-        # Include the user's state in the message context
-        user_state = chat_request.state or "US"
-        current_message = HumanMessage(content=f"[User is in {user_state}] {chat_request.message}")
-        messages = history_messages + [current_message]
-        inputs = {"messages": messages, "user_state": user_state}
-
-        # Run the agent with recursion limit to prevent infinite loops
+    try:
+        chat_response, replayed = await idempotency.chat_runs.run(key, fingerprint, ttl, run)
+    except idempotency.IdempotencyKeyReused:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail="This Idempotency-Key was already used for a different request",
+        )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return chat_response
+
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+@limiter.limit("20/hour", key_func=get_user_id_for_rate_limit)
+async def chat_batch_endpoint(
+    request: Request,
+    batch_request: ChatBatchRequest,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Answer several questions for one state with one auth, one quota check and shared searches"""
+    count = len(batch_request.messages)
+    if not await reserve_query(current_user, db, count=count):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Daily query limit reached (this batch needs {count}). Upgrade to Premium for unlimited queries."
+        )
+
+    chat_requests = [
+        ChatRequest(message=message, history=batch_request.history, state=batch_request.state)
+        for message in batch_request.messages
+    ]
+
+    async def results():
+        answered_count = 0
         try:
-            final_state = await app_graph.ainvoke(
-                inputs, 
-                config={"recursion_limit": 20}
+            batch = answer_batch(
+                chat_requests, settings.CHAT_BATCH_CONCURRENCY, priority_for(current_user.subscription_tier)
             )
-
-            # Extract the final response from the AI
-            final_message = final_state["messages"][-1].content
-
-            # Fallback: if the model failed to deliver useful info, run a case-law search directly.
-            msg_lower = str(final_message).lower() if final_message else ""
-            last_tool_content = None
-            for m in reversed(final_state.get("messages", [])):
-                if isinstance(m, ToolMessage) and m.content:
-                    last_tool_content = str(m.content)
-                    break
-            
-            fallback_triggers = [
-                "i'm having trouble",
-                "technical difficulties",
-                "couldn't find",
-                "search_statutes(",
-                "trouble processing",
-            ]
-            if any(trigger in msg_lower for trigger in fallback_triggers):
-                if last_tool_content:
-                    final_message = last_tool_content
+            async for index, response, answered in batch:
+                if answered:
+                    answered_count += 1
+                    await usage_log_writer.log(current_user.id, chat_requests[index].message, state=batch_request.state)
+                if isinstance(response, str):
+                    yield ChatBatchItem(index=index, error=response)
                 else:
-                    try:
-                        case_result = await search_case_law.ainvoke({
-                            "query": chat_request.message,
-                            "jurisdiction": user_state,
-                        })
-                        final_message = str(case_result)
-                    except Exception:
-                        pass
-
-            # Increment usage and log query
-            increment_usage(current_user, db)
-            usage_log = UsageLog(
-                user_id=current_user.id,
-                query_text=chat_request.message[:500],  # Truncate for storage
-                timestamp=datetime.utcnow()
-            )
-            db.add(usage_log)
-            db.commit()
+                    yield ChatBatchItem(index=index, **response.model_dump())
+        finally:
+            # Refund everything that produced no answer, including questions never run.
+            # Own session: a streaming body outlives the request's dependencies.
+            if answered_count < count:
+                async with SessionLocal() as refund_db:
+                    await release_query(current_user, refund_db, count=count - answered_count)
 
-            return ChatResponse(
-                response=str(final_message),
-                citations=[],
-                thought_process=[],
-            )
-        except Exception as graph_error:
-            error_str = str(graph_error)
-            if "recursion_limit" in error_str.lower():
-                try:
-                    last_ai_message = None
-                    for msg in reversed(inputs["messages"]):
-                        if isinstance(msg, AIMessage) and not hasattr(msg, "tool_calls"):
-                            last_ai_message = msg.content
-                            break
-                    
-                    if last_ai_message:
-                        return ChatResponse(
-                            response=f"{last_ai_message}\n\n(I'm having some trouble finding complete information right now. Please try rephrasing your question.)",
-                            citations=[],
-                            thought_process=[],
-                        )
-                except:
-                    pass
-                
-                return ChatResponse(
-                    response="I'm having trouble processing that request right now. Could you try rephrasing your question or breaking it into smaller parts?",
-                    citations=[],
-                    thought_process=[],
-                )
-            else:
-                raise graph_error
-    except HTTPException:
-        raise
-    except Exception as e:
-        with open("error.log", "a") as f:
-            import traceback
-            f.write(f"Error: {str(e)}\n")
-            f.write(traceback.format_exc())
-            f.write("\n" + "-"*20 + "\n")
+    if batch_request.stream:
+        async def ndjson():
+            async for item in results():
+                yield item.model_dump_json() + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    items = [item async for item in results()]
+    return ChatBatchResponse(results=sorted(items, key=lambda item: item.index))
+
+
+@app.post("/chat/jobs", response_model=ChatJobResponse, status_code=status.HTTP_202_ACCEPTED)
+@chat_rate_limit
+async def create_chat_job(
+    request: Request,
+    chat_request: ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db = Depends(get_db)
+):
+    """Queue a question for a background worker and return its job ID straight away"""
+    # Charged now, refunded by the worker if no answer comes of it
+    if not await reserve_query(current_user, db):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Daily query limit reached. Upgrade to Premium for unlimited queries."
+        )
+    try:
+        job = await jobs.enqueue(current_user, chat_request, priority_for(current_user.subscription_tier))
+    except Exception:
+        await release_query(current_user, db)
+        logger.exception("Error queueing chat job")
         raise HTTPException(status_code=500, detail="An error occurred processing your request")
+    return jobs.to_response(job)
+
+
+@app.get("/chat/jobs/{job_id}", response_model=ChatJobResponse)
+@limiter.limit("1000/hour", key_func=get_user_id_for_rate_limit)
+async def get_chat_job(
+    request: Request,
+    job_id: str,
+    wait: float = 0,
+    current_user: User = Depends(get_current_user),
+):
+    """A job's status and, once it has succeeded, its answer.
+
+    With ?wait=<seconds> (up to CHAT_JOB_MAX_WAIT_SECONDS) the request is held
+    until the job finishes or the time runs out (long polling).
+    """
+    wait = min(max(wait, 0), settings.CHAT_JOB_MAX_WAIT_SECONDS)
+    job = await jobs.wait_for_job(job_id, current_user.id, wait)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return jobs.to_response(job)
+
+
+@app.get("/chat/jobs/{job_id}/events")
+async def chat_job_events(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Server-Sent Events: the job's status now and on every change, ending once it has finished"""
+    if await jobs.get_job(job_id, current_user.id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    async def events():
+        async for job in jobs.watch_job(job_id, current_user.id):
+            if job is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {job.status}\ndata: {jobs.to_response(job).model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # Subscription endpoints
@@ -199,15 +350,15 @@ async def create_checkout(
     db = Depends(get_db)
 ):
     """Create Stripe Checkout session for Premium subscription"""
-    return create_checkout_session(current_user, db)
+    return await create_checkout_session(current_user, db)
 
 
 @app.post("/subscription/webhook")
 async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
+    """Handle Stripe webhook events (acknowledged once stored; applied in the background)"""
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
-    return handle_stripe_webhook(payload, sig_header)
+    return await handle_stripe_webhook(payload, sig_header)
 
 
 @app.get("/subscription/status", response_model=SubscriptionStatusResponse)
@@ -223,27 +374,17 @@ async def cancel_user_subscription(
     db = Depends(get_db)
 ):
     """Cancel user's subscription"""
-    return cancel_subscription(current_user, db)
+    return await cancel_subscription(current_user, db)
 
 
 # Legal documents endpoints
 @app.get("/legal/privacy")
-async def privacy_policy():
+async def privacy_policy(request: Request):
     """Return privacy policy"""
-    try:
-        with open("legal/privacy_policy.md", "r") as f:
-            return {"content": f.read()}
-    except FileNotFoundError:
-        return {"content": "Privacy policy not yet available"}
+    return legal_document_response(request, "privacy")
 
 
 @app.get("/legal/terms")
-async def terms_of_service():
+async def terms_of_service(request: Request):
     """Return terms of service"""
-    try:
-        with open("legal/terms_of_service.md", "r") as f:
-            return {"content": f.read()}
-    except FileNotFoundError:
-        return {"content": "Terms of service not yet available"}
-
-
+    return legal_document_response(request, "terms")
@@ -0,0 +1,42 @@
+"""add stripe_webhook_events inbox
+
+Revision ID: 00597afdd132
+Revises: acf184d1936d
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '00597afdd132'
+down_revision: Union[str, None] = 'acf184d1936d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "stripe_webhook_events",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("customer_id", sa.String(), nullable=True),
+        sa.Column("created", sa.Integer(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("received_at", sa.DateTime(), nullable=False),
+        sa.Column("processed_at", sa.DateTime(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_stripe_webhook_events_customer_id", "stripe_webhook_events", ["customer_id"])
+    op.create_index("ix_stripe_webhook_events_processed_at", "stripe_webhook_events", ["processed_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_stripe_webhook_events_processed_at", table_name="stripe_webhook_events")
+    op.drop_index("ix_stripe_webhook_events_customer_id", table_name="stripe_webhook_events")
+    op.drop_table("stripe_webhook_events")
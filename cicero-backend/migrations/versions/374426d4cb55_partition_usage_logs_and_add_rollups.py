@@ -0,0 +1,139 @@
+"""partition usage_logs by month, add lookup indexes and usage_daily rollup
+
+Revision ID: 374426d4cb55
+Revises: c81eea030e1a
+Create Date: 2026-10-19 09:30:00.000000
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '374426d4cb55'
+down_revision: Union[str, None] = 'c81eea030e1a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _create_month_partition(month_start: date) -> None:
+    month_end = _add_months(month_start, 1)
+    op.execute(
+        f"CREATE TABLE IF NOT EXISTS usage_logs_y{month_start:%Y}m{month_start:%m} "
+        f"PARTITION OF usage_logs FOR VALUES FROM ('{month_start.isoformat()}') TO ('{month_end.isoformat()}')"
+    )
+
+
+def _partition_usage_logs() -> None:
+    bind = op.get_bind()
+    oldest, newest = bind.execute(sa.text("SELECT min(timestamp), max(timestamp) FROM usage_logs")).one()
+    this_month = datetime.utcnow().date().replace(day=1)
+    first_month = min(oldest.date().replace(day=1), this_month) if oldest else this_month
+    # Every existing row gets a monthly partition, so none start out in DEFAULT
+    last_month = _add_months(this_month, MONTHS_AHEAD)
+    if newest and newest.date().replace(day=1) > last_month:
+        last_month = newest.date().replace(day=1)
+
+    # Keep the id sequence alive when the old table is dropped
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE usage_logs RENAME TO usage_logs_unpartitioned")
+    op.execute("ALTER TABLE usage_logs_unpartitioned RENAME CONSTRAINT usage_logs_pkey TO usage_logs_unpartitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_usage_logs_id RENAME TO ix_usage_logs_unpartitioned_id")
+
+    # The partition key has to be part of the primary key
+    op.execute(
+        """
+        CREATE TABLE usage_logs (
+            id INTEGER NOT NULL DEFAULT nextval('usage_logs_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            query_text TEXT NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            tokens_used INTEGER,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+        """
+    )
+    month = first_month
+    while month <= last_month:
+        _create_month_partition(month)
+        month = _add_months(month, 1)
+    # Safety net for rows outside the maintained range; app.retention moves them
+    # into monthly partitions so it stays empty
+    op.execute("CREATE TABLE usage_logs_default PARTITION OF usage_logs DEFAULT")
+
+    op.execute(
+        "INSERT INTO usage_logs (id, user_id, query_text, timestamp, tokens_used) "
+        "SELECT id, user_id, query_text, timestamp, tokens_used FROM usage_logs_unpartitioned"
+    )
+    op.execute("DROP TABLE usage_logs_unpartitioned")
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY usage_logs.id")
+    op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+
+
+def _unpartition_usage_logs() -> None:
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE usage_logs RENAME TO usage_logs_partitioned")
+    op.execute("ALTER TABLE usage_logs_partitioned RENAME CONSTRAINT usage_logs_pkey TO usage_logs_partitioned_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_usage_logs_id RENAME TO ix_usage_logs_partitioned_id")
+    op.execute(
+        """
+        CREATE TABLE usage_logs (
+            id INTEGER NOT NULL DEFAULT nextval('usage_logs_id_seq') PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            query_text TEXT NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            tokens_used INTEGER
+        )
+        """
+    )
+    op.execute(
+        "INSERT INTO usage_logs (id, user_id, query_text, timestamp, tokens_used) "
+        "SELECT id, user_id, query_text, timestamp, tokens_used FROM usage_logs_partitioned"
+    )
+    op.execute("DROP TABLE usage_logs_partitioned")
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY usage_logs.id")
+    op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+
+
+def upgrade() -> None:
+    is_postgres = op.get_bind().dialect.name == "postgresql"
+    if is_postgres:
+        _partition_usage_logs()
+
+    op.create_index("ix_usage_logs_user_id_timestamp", "usage_logs", ["user_id", "timestamp"])
+    op.create_index("ix_users_stripe_subscription_id", "users", ["stripe_subscription_id"])
+    op.create_index("ix_users_stripe_customer_id", "users", ["stripe_customer_id"])
+
+    op.create_table(
+        "usage_daily",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("query_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("day", "user_id"),
+    )
+    # Seed the rollup from history; the UsageLog writer keeps it current from here on
+    day = "CAST(timestamp AS DATE)" if is_postgres else "date(timestamp)"
+    op.execute(
+        f"INSERT INTO usage_daily (day, user_id, query_count) "
+        f"SELECT {day}, user_id, count(*) FROM usage_logs GROUP BY {day}, user_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("usage_daily")
+    op.drop_index("ix_users_stripe_customer_id", table_name="users")
+    op.drop_index("ix_users_stripe_subscription_id", table_name="users")
+    op.drop_index("ix_usage_logs_user_id_timestamp", table_name="usage_logs")
+    if op.get_bind().dialect.name == "postgresql":
+        _unpartition_usage_logs()
@@ -0,0 +1,28 @@
+"""add usage_logs.state
+
+Revision ID: 490162824434
+Revises: 00597afdd132
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '490162824434'
+down_revision: Union[str, None] = '00597afdd132'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # On Postgres this is the partitioned parent; the column propagates to every partition
+    op.add_column("usage_logs", sa.Column("state", sa.String(length=2), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("usage_logs") as batch_op:
+        batch_op.drop_column("state")
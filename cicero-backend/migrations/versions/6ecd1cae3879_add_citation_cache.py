@@ -0,0 +1,34 @@
+"""add citation_cache
+
+Revision ID: 6ecd1cae3879
+Revises: 490162824434
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6ecd1cae3879'
+down_revision: Union[str, None] = '490162824434'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "citation_cache",
+        sa.Column("citation", sa.String(), nullable=False),
+        sa.Column("case_name", sa.Text(), nullable=True),
+        sa.Column("url", sa.String(), nullable=True),
+        sa.Column("date_filed", sa.String(length=10), nullable=True),
+        sa.Column("resolved_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("citation"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("citation_cache")
@@ -0,0 +1,50 @@
+"""add chat_jobs
+
+Revision ID: b3e51f0c7a92
+Revises: 6ecd1cae3879
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e51f0c7a92'
+down_revision: Union[str, None] = '6ecd1cae3879'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_jobs",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("priority", sa.Integer(), nullable=False),
+        sa.Column("request", sa.Text(), nullable=False),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("worker_id", sa.String(), nullable=True),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_chat_jobs_user_id", "chat_jobs", ["user_id"])
+    op.create_index("ix_chat_jobs_expires_at", "chat_jobs", ["expires_at"])
+    op.create_index("ix_chat_jobs_claim", "chat_jobs", ["status", "priority", "created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chat_jobs_claim", table_name="chat_jobs")
+    op.drop_index("ix_chat_jobs_expires_at", table_name="chat_jobs")
+    op.drop_index("ix_chat_jobs_user_id", table_name="chat_jobs")
+    op.drop_table("chat_jobs")
@@ -0,0 +1,66 @@
+"""initial schema
+
+Revision ID: c81eea030e1a
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81eea030e1a'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases created before migrations were tracked already have these
+    # tables; only create what is missing so they can be stamped forward.
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("firebase_uid", sa.String(), nullable=False),
+            sa.Column("subscription_tier", sa.Enum("FREE", "PREMIUM", name="subscriptiontier"), nullable=False),
+            sa.Column("queries_today", sa.Integer(), nullable=False),
+            sa.Column("queries_reset_date", sa.DateTime(), nullable=False),
+            sa.Column("stripe_customer_id", sa.String(), nullable=True),
+            sa.Column("stripe_subscription_id", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+        op.create_index("ix_users_firebase_uid", "users", ["firebase_uid"], unique=True)
+
+    if "usage_logs" not in existing:
+        op.create_table(
+            "usage_logs",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("query_text", sa.Text(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(), nullable=False),
+            sa.Column("tokens_used", sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_usage_logs_id", table_name="usage_logs")
+    op.drop_table("usage_logs")
+    op.drop_index("ix_users_firebase_uid", table_name="users")
+    op.drop_index("ix_users_email", table_name="users")
+    op.drop_index("ix_users_id", table_name="users")
+    op.drop_table("users")
+    sa.Enum(name="subscriptiontier").drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,83 @@
+"""
+Shared test setup: placeholder API keys and a throwaway SQLite database.
+
+Run from cicero-backend with `python -m pytest`. The settings are read when
+app.config is first imported, so the environment is set before any app
+module is loaded.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+_DB_DIR = tempfile.mkdtemp(prefix="cicero-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/test.db"
+for _name in (
+    "GROQ_API_KEY", "GEMINI_API_KEY", "PINECONE_API_KEY", "COURTLISTENER_API_KEY",
+    "LEGISCAN_API_KEY", "CONGRESS_GOV_API_KEY", "STRIPE_SECRET_KEY", "STRIPE_WEBHOOK_SECRET",
+    "STRIPE_PREMIUM_PRICE_ID",
+):
+    os.environ.setdefault(_name, "test")
+
+from app.database import Base, SessionLocal, SubscriptionTier, User, engine  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on a fresh event loop"""
+    async def with_cleanup(coro):
+        try:
+            return await coro
+        finally:
+            # Pooled connections belong to this loop
+            await engine.dispose()
+
+    return lambda coro: asyncio.run(with_cleanup(coro))
+
+
+@pytest.fixture(autouse=True)
+def database(run):
+    """Empty tables for every test"""
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def drop():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+
+    run(create())
+    yield
+    run(drop())
+
+
+@pytest.fixture
+def make_user(run):
+    """Insert a user and return it"""
+    count = 0
+
+    def make(tier: SubscriptionTier = SubscriptionTier.FREE, queries_today: int = 0) -> User:
+        nonlocal count
+        count += 1
+
+        async def insert():
+            user = User(
+                email=f"user{count}@example.com",
+                firebase_uid=f"uid-{count}",
+                subscription_tier=tier,
+                queries_today=queries_today,
+            )
+            async with SessionLocal() as db:
+                db.add(user)
+                await db.commit()
+            return user
+
+        return run(insert())
+
+    return make
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.admission import (
+    AdmissionController, BUSY_DETAIL, PRIORITY_BACKGROUND, PRIORITY_FREE, PRIORITY_PREMIUM,
+)
+
+
+async def _hold(controller: AdmissionController, priority: int, release: asyncio.Event,
+                admitted: list, name: str, timeout: float = 5):
+    async with controller.slot(priority, timeout=timeout):
+        admitted.append(name)
+        await release.wait()
+
+
+async def _settle():
+    # Let waiters run until they block again
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_in_priority_order():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        first = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "running"))
+        await _settle()
+
+        waiters = [
+            asyncio.create_task(_hold(controller, priority, release, admitted, name))
+            for priority, name in [
+                (PRIORITY_BACKGROUND, "background"),
+                (PRIORITY_FREE, "free 1"),
+                (PRIORITY_PREMIUM, "premium"),
+                (PRIORITY_FREE, "free 2"),
+            ]
+        ]
+        await _settle()
+        assert admitted == ["running"]
+        assert controller._waiting == 4
+
+        # One slot: each admitted run releases the next as soon as it starts
+        release.set()
+        await asyncio.gather(first, *waiters)
+        return admitted, controller
+
+    admitted, controller = asyncio.run(scenario())
+    assert admitted == ["running", "premium", "free 1", "free 2", "background"]
+    assert controller._active == 0
+    assert controller._waiting == 0
+
+
+def test_full_queue_evicts_a_lower_priority_waiter():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=1)
+        release = asyncio.Event()
+        admitted = []
+        running = asyncio.create_task(_hold(controller, PRIORITY_PREMIUM, release, admitted, "running"))
+        await _settle()
+        free = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "free"))
+        await _settle()
+
+        premium = asyncio.create_task(_hold(controller, PRIORITY_PREMIUM, release, admitted, "premium"))
+        await _settle()
+        with pytest.raises(HTTPException) as evicted:
+            await free
+        assert evicted.value.status_code == 503
+
+        release.set()
+        await asyncio.gather(running, premium)
+        return admitted, controller
+
+    admitted, controller = asyncio.run(scenario())
+    assert admitted == ["running", "premium"]
+    assert controller._active == 0
+    assert controller._waiting == 0
+
+
+def test_full_queue_sheds_an_arrival_that_ranks_no_higher():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=1)
+        release = asyncio.Event()
+        admitted = []
+        running = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "running"))
+        await _settle()
+        queued = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "queued"))
+        await _settle()
+
+        with pytest.raises(HTTPException) as shed:
+            await _hold(controller, PRIORITY_FREE, release, admitted, "shed")
+        release.set()
+        await asyncio.gather(running, queued)
+        return shed.value, admitted
+
+    shed, admitted = asyncio.run(scenario())
+    assert shed.status_code == 503
+    assert shed.detail == BUSY_DETAIL
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert admitted == ["running", "queued"]
+
+
+def test_queue_timeout_sheds_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        running = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "running"))
+        await _settle()
+
+        with pytest.raises(HTTPException) as shed:
+            await _hold(controller, PRIORITY_FREE, release, admitted, "late", timeout=0.01)
+        waiting_after = controller._waiting
+        release.set()
+        await running
+        return shed.value, waiting_after, controller
+
+    shed, waiting_after, controller = asyncio.run(scenario())
+    assert shed.status_code == 503
+    assert "Retry-After" in shed.headers
+    assert waiting_after == 0
+    assert controller._active == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        running = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "running"))
+        await _settle()
+        cancelled = asyncio.create_task(_hold(controller, PRIORITY_PREMIUM, release, admitted, "cancelled"))
+        later = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "later"))
+        await _settle()
+
+        cancelled.cancel()
+        await _settle()
+        assert controller._waiting == 1
+
+        release.set()
+        await asyncio.gather(running, later)
+        assert cancelled.cancelled()
+
+        # Both slots' worth of capacity is back: a new run is admitted straight away
+        async with controller.slot(PRIORITY_FREE, timeout=0.01):
+            admitted.append("after")
+        return admitted, controller
+
+    admitted, controller = asyncio.run(scenario())
+    assert admitted == ["running", "later", "after"]
+    assert controller._active == 0
+    assert controller._waiting == 0
+
+
+def test_waiter_cancelled_as_it_is_granted_hands_the_slot_on():
+    async def scenario():
+        controller = AdmissionController(max_active=1, max_queue=10)
+        release = asyncio.Event()
+        admitted = []
+        await controller._acquire(PRIORITY_FREE, timeout=1)
+        granted = asyncio.create_task(_hold(controller, PRIORITY_PREMIUM, release, admitted, "granted"))
+        later = asyncio.create_task(_hold(controller, PRIORITY_FREE, release, admitted, "later"))
+        await _settle()
+
+        # Grant the slot to `granted` and cancel it before it gets to run
+        controller._release()
+        granted.cancel()
+        release.set()
+        await asyncio.gather(granted, later, return_exceptions=True)
+        return admitted, controller, granted
+
+    admitted, controller, granted = asyncio.run(scenario())
+    # On Python 3.11 wait_for can let the grant win over the cancel; either way nothing leaks
+    assert admitted == (["later"] if granted.cancelled() else ["granted", "later"])
+    assert controller._active == 0
+    assert controller._waiting == 0
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.auth import FREE_DAILY_QUERY_LIMIT, release_query, reserve_query
+from app.database import SessionLocal, SubscriptionTier, User
+
+
+async def _reserve(user: User, count: int = 1) -> bool:
+    async with SessionLocal() as db:
+        return await reserve_query(user, db, count)
+
+
+async def _release(user: User, count: int = 1):
+    async with SessionLocal() as db:
+        await release_query(user, db, count)
+
+
+async def _queries_today(user: User) -> int:
+    async with SessionLocal() as db:
+        return (await db.get(User, user.id)).queries_today
+
+
+async def _reset_yesterday(user: User, queries_today: int):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(User).where(User.id == user.id).values(
+                queries_today=queries_today, queries_reset_date=datetime.utcnow() - timedelta(days=1)
+            )
+        )
+        await db.commit()
+
+
+def test_free_user_stops_at_the_daily_limit(run, make_user):
+    user = make_user()
+    for taken in range(1, FREE_DAILY_QUERY_LIMIT + 1):
+        assert run(_reserve(user)) is True
+        assert user.queries_today == taken
+    assert run(_reserve(user)) is False
+    assert run(_queries_today(user)) == FREE_DAILY_QUERY_LIMIT
+
+
+def test_premium_user_has_no_limit(run, make_user):
+    user = make_user(tier=SubscriptionTier.PREMIUM, queries_today=FREE_DAILY_QUERY_LIMIT)
+    assert run(_reserve(user, count=10)) is True
+    assert run(_queries_today(user)) == FREE_DAILY_QUERY_LIMIT + 10
+
+
+def test_batch_reservation_is_all_or_nothing(run, make_user):
+    user = make_user(queries_today=FREE_DAILY_QUERY_LIMIT - 2)
+    assert run(_reserve(user, count=3)) is False
+    assert run(_queries_today(user)) == FREE_DAILY_QUERY_LIMIT - 2
+    assert run(_reserve(user, count=2)) is True
+
+
+def test_new_day_resets_the_count(run, make_user):
+    user = make_user()
+    run(_reset_yesterday(user, FREE_DAILY_QUERY_LIMIT))
+    assert run(_reserve(user, count=2)) is True
+    assert run(_queries_today(user)) == 2
+
+
+def test_concurrent_reservations_cannot_pass_the_limit(run, make_user):
+    user = make_user(queries_today=FREE_DAILY_QUERY_LIMIT - 1)
+
+    async def race():
+        return await asyncio.gather(*(_reserve(user) for _ in range(5)))
+
+    assert sum(run(race())) == 1
+    assert run(_queries_today(user)) == FREE_DAILY_QUERY_LIMIT
+
+
+def test_release_refunds_a_reservation(run, make_user):
+    user = make_user()
+    run(_reserve(user, count=2))
+    run(_release(user))
+    assert run(_queries_today(user)) == 1
+    run(_release(user, count=5))
+    # More than is left to refund: ignored rather than going negative
+    assert run(_queries_today(user)) == 1
+
+
+def test_release_after_the_daily_reset_refunds_nothing(run, make_user):
+    user = make_user()
+    run(_reset_yesterday(user, 3))
+    run(_release(user))
+    assert run(_queries_today(user)) == 3
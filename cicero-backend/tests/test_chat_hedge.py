@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app import chat
+from app.admission import PRIORITY_FREE
+from app.models import ChatRequest
+
+CASE_LAW = "Smith v. Jones (2019): recording police in public is protected."
+GRAPH_ANSWER = "Yes, you may record the police in public places."
+
+
+class _Fake:
+    """A stand-in coroutine that returns `result` after `delay`, noting whether it was cancelled"""
+
+    def __init__(self, result, delay: float = 0):
+        self.result = result
+        self.delay = delay
+        self.started = False
+        self.cancelled = False
+
+    async def __call__(self, *args, **kwargs):
+        self.started = True
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self.result
+
+
+@pytest.fixture
+def race(monkeypatch):
+    """Patch the graph and the hedged search with fakes; hedges start after 10ms"""
+    async def no_citations(*texts):
+        return []
+
+    monkeypatch.setattr(chat, "hedge_delay", lambda priority: 0.01)
+    monkeypatch.setattr(chat, "cited_sources", no_citations)
+
+    def patch(graph: _Fake, hedge: _Fake):
+        monkeypatch.setattr(chat, "_run_graph", graph)
+        monkeypatch.setattr(chat, "_direct_case_search", hedge)
+
+    return patch
+
+
+def _ask(**kwargs):
+    return chat.answer_chat(ChatRequest(message="Can I record the police?"), PRIORITY_FREE, **kwargs)
+
+
+def test_hedge_wins_and_the_graph_is_cancelled(race):
+    graph = _Fake({"messages": [AIMessage(content=GRAPH_ANSWER)]}, delay=5)
+    hedge = _Fake(CASE_LAW, delay=0.01)
+    race(graph, hedge)
+
+    response, answered = asyncio.run(_ask(deadline_seconds=10))
+
+    assert answered
+    assert response.response == CASE_LAW
+    assert graph.cancelled
+    assert not hedge.cancelled
+
+
+def test_graph_wins_and_the_hedge_is_cancelled(race):
+    graph = _Fake({"messages": [AIMessage(content=GRAPH_ANSWER)]}, delay=0.05)
+    hedge = _Fake(CASE_LAW, delay=5)
+    race(graph, hedge)
+
+    response, answered = asyncio.run(_ask(deadline_seconds=10))
+
+    assert answered
+    assert response.response == GRAPH_ANSWER
+    assert hedge.started
+    assert hedge.cancelled
+    assert not graph.cancelled
+
+
+def test_hedge_result_answers_when_the_graph_gives_up(race):
+    # The graph ran out of time or hit its recursion limit before the search finished
+    graph = _Fake(None, delay=0.05)
+    hedge = _Fake(CASE_LAW, delay=0.1)
+    race(graph, hedge)
+
+    response, answered = asyncio.run(_ask(deadline_seconds=10))
+
+    assert answered
+    assert response.response == CASE_LAW
+    assert not hedge.cancelled
+
+
+def test_unusable_hedge_does_not_beat_the_graph(race):
+    graph = _Fake({"messages": [AIMessage(content=GRAPH_ANSWER)]}, delay=0.05)
+    hedge = _Fake("No relevant case law found for that question.", delay=0.01)
+    race(graph, hedge)
+
+    response, answered = asyncio.run(_ask(deadline_seconds=10))
+
+    assert response.response == GRAPH_ANSWER
+    assert not graph.cancelled
+
+
+def test_no_hedge_when_the_graph_answers_in_time(race):
+    graph = _Fake({"messages": [AIMessage(content=GRAPH_ANSWER)]})
+    hedge = _Fake(CASE_LAW)
+    race(graph, hedge)
+
+    response, _ = asyncio.run(_ask(deadline_seconds=10))
+
+    assert response.response == GRAPH_ANSWER
+    assert not hedge.started
+
+
+def test_caller_cancellation_cancels_both(race):
+    graph = _Fake({"messages": [AIMessage(content=GRAPH_ANSWER)]}, delay=5)
+    hedge = _Fake(CASE_LAW, delay=5)
+    race(graph, hedge)
+
+    async def scenario():
+        task = asyncio.create_task(_ask(deadline_seconds=10))
+        # Long enough for the hedge to start
+        await asyncio.sleep(0.05)
+        assert hedge.started
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Let the cancelled tasks unwind
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert graph.cancelled
+    assert hedge.cancelled
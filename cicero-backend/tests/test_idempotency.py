@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.idempotency import IdempotencyKeyReused, IdempotentRuns, chat_runs, request_key
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    # A fresh store per test, so answers don't carry over between tests
+    fresh = IdempotentRuns(max_size=100)
+    monkeypatch.setattr(chat_runs, "_running", fresh._running)
+    monkeypatch.setattr(chat_runs, "_done", fresh._done)
+    return chat_runs
+
+
+def test_request_key_prefers_the_header():
+    key, fingerprint, _ = request_key(7, "abc", '{"message": "hi"}')
+    assert key == "7:key:abc"
+    auto_key, auto_fingerprint, _ = request_key(7, None, '{"message": "hi"}')
+    assert auto_key == f"7:auto:{fingerprint}"
+    assert auto_fingerprint == fingerprint
+    assert request_key(8, None, '{"message": "hi"}')[0] != auto_key
+
+
+def test_concurrent_duplicates_share_one_run(runs):
+    calls = 0
+
+    async def answer():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "answer", True
+
+    async def submit():
+        return await asyncio.gather(*(runs.run("1:key:a", "fp", 60, answer) for _ in range(3)))
+
+    results = asyncio.run(submit())
+    assert calls == 1
+    assert [result for result, _ in results] == ["answer"] * 3
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+
+
+def test_stored_answer_is_replayed(runs):
+    async def answer():
+        return "answer", True
+
+    async def submit_twice():
+        first = await runs.run("1:key:a", "fp", 60, answer)
+        second = await runs.run("1:key:a", "fp", 60, answer)
+        return first, second
+
+    assert asyncio.run(submit_twice()) == (("answer", False), ("answer", True))
+
+
+def test_unkept_and_failed_runs_are_not_stored(runs):
+    outcomes = iter([("no answer", False), RuntimeError("boom"), ("answer", True)])
+
+    async def answer():
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def submit():
+        results = [await runs.run("1:key:a", "fp", 60, answer)]
+        with pytest.raises(RuntimeError):
+            await runs.run("1:key:a", "fp", 60, answer)
+        results.append(await runs.run("1:key:a", "fp", 60, answer))
+        return results
+
+    assert asyncio.run(submit()) == [("no answer", False), ("answer", False)]
+
+
+def test_key_reused_for_another_request(runs):
+    async def answer():
+        return "answer", True
+
+    async def submit():
+        await runs.run("1:key:a", "fp", 60, answer)
+        await runs.run("1:key:a", "other", 60, answer)
+
+    with pytest.raises(IdempotencyKeyReused):
+        asyncio.run(submit())
+
+
+def test_run_survives_the_caller_going_away(runs):
+    finished = []
+
+    async def answer():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+        return "answer", True
+
+    async def submit_and_retry():
+        caller = asyncio.create_task(runs.run("1:key:a", "fp", 60, answer))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        # The retry attaches to the run the first caller started
+        return await runs.run("1:key:a", "fp", 60, answer)
+
+    assert asyncio.run(submit_and_retry()) == ("answer", True)
+    assert finished == [True]
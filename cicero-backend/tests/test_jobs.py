@@ -0,0 +1,211 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from app import jobs
+from app.config import settings
+from app.database import ChatJob, SessionLocal, User
+from app.models import ChatRequest, ChatResponse
+
+
+async def _queries_today(user_id: int) -> int:
+    async with SessionLocal() as db:
+        return (await db.get(User, user_id)).queries_today
+
+
+async def _set_attempts(job_id: str, attempts: int):
+    async with SessionLocal() as db:
+        await db.execute(update(ChatJob).where(ChatJob.id == job_id).values(attempts=attempts))
+        await db.commit()
+
+
+def _enqueue(run, user, priority=1):
+    return run(jobs.enqueue(user, ChatRequest(message="Can I record the police?"), priority))
+
+
+def test_claim_leases_the_next_job(run, make_user):
+    user = make_user()
+    first = _enqueue(run, user, priority=1)
+    urgent = _enqueue(run, user, priority=0)
+
+    claimed = run(jobs._claim())
+    assert claimed.id == urgent.id
+    assert claimed.status == jobs.RUNNING
+    assert claimed.attempts == 1
+
+    stored = run(jobs.get_job(urgent.id, user.id))
+    assert stored.worker_id == jobs.WORKER_ID
+    assert stored.locked_until > datetime.utcnow()
+
+    assert run(jobs._claim()).id == first.id
+    assert run(jobs._claim()) is None
+
+
+def test_claim_takes_over_an_expired_lease(run, make_user):
+    user = make_user()
+    job = _enqueue(run, user)
+    run(jobs._claim())
+
+    async def expire_lease():
+        async with SessionLocal() as db:
+            await db.execute(
+                update(ChatJob).where(ChatJob.id == job.id)
+                .values(locked_until=datetime.utcnow() - timedelta(seconds=1))
+            )
+            await db.commit()
+
+    run(expire_lease())
+    reclaimed = run(jobs._claim())
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+
+
+def test_claim_skips_jobs_out_of_attempts(run, make_user):
+    user = make_user()
+    job = _enqueue(run, user)
+    run(_set_attempts(job.id, settings.CHAT_JOB_MAX_ATTEMPTS))
+    assert run(jobs._claim()) is None
+
+
+def test_finish_stores_the_answer(run, make_user):
+    user = make_user()
+    _enqueue(run, user)
+    job = run(jobs._claim())
+
+    assert run(jobs._finish(job, result=ChatResponse(response="Yes, in public."))) is True
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.SUCCEEDED
+    assert jobs.to_response(stored).result.response == "Yes, in public."
+    assert stored.expires_at > datetime.utcnow()
+    # Already finished: a second outcome is not recorded
+    assert run(jobs._finish(job, error="late")) is False
+
+
+def test_finish_requeues(run, make_user):
+    user = make_user()
+    _enqueue(run, user)
+    job = run(jobs._claim())
+
+    assert run(jobs._finish(job, requeue=True)) is True
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.QUEUED
+    assert stored.worker_id is None
+    assert run(jobs._claim()).id == job.id
+
+
+def _cancel_run(run, job, monkeypatch):
+    started = asyncio.Event()
+
+    async def never_answers(*args, **kwargs):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(jobs, "answer_chat", never_answers)
+
+    async def cancel():
+        task = asyncio.create_task(jobs._run_job(job))
+        await started.wait()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    run(cancel())
+
+
+def test_cancelled_job_goes_back_on_the_queue(run, make_user, monkeypatch):
+    user = make_user(queries_today=1)
+    _enqueue(run, user)
+    job = run(jobs._claim())
+
+    _cancel_run(run, job, monkeypatch)
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.QUEUED
+    assert run(_queries_today(user.id)) == 1
+
+
+def test_cancelled_job_does_not_use_up_an_attempt(run, make_user, monkeypatch):
+    user = make_user(queries_today=1)
+    queued = _enqueue(run, user)
+    run(_set_attempts(queued.id, settings.CHAT_JOB_MAX_ATTEMPTS - 1))
+    job = run(jobs._claim())
+    assert job.attempts == settings.CHAT_JOB_MAX_ATTEMPTS
+
+    _cancel_run(run, job, monkeypatch)
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.QUEUED
+    assert stored.attempts == settings.CHAT_JOB_MAX_ATTEMPTS - 1
+    assert run(jobs._claim()).id == job.id
+
+
+def _shed_run(run, job, monkeypatch, retry_after: str):
+    async def overloaded(*args, **kwargs):
+        raise HTTPException(status_code=503, detail="busy", headers={"Retry-After": retry_after})
+
+    monkeypatch.setattr(jobs, "answer_chat", overloaded)
+    run(jobs._run_job(job))
+
+
+def test_shed_job_waits_before_it_is_claimed_again(run, make_user, monkeypatch):
+    user = make_user(queries_today=1)
+    _enqueue(run, user)
+    job = run(jobs._claim())
+
+    _shed_run(run, job, monkeypatch, retry_after="30")
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.QUEUED
+    assert stored.attempts == 0
+    assert stored.locked_until > datetime.utcnow() + timedelta(seconds=25)
+    assert run(jobs._claim()) is None
+
+    async def claim_later():
+        with patch.object(jobs, "datetime", wraps=datetime) as clock:
+            clock.utcnow.return_value = datetime.utcnow() + timedelta(seconds=31)
+            return await jobs._claim()
+
+    assert run(claim_later()).id == job.id
+
+
+def test_shed_job_never_runs_out_of_attempts(run, make_user, monkeypatch):
+    user = make_user(queries_today=1)
+    _enqueue(run, user)
+    for _ in range(settings.CHAT_JOB_MAX_ATTEMPTS + 1):
+        job = run(jobs._claim())
+        _shed_run(run, job, monkeypatch, retry_after="0")
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.QUEUED
+    assert run(_queries_today(user.id)) == 1
+
+
+def test_purge_fails_queued_jobs_out_of_attempts(run, make_user):
+    user = make_user(queries_today=1)
+    job = _enqueue(run, user)
+    run(_set_attempts(job.id, settings.CHAT_JOB_MAX_ATTEMPTS))
+
+    run(jobs.purge_expired())
+    stored = run(jobs.get_job(job.id, user.id))
+    assert stored.status == jobs.FAILED
+    assert stored.expires_at is not None
+    assert run(_queries_today(user.id)) == 0
+
+
+def test_purge_fails_jobs_queued_too_long(run, make_user):
+    user = make_user(queries_today=1)
+    job = _enqueue(run, user)
+
+    async def age():
+        async with SessionLocal() as db:
+            await db.execute(
+                update(ChatJob).where(ChatJob.id == job.id)
+                .values(created_at=datetime.utcnow() - timedelta(seconds=settings.CHAT_JOB_MAX_QUEUE_SECONDS + 1))
+            )
+            await db.commit()
+
+    run(age())
+    run(jobs.purge_expired())
+    assert run(jobs.get_job(job.id, user.id)).status == jobs.FAILED
+    assert run(_queries_today(user.id)) == 0
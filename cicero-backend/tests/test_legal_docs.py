@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app import legal_docs
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def _vary_tokens(response) -> list:
+    return [token.strip().lower() for value in response.headers.get_list("vary") for token in value.split(",")]
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip", "br", "identity"])
+def test_vary_accept_encoding_is_sent_once(client, accept_encoding):
+    response = client.get("/legal/privacy", headers={"Accept-Encoding": accept_encoding})
+    assert response.status_code == 200
+    assert _vary_tokens(response).count("accept-encoding") == 1
+
+    revalidated = client.get(
+        "/legal/privacy",
+        headers={"Accept-Encoding": accept_encoding, "If-None-Match": response.headers["etag"]},
+    )
+    assert revalidated.status_code == 304
+    assert _vary_tokens(revalidated).count("accept-encoding") == 1
+
+
+def test_small_documents_still_vary(client, monkeypatch):
+    monkeypatch.setitem(legal_docs._documents, "terms", legal_docs.LegalDocument("Short."))
+    response = client.get("/legal/terms", headers={"Accept-Encoding": "identity"})
+    assert _vary_tokens(response).count("accept-encoding") == 1
+
+
+def test_brotli_variant_has_its_own_etag(client):
+    brotli_response = client.get("/legal/privacy", headers={"Accept-Encoding": "br"})
+    assert brotli_response.headers["content-encoding"] == "br"
+    identity_response = client.get("/legal/privacy", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity_response.headers
+
+    assert brotli_response.json() == identity_response.json()
+    assert brotli_response.headers["etag"].endswith('-br"')
+    assert brotli_response.headers["etag"] != identity_response.headers["etag"]
+
+    revalidated = client.get(
+        "/legal/privacy", headers={"Accept-Encoding": "br", "If-None-Match": brotli_response.headers["etag"]}
+    )
+    assert revalidated.status_code == 304
+
+
+def test_brotli_is_preferred_over_gzip(client):
+    response = client.get("/legal/terms", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
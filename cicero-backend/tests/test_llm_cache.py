@@ -0,0 +1,80 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from app import llm_cache
+from app.llm_cache import LLMCache
+
+PROMPT = '[{"role": "user", "content": "Can I record the police?"}]'
+LLM_STRING = "groq llama temperature=0"
+
+
+def _answer(text: str = "Yes, in public.") -> list:
+    return [ChatGeneration(message=AIMessage(content=text, id="run-1"))]
+
+
+def test_miss_then_hit():
+    cache = LLMCache(max_entries=10, ttl=60)
+    assert cache.lookup(PROMPT, LLM_STRING) is None
+    cache.update(PROMPT, LLM_STRING, _answer())
+
+    hit = cache.lookup(PROMPT, LLM_STRING)
+    assert hit[0].message.content == "Yes, in public."
+    # A replayed message must not reuse the original's ID
+    assert hit[0].message.id is None
+
+
+def test_model_and_tools_are_part_of_the_key():
+    cache = LLMCache(max_entries=10, ttl=60)
+    cache.update(PROMPT, LLM_STRING, _answer())
+    assert cache.lookup(PROMPT, LLM_STRING + " tools=[search_case_law]") is None
+    assert cache.lookup(PROMPT + " ", LLM_STRING) is None
+
+
+def test_hits_are_independent_copies():
+    cache = LLMCache(max_entries=10, ttl=60)
+    cache.update(PROMPT, LLM_STRING, _answer())
+    cache.lookup(PROMPT, LLM_STRING)[0].message.content = "changed"
+    assert cache.lookup(PROMPT, LLM_STRING)[0].message.content == "Yes, in public."
+
+
+def test_bypass_skips_lookups_but_stores_answers():
+    cache = LLMCache(max_entries=10, ttl=60)
+    cache.update(PROMPT, LLM_STRING, _answer("old"))
+    with llm_cache.bypass():
+        assert cache.lookup(PROMPT, LLM_STRING) is None
+        cache.update(PROMPT, LLM_STRING, _answer("fresh"))
+    assert cache.lookup(PROMPT, LLM_STRING)[0].message.content == "fresh"
+
+
+def test_expired_entries_miss():
+    cache = LLMCache(max_entries=10, ttl=-1)
+    cache.update(PROMPT, LLM_STRING, _answer())
+    assert cache.lookup(PROMPT, LLM_STRING) is None
+
+
+def test_sqlite_tier_is_shared_and_survives_restarts(tmp_path):
+    path = tmp_path / "llm_cache.sqlite3"
+    first = LLMCache(max_entries=10, ttl=60, sqlite_path=path, sqlite_max_entries=100)
+    asyncio.run(first.aupdate(PROMPT, LLM_STRING, _answer()))
+
+    second = LLMCache(max_entries=10, ttl=60, sqlite_path=path, sqlite_max_entries=100)
+    hit = asyncio.run(second.alookup(PROMPT, LLM_STRING))
+    assert hit[0].message.content == "Yes, in public."
+    # Now in the second cache's memory tier too
+    second._sqlite.clear()
+    assert second.lookup(PROMPT, LLM_STRING) is not None
+
+
+def test_sqlite_tier_trims_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(clock))
+    tier = llm_cache.SQLiteTier(tmp_path / "llm_cache.sqlite3", max_entries=2)
+    for index in range(3):
+        tier.set(f"key{index}", "value", expires_at=4102444800)
+    tier.get("key0")
+    tier._prune(0)
+    assert tier.get("key0") is not None
+    assert tier.get("key1") is None
+    assert tier.get("key2") is not None
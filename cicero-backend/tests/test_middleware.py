@@ -0,0 +1,68 @@
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from starlette.responses import JSONResponse, StreamingResponse
+
+from app.middleware import RateLimitHeadersMiddleware, RateLimitMiddleware, SecurityHeadersMiddleware
+from app.rate_limit import limiter
+
+
+def _client(test_limiter: Limiter) -> TestClient:
+    app = FastAPI()
+    app.state.limiter = test_limiter
+    app.add_middleware(RateLimitMiddleware)
+    app.add_middleware(RateLimitHeadersMiddleware, limiter=test_limiter)
+    app.add_middleware(SecurityHeadersMiddleware)
+
+    @app.exception_handler(RateLimitExceeded)
+    async def rate_limited(request: Request, exc: RateLimitExceeded):
+        return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"})
+
+    @app.get("/limited")
+    @test_limiter.limit("2/hour")
+    async def limited(request: Request, response: Response):
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for index in range(5):
+                yield f"chunk {index}\n"
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    return TestClient(app)
+
+
+def test_app_limiter_sends_no_rate_limit_headers():
+    # Same as before the headers middleware: the API has never advertised its limits
+    assert not limiter._headers_enabled
+    client = _client(Limiter(key_func=get_remote_address))
+    responses = [client.get("/limited") for _ in range(3)]
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    for response in responses:
+        assert "X-RateLimit-Limit" not in response.headers
+        assert "Retry-After" not in response.headers
+        assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_rate_limit_headers_when_enabled():
+    client = _client(Limiter(key_func=get_remote_address, headers_enabled=True))
+    first = client.get("/limited")
+    assert first.headers["X-RateLimit-Limit"] == "2"
+    assert first.headers["X-RateLimit-Remaining"] == "1"
+    client.get("/limited")
+    rejected = client.get("/limited")
+    assert rejected.status_code == 429
+    assert rejected.headers["X-RateLimit-Remaining"] == "0"
+    assert int(rejected.headers["Retry-After"]) > 0
+
+
+def test_streamed_response_on_an_undecorated_route_arrives_intact():
+    client = _client(Limiter(key_func=get_remote_address))
+    response = client.get("/stream")
+    assert response.status_code == 200
+    assert response.text == "".join(f"chunk {index}\n" for index in range(5))
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
@@ -0,0 +1,91 @@
+import pytest
+
+from app.rate_limit import SharedWindowStorage
+
+HOUR = 3600
+
+
+class CountingBackend:
+    """Wraps a real backend and records what each sync writes and reads"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.writes = []
+        self.reads = []
+
+    def sync(self, deltas):
+        self.writes.append(dict(deltas))
+        return self.backend.sync(deltas)
+
+    def read(self, keys):
+        self.reads.append(list(keys))
+        return self.backend.read(keys)
+
+    def clear(self, prefix):
+        self.backend.clear(prefix)
+
+
+@pytest.fixture
+def make_storage():
+    def make(refresh_interval: float = 10.0) -> SharedWindowStorage:
+        # A sync interval this long keeps the background thread out of the way; tests sync by hand
+        storage = SharedWindowStorage(sync_interval=HOUR, sync_batch=1000, refresh_interval=refresh_interval)
+        storage.backend = CountingBackend(storage.backend)
+        return storage
+
+    return make
+
+
+def test_hits_are_counted_locally_until_synced(make_storage):
+    storage = make_storage()
+    assert storage.incr("chat/1", HOUR) == 1
+    assert storage.incr("chat/1", HOUR) == 2
+    assert storage.get("chat/1") == 2
+    assert storage.backend.writes == []
+
+    storage._sync_once()
+    assert [list(deltas.values())[0][0] for deltas in storage.backend.writes] == [2]
+    assert storage.get("chat/1") == 2
+
+
+def test_workers_see_each_others_hits(make_storage):
+    first, second = make_storage(), make_storage()
+    first.incr("chat/1", HOUR, amount=3)
+    first._sync_once()
+
+    second.incr("chat/1", HOUR)
+    second._sync_once()
+    assert second.get("chat/1") == 4
+
+
+def test_idle_keys_are_not_written(make_storage):
+    storage = make_storage()
+    storage.incr("chat/1", HOUR)
+    storage._sync_once()
+    storage._sync_once()
+    storage._sync_once()
+    assert len(storage.backend.writes) == 1
+    assert storage.backend.reads == []
+
+
+def test_idle_keys_are_refreshed_after_the_refresh_interval(make_storage):
+    idle, busy = make_storage(refresh_interval=0), make_storage()
+    idle.incr("chat/1", HOUR)
+    idle._sync_once()
+
+    busy.incr("chat/1", HOUR, amount=5)
+    busy._sync_once()
+
+    idle._sync_once()
+    assert len(idle.backend.writes) == 1
+    assert len(idle.backend.reads) == 1
+    assert idle.get("chat/1") == 6
+
+
+def test_clear_forgets_the_key(make_storage):
+    storage = make_storage()
+    storage.incr("chat/1", HOUR, amount=2)
+    storage._sync_once()
+    storage.clear("chat/1")
+    assert storage.get("chat/1") == 0
+    assert storage.backend.read([k for k in storage.backend.writes[0]]) == {}
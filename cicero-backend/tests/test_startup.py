@@ -0,0 +1,37 @@
+from app import rag, startup
+from app.startup import import_time_report
+
+# Loaded on first use (or by warm-up), never by importing the app
+LAZY_PACKAGES = {"langgraph", "stripe", "firebase_admin"}
+
+
+def test_startup_does_not_import_heavy_clients():
+    rows = import_time_report("main")
+    imported = {name.strip().split(".")[0] for name, _, _ in rows}
+    assert "main" in imported
+    assert imported & LAZY_PACKAGES == set()
+
+
+def test_failed_startup_is_logged_and_stops_the_process(run, monkeypatch, caplog):
+    def broken():
+        raise RuntimeError("bad client config")
+
+    stopped = []
+    monkeypatch.setattr(startup, "_build_clients", broken)
+    monkeypatch.setattr(startup, "_stop_process", lambda: stopped.append(True))
+    monkeypatch.setattr(startup, "_ready", False)
+
+    run(startup.initialize())
+    assert stopped == [True]
+    assert not startup.is_ready()
+    failure = [record for record in caplog.records if record.message == "Startup failed; stopping the process"]
+    assert failure and "bad client config" in str(failure[0].exc_info[1])
+
+
+def test_broken_document_index_starts_without_document_search(tmp_path, monkeypatch, caplog):
+    (tmp_path / "chunks.json").write_text("not json")
+    monkeypatch.setattr(rag, "_store", rag.LocalVectorStore(tmp_path))
+    assert rag.get_vector_store().exists()
+
+    startup._load_document_index()
+    assert any(record.message.startswith("Could not load the document index") for record in caplog.records)
@@ -0,0 +1,76 @@
+import asyncio
+
+from app import warmer
+from app.metrics import metrics
+from app.tools.legal_search import count_upstream_calls, record_upstream_request
+
+POPULAR = {
+    "CA": [("can i record the police", 9), ("is jaywalking legal", 4)],
+    "NY": [("can my landlord enter", 7), ("how long to return a deposit", 3)],
+}
+
+
+def _patch_popular(monkeypatch):
+    async def popular_queries():
+        return POPULAR
+
+    monkeypatch.setattr(warmer, "popular_queries", popular_queries)
+
+
+def test_budget_counts_only_the_warmers_own_calls(monkeypatch):
+    _patch_popular(monkeypatch)
+
+    async def search():
+        await asyncio.sleep(0.01)
+        record_upstream_request()
+
+    async def warm_one(state, text):
+        record_upstream_request()
+        # A task started while warming (e.g. the agent's tool calls) counts too
+        await asyncio.create_task(search())
+
+    monkeypatch.setattr(warmer, "_warm_one", warm_one)
+
+    async def user_traffic(stop: asyncio.Event):
+        while not stop.is_set():
+            record_upstream_request()
+            await asyncio.sleep(0)
+
+    async def scenario():
+        stop = asyncio.Event()
+        users = asyncio.create_task(user_traffic(stop))
+        before = metrics.counter("upstream.requests")
+        report = await warmer.warm_cache(budget=5)
+        stop.set()
+        await users
+        return report, metrics.counter("upstream.requests") - before
+
+    report, total = asyncio.run(scenario())
+    # Two calls per question: the third question takes the run past its budget of five
+    assert report["questions"] == 3
+    assert report["upstream_calls"] == 6
+    assert total > report["upstream_calls"]
+
+
+def test_failed_questions_still_count_against_the_budget(monkeypatch):
+    _patch_popular(monkeypatch)
+
+    async def warm_one(state, text):
+        record_upstream_request()
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(warmer, "_warm_one", warm_one)
+
+    report = asyncio.run(warmer.warm_cache(budget=2))
+    assert report["questions"] == 0
+    assert report["upstream_calls"] == 2
+
+
+def test_count_upstream_calls_is_scoped_to_the_block():
+    with count_upstream_calls() as outer:
+        record_upstream_request()
+        with count_upstream_calls() as inner:
+            record_upstream_request()
+        record_upstream_request()
+    record_upstream_request()
+    assert (outer.count, inner.count) == (2, 1)
@@ -0,0 +1,130 @@
+"""
+Concurrency benchmark: the old single-threaded server vs server.py.
+
+Starts each server on a free local port, opens one deliberately slow client
+that connects and then sends nothing (like a stalled mobile connection), and
+has CLIENTS threads fetch the page and its assets over keep-alive for
+SECONDS. The old TCPServer is stuck on the idle connection until its read
+times out; the threaded server keeps serving everyone else. Usage:
+
+    python bench_server.py [clients] [seconds]
+"""
+import gzip
+import http.client
+import http.server
+import socket
+import socketserver
+import statistics
+import sys
+import threading
+import time
+from functools import partial
+
+import server
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+PATHS = ["/", "/app.js", "/styles.css", "/favicon.png"]
+STALL_SECONDS = 2.0  # How long the slow client holds its connection open
+
+
+class LegacyHandler(http.server.SimpleHTTPRequestHandler):
+    """The previous server.py handler, kept here for comparison"""
+
+    timeout = STALL_SECONDS * 2  # Without one, the stalled client would block it for good
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_legacy():
+    handler = partial(LegacyHandler, directory=str(server.WEB_DIR))
+    httpd = socketserver.TCPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def start_threaded():
+    httpd = server.make_server("127.0.0.1", 0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def stall(port):
+    """Connect and send nothing, as a slow client would"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    time.sleep(STALL_SECONDS)
+    sock.close()
+
+
+def client(port, deadline, latencies, sizes, headers):
+    conn = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            if conn is not None:
+                conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(body))
+    if conn is not None:
+        conn.close()
+
+
+def run(name, httpd):
+    port = httpd.server_address[1]
+    headers = {"Accept-Encoding": "gzip, br"}
+    # Let the stalled connection get in first, as it would under real traffic
+    staller = threading.Thread(target=stall, args=(port,), daemon=True)
+    staller.start()
+    time.sleep(0.1)
+
+    latencies, sizes = [], []
+    deadline = time.perf_counter() + SECONDS
+    threads = [
+        threading.Thread(target=client, args=(port, deadline, latencies, sizes, headers))
+        for _ in range(CLIENTS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    httpd.shutdown()
+    httpd.server_close()
+
+    latencies.sort()
+    count = len(latencies)
+    p99 = latencies[min(count - 1, int(count * 0.99))] * 1000 if count else float("nan")
+    print(
+        f"{name:<22} {count / SECONDS:9.0f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000 if count else float('nan'):7.2f} ms  "
+        f"p99 {p99:8.2f} ms  max {latencies[-1] * 1000 if count else float('nan'):8.2f} ms  "
+        f"avg body {sum(sizes) / max(count, 1):7.0f} B"
+    )
+
+
+if __name__ == "__main__":
+    files = [(server.WEB_DIR / (p.lstrip("/") or "index.html")).read_bytes() for p in PATHS]
+    page = sum(len(data) for data in files)
+    gzipped = sum(len(gzip.compress(data)) for data in files)
+    print(f"{CLIENTS} clients for {SECONDS:.0f}s, one stalled connection for {STALL_SECONDS:.0f}s; "
+          f"page + assets: {page} B raw, ~{gzipped} B gzipped\n")
+    run("TCPServer (old)", start_legacy())
+    threaded = start_threaded()
+    try:
+        run("ThreadingHTTPServer", threaded)
+    finally:
+        threaded.store.close()
@@ -1,18 +1,253 @@
 #!/usr/bin/env python3
 """
-Simple HTTP server for the Cicero web app.
-Run this script to serve the web app locally.
+HTTP server for the Cicero web app.
+Run this script to serve the web app locally or in production:
+
+    python server.py [--port 3000] [--host 0.0.0.0] [--no-browser]
+
+- One thread per connection (ThreadingHTTPServer), with HTTP/1.1 keep-alive,
+  so a slow client never blocks anyone else.
+- Strong ETags and Last-Modified, answering If-None-Match and
+  If-Modified-Since with 304.
+- index.html references app.js and styles.css by content hash
+  (app.js?v=<hash>). Those fingerprinted URLs are cached for a year
+  (immutable); index.html and plain URLs are revalidated every time.
+- gzip (and brotli, if the `brotli` package is installed) variants of the text
+  assets are built once at startup, and again when a file changes.
+- Files go out with sendfile (zero-copy) where the OS supports it.
 """
 
+import argparse
+import errno
+import gzip
+import hashlib
 import http.server
-import socketserver
-import webbrowser
+import mimetypes
+import re
+import shutil
 import sys
+import tempfile
+import threading
+import webbrowser
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 PORT = 3000
+WEB_DIR = Path(__file__).resolve().parent
+
+# Served files: everything in WEB_DIR except these
+EXCLUDED = {"server.py", "bench_server.py", "README.md", "requirements.txt"}
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/javascript", "application/javascript",
+                      "application/json", "image/svg+xml", "text/plain"}
+MIN_COMPRESS_SIZE = 512
+
+# Assets index.html refers to by fingerprinted URL
+FINGERPRINTED = ("app.js", "styles.css", "favicon.png")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class Asset:
+    """One servable file: its metadata plus the paths of its identity/gzip/br variants"""
+
+    def __init__(self, name, sources, path, data, content_type, mtime):
+        self.name = name
+        # Files on disk this asset was built from, watched for changes
+        self.sources = {source: _stat_key(source) for source in sources}
+        self.content_type = content_type
+        self.mtime = mtime
+        self.last_modified = formatdate(int(mtime), usegmt=True)
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        # encoding -> (path, size, etag)
+        self.variants = {"identity": (path, len(data), f'"{self.digest}"')}
+
+    def add_variant(self, encoding, path):
+        self.variants[encoding] = (path, path.stat().st_size, f'"{self.digest}-{encoding}"')
+
+
+def _stat_key(path):
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+class AssetStore:
+    """All servable files, precompressed into a private temp directory at startup"""
+
+    def __init__(self, root):
+        self.root = root
+        self.work_dir = Path(tempfile.mkdtemp(prefix="cicero-web-"))
+        self._lock = threading.Lock()
+        self.assets = {}
+        self.build()
+
+    def build(self):
+        assets = {}
+        for source in sorted(self.root.iterdir()):
+            if source.is_file() and source.name not in EXCLUDED and not source.name.startswith("."):
+                assets[source.name] = self._build_asset(source.name, [source], source)
+
+        # index.html with fingerprinted asset URLs, written next to the variants
+        index = self.root / "index.html"
+        if index.is_file():
+            html = index.read_text(encoding="utf-8")
+            for name in FINGERPRINTED:
+                if name in assets:
+                    html = re.sub(
+                        r'((?:src|href)=")' + re.escape(name) + r'(")',
+                        rf"\g<1>{name}?v={assets[name].digest}\g<2>",
+                        html,
+                    )
+            # Named by content, so a rebuild never rewrites a file another thread is sending
+            rendered = self.work_dir / f"index.{hashlib.sha256(html.encode()).hexdigest()[:16]}.html"
+            rendered.write_text(html, encoding="utf-8")
+            # The rendered page also changes when a fingerprinted asset does
+            mtime = max([index.stat().st_mtime] + [assets[n].mtime for n in FINGERPRINTED if n in assets])
+            sources = [index] + [self.root / n for n in FINGERPRINTED if n in assets]
+            assets["index.html"] = self._build_asset("index.html", sources, rendered, mtime)
+        self.assets = assets
+
+    def _build_asset(self, name, sources, path, mtime=None):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        data = path.read_bytes()
+        mtime = path.stat().st_mtime if mtime is None else mtime
+        asset = Asset(name, sources, path, data, content_type, mtime)
+        if content_type in COMPRESSIBLE_TYPES and len(data) >= MIN_COMPRESS_SIZE:
+            gz_path = self.work_dir / f"{name}.{asset.digest}.gz"
+            # mtime=0 keeps the bytes (and so the ETag) identical across restarts
+            gz_path.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+            asset.add_variant("gzip", gz_path)
+            if brotli is not None:
+                br_path = self.work_dir / f"{name}.{asset.digest}.br"
+                br_path.write_bytes(brotli.compress(data, quality=11))
+                asset.add_variant("br", br_path)
+        return asset
+
+    def get(self, name):
+        """The asset for `name`, rebuilding everything first if its file changed on disk"""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        try:
+            changed = any(_stat_key(source) != stat for source, stat in asset.sources.items())
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            with self._lock:
+                if self.assets.get(name) is asset:
+                    self.build()
+            asset = self.assets.get(name)
+        return asset
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def _accepted_encodings(header):
+    """Encodings the client accepts (q > 0) from an Accept-Encoding header"""
+    accepted = set()
+    for part in header.split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        q = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+class CiceroRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive: every response has a Content-Length
+    # Headers and the sendfile body go out as separate writes; without TCP_NODELAY
+    # Nagle holds the body back for the client's delayed ACK (~40 ms per request)
+    disable_nagle_algorithm = True
+    server_version = "CiceroWeb"
+    store = None  # Set by make_server
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _serve(self, send_body):
+        path, _, query = self.path.partition("?")
+        name = path.lstrip("/") or "index.html"
+        asset = self.store.get(name) if "/" not in name else None
+        if asset is None:
+            self._send_error(404, "Not Found")
+            return
+
+        accepted = _accepted_encodings(self.headers.get("Accept-Encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in asset.variants and e in accepted), "identity")
+        file_path, size, etag = asset.variants[encoding]
+
+        if self._not_modified(asset, etag):
+            self.send_response(304)
+            self._send_cache_headers(asset, etag, query)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(size))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self._send_cache_headers(asset, etag, query)
+        self.end_headers()
+        if send_body:
+            with open(file_path, "rb") as f:
+                # socket.sendfile uses os.sendfile where available and falls back to send()
+                self.connection.sendfile(f)
+
+    def _send_cache_headers(self, asset, etag, query):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", asset.last_modified)
+        if len(asset.variants) > 1:
+            self.send_header("Vary", "Accept-Encoding")
+        # Immutable only for the URL index.html actually references: ?v=<current hash>
+        fingerprinted = asset.name in FINGERPRINTED and query == f"v={asset.digest}"
+        self.send_header("Cache-Control", IMMUTABLE if fingerprinted else REVALIDATE)
+
+    def _not_modified(self, asset, etag):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-None-Match wins over If-Modified-Since (RFC 9110)
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(asset.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_error(self, code, message):
+        body = message.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         # Add CORS headers for development
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -24,40 +259,59 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         # Suppress default logging
         pass
 
+
+class CiceroHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True  # Don't let idle keep-alive connections hold up shutdown
+    request_queue_size = 128
+
+
+def make_server(host="", port=PORT, root=WEB_DIR):
+    """A ready-to-run server (call serve_forever(); server.store.close() when done)"""
+    store = AssetStore(Path(root))
+    handler = type("Handler", (CiceroRequestHandler,), {"store": store})
+    server = CiceroHTTPServer((host, port), handler)
+    server.store = store
+    return server
+
+
 def main():
-    import os
-    # Change to the script's directory
-    script_dir = Path(__file__).parent
-    os.chdir(script_dir)
-    
-    handler = MyHTTPRequestHandler
-    
+    parser = argparse.ArgumentParser(description="Serve the Cicero web app")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--host", default="", help="Interface to bind (default: all)")
+    parser.add_argument("--no-browser", action="store_true", help="Don't open a browser window")
+    args = parser.parse_args()
+
     try:
-        with socketserver.TCPServer(("", PORT), handler) as httpd:
-            print(f"🚀 Cicero Web App server running at http://localhost:{PORT}")
-            print(f"📁 Serving from: {script_dir}")
-            print(f"🌐 Open http://localhost:{PORT} in your browser")
-            print("Press Ctrl+C to stop the server\n")
-            
-            # Try to open browser automatically
-            try:
-                webbrowser.open(f'http://localhost:{PORT}')
-            except:
-                pass
-            
-            httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\n\n👋 Server stopped")
-        sys.exit(0)
+        httpd = make_server(args.host, args.port)
     except OSError as e:
-        if e.errno == 48:  # Address already in use
-            print(f"❌ Port {PORT} is already in use. Try a different port:")
-            print(f"   python server.py --port {PORT + 1}")
+        if e.errno == errno.EADDRINUSE:
+            print(f"❌ Port {args.port} is already in use. Try a different port:")
+            print(f"   python server.py --port {args.port + 1}")
         else:
             print(f"❌ Error starting server: {e}")
         sys.exit(1)
 
+    with httpd:
+        encodings = "gzip, br" if brotli is not None else "gzip"
+        print(f"🚀 Cicero Web App server running at http://localhost:{args.port}")
+        print(f"📁 Serving from: {WEB_DIR} ({len(httpd.store.assets)} files, precompressed: {encodings})")
+        print(f"🌐 Open http://localhost:{args.port} in your browser")
+        print("Press Ctrl+C to stop the server\n")
+
+        # Try to open browser automatically
+        if not args.no_browser:
+            try:
+                webbrowser.open(f'http://localhost:{args.port}')
+            except Exception:
+                pass
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\n\n👋 Server stopped")
+        finally:
+            httpd.store.close()
+
+
 if __name__ == "__main__":
-    import os
     main()
-
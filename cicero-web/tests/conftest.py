@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# server.py is a standalone script next to this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
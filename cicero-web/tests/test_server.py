@@ -0,0 +1,47 @@
+import gzip
+import http.client
+import threading
+
+import brotli
+import pytest
+
+import server
+
+
+@pytest.fixture
+def web():
+    httpd = server.make_server("127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    httpd.store.close()
+
+
+def _get(httpd, path, **headers):
+    conn = http.client.HTTPConnection("127.0.0.1", httpd.server_address[1])
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response, body
+
+
+def test_brotli_variant_has_its_own_etag(web):
+    plain, plain_body = _get(web, "/app.js", **{"Accept-Encoding": "identity"})
+    compressed, compressed_body = _get(web, "/app.js", **{"Accept-Encoding": "br"})
+
+    assert compressed.getheader("Content-Encoding") == "br"
+    assert brotli.decompress(compressed_body) == plain_body
+    assert compressed.getheader("ETag").endswith('-br"')
+    assert compressed.getheader("ETag") != plain.getheader("ETag")
+
+    revalidated, _ = _get(web, "/app.js", **{"Accept-Encoding": "br", "If-None-Match": compressed.getheader("ETag")})
+    assert revalidated.status == 304
+
+
+def test_gzip_variant_for_clients_without_brotli(web):
+    response, body = _get(web, "/app.js", **{"Accept-Encoding": "gzip"})
+    assert response.getheader("Content-Encoding") == "gzip"
+    assert gzip.decompress(body) == (server.WEB_DIR / "app.js").read_bytes()